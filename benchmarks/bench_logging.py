@@ -0,0 +1,78 @@
+"""
+Benchmark of per-chunk logging cost on the stream path.
+
+Measures the time spent in the calling thread for one DEBUG log call per streamed chunk:
+
+* legacy - the previous configuration: five synchronous file sinks with diagnose=True
+           and an eagerly formatted f-string of the whole chunk object;
+* info   - the default setup_logger(): the sink is registered at INFO, so the DEBUG call
+           returns before loguru builds or formats the record;
+* debug  - setup_logger() with DEBUG opted in (--debug or RAGENT_COPILOT_LOG_LEVEL=DEBUG):
+           the record is still built and formatted on the calling thread, only the file
+           writes move to the background thread.
+
+Usage (from the repository root):
+    python benchmarks/bench_logging.py [--chunks 5000]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# logger_config 在导入时会在当前目录下创建 log 文件夹，先切换到临时目录
+_workdir = tempfile.mkdtemp(prefix="ragent-bench-logging-")
+os.chdir(_workdir)
+
+from loguru import logger  # noqa: E402
+from utils.chat.cache import make_chunk  # noqa: E402
+from utils.log.logger_config import setup_logger  # noqa: E402
+
+
+def setup_legacy_logger(folder: str):
+    logger.remove()
+    format_ = '<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> ' \
+              '| <magenta>{process}</magenta>:<yellow>{thread}</yellow> ' \
+              '| <cyan>{name}</cyan>:<cyan>{function}</cyan>:<yellow>{line}</yellow> - <level>{message}</level>'
+    for level in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+        logger.add(os.path.join(folder, f"ragent-copilot-{level.lower()}.log"), level=level, backtrace=True,
+                   diagnose=True, format=format_, colorize=False, rotation="10 MB", retention="30 days",
+                   encoding="utf-8", filter=lambda record, level=level: record["level"].no >= logger.level(level).no)
+
+
+def time_per_call(func, chunks) -> float:
+    start = time.perf_counter()
+    for chunk in chunks:
+        func(chunk)
+    return (time.perf_counter() - start) / len(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000, help="number of streamed chunks to log")
+    args = parser.parse_args()
+
+    chunks = [make_chunk("token ", "qwen2:1.5b") for _ in range(args.chunks)]
+
+    setup_legacy_logger(os.path.join(_workdir, "legacy"))
+    legacy = time_per_call(lambda chunk: logger.debug(f"Generated chunk: {chunk}"), chunks)
+
+    def log_chunk(chunk):
+        logger.opt(lazy=True).debug("Generated chunk: {}", lambda: chunk.choices[0].delta.content)
+
+    results = [("legacy", legacy)]
+    for level in ("INFO", "DEBUG"):
+        logger.remove()
+        setup_logger(os.path.join(_workdir, level.lower()), level)
+        results.append((level.lower(), time_per_call(log_chunk, chunks)))
+        logger.complete()
+
+    print(f"{'configuration':>13} | {'cost per chunk (us)':>20}")
+    for name, cost in results:
+        print(f"{name:>13} | {cost * 1e6:>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark for the prompt layout against a server with prefix caching.
+
+Runs the same request sequences with the legacy templates (user text in the middle, a cue such as
+"Summary:" after it, the tone named before the text) and with the compiled templates in
+utils.chat.prompts, against the fake server with `prefill_per_token` set so that time-to-first-token
+depends on how much of each prompt is not shared with the previous one. Two workloads:
+
+  same_task     one task (Summarize) on a series of different texts
+  tone_rewrite  every tone rewrite of the same text in a row, as in the result window
+
+Also reports the cost of looking up and filling a template.
+
+Usage (from the repository root):
+    python benchmarks/bench_prompt_layout.py [--texts 8] [--prefill-per-token 0.001]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+sys.path.insert(0, BENCH_DIR)
+
+# 日志和缓存写在当前目录下，切换到临时目录以免污染仓库
+os.chdir(tempfile.mkdtemp(prefix="ragent-bench-"))
+
+from fake_server import FakeOpenAIServer, FakeServerConfig  # noqa: E402
+from run_benchmarks import consume_chunks, make_llm  # noqa: E402
+from utils.chat.prompts import EDITOR_NAMES, LANGUAGE, prompt_registry  # noqa: E402
+
+LEGACY_SUMMARIZE = "Summarize the text below in {language}:\n\n{text}\n\nSummary:"
+LEGACY_EDITOR = "Rewrite the text below in a {tone} tone in {language}:\n\n{text}\n\nRewritten Text:"
+
+WORDS = (
+    "the model server caches the prompt prefix so that repeated requests only prefill what changed while "
+    "the user waits for the first token of a summary email rewrite explanation keyword list translation"
+).split()
+
+
+def make_text(seed: int, words: int) -> str:
+    rng = random.Random(seed)
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < words:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20)))
+        sentences.append(sentence.capitalize() + ".")
+    return " ".join(sentences)
+
+
+def legacy_prompts(workload: str, texts: List[str]) -> List[str]:
+    if workload == "same_task":
+        return [LEGACY_SUMMARIZE.format(text=text, language=LANGUAGE) for text in texts]
+    return [
+        LEGACY_EDITOR.format(text=text, tone=editor.lower(), language=LANGUAGE)
+        for text in texts for editor in EDITOR_NAMES
+    ]
+
+
+def registry_prompts(workload: str, texts: List[str]) -> List[str]:
+    if workload == "same_task":
+        return [prompt_registry.get("Summarize").render(text) for text in texts]
+    return [prompt_registry.get(editor).render(text) for text in texts for editor in EDITOR_NAMES]
+
+
+def run_layout(server: FakeOpenAIServer, prompts: List[str]) -> Dict[str, float]:
+    llm = make_llm(server.base_url, stream=True)
+    # 每种布局从空缓存开始，第一个请求总是完整预填充
+    server._cached_prompt = ""
+    server.prefilled_tokens = server.cached_tokens = 0
+    ttfts = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        ttfts.append(consume_chunks(llm.generate(prompt), start)["ttft"] * 1000)
+    total = server.prefilled_tokens + server.cached_tokens
+    return {
+        "ttft_mean_ms": round(statistics.mean(ttfts), 2),
+        "ttft_p50_ms": round(statistics.median(ttfts), 2),
+        "prefilled_tokens": server.prefilled_tokens,
+        "prefix_hit_ratio": round(server.cached_tokens / total, 3) if total else 0.0,
+    }
+
+
+def time_call(func: Callable[[], object], repeat: int) -> float:
+    """单次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def legacy_editor_lookup(task: str, text: str) -> str:
+    # 原来每次编辑都重建提示词列表并线性查找
+    editor_prompts = [
+        {"editor": editor, "prompt": LEGACY_EDITOR.replace("{tone}", editor.lower())} for editor in EDITOR_NAMES
+    ]
+    editor_prompt = next((item for item in editor_prompts if item["editor"] == task), None)
+    return editor_prompt["prompt"].format(text=text, language=LANGUAGE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=8, help="number of different input texts")
+    parser.add_argument("--words", type=int, default=300, help="words per input text")
+    parser.add_argument("--ttft", type=float, default=0.02)
+    parser.add_argument("--prefill-per-token", type=float, default=0.001)
+    parser.add_argument("--output-tokens", type=int, default=8)
+    args = parser.parse_args()
+
+    config = FakeServerConfig(
+        ttft=args.ttft, token_delay=0.001, output_tokens=args.output_tokens, prefill_per_token=args.prefill_per_token
+    )
+    server = FakeOpenAIServer(config).start()
+    texts = [make_text(seed, args.words) for seed in range(args.texts)]
+    print(f"{args.texts} texts of {args.words} words, prefill {args.prefill_per_token * 1000:.2f} ms/token\n")
+    try:
+        for workload in ("same_task", "tone_rewrite"):
+            for layout, build in (("legacy", legacy_prompts), ("registry", registry_prompts)):
+                result = run_layout(server, build(workload, texts))
+                print(f"{workload:<13} {layout:<9} " + "  ".join(f"{key}={value}" for key, value in result.items()))
+    finally:
+        server.stop()
+
+    text = texts[0]
+    legacy = time_call(lambda: legacy_editor_lookup("Simple", text), 20000)
+    compiled = time_call(lambda: prompt_registry.get("Simple").render(text), 20000)
+    print(f"\ntemplate lookup+fill: legacy {legacy:.2f} us, registry {compiled:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
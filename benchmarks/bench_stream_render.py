@@ -0,0 +1,156 @@
+"""
+Micro-benchmark for the streaming renderer.
+
+Compares the legacy per-chunk path (string concatenation on an attribute plus a forced widget update per
+chunk) with StreamRenderer, which joins everything queued since the last frame and applies it with a single
+insert, leaving the redraw to the event loop. The fake text box models what makes the legacy path slow in
+Tk: inserting is cheap, but every redraw re-wraps the logical line that changed (wrap=WORD), so a redraw
+costs more as the streamed paragraph grows. The legacy path pays one redraw per chunk, StreamRenderer one
+per frame.
+
+Reported per frame: draining the queue, applying the text and redrawing.
+
+Usage (from the repository root):
+    python benchmarks/bench_stream_render.py [--chunks 4000] [--chunks-per-frame 8]
+"""
+import os
+import sys
+import time
+import queue
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from utils.chat.streaming import StreamRenderer, TextBuffer  # noqa: E402
+
+
+class FakeTextBox:
+    """
+    Stand-in for CTkTextbox. A redraw re-wraps the current logical line, as a Tk text widget does, so its
+    cost grows with the output; update() redraws immediately, otherwise the event loop redraws once when
+    it goes idle (idle_redraw).
+    """
+
+    WRAP_CHARS = 80
+
+    def __init__(self):
+        self.parts = []
+        self.line = []
+        self.display_lines = []
+        self.dirty = False
+        self.redraws = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def insert(self, index, content):
+        self.parts.append(content)
+        _, newline, tail = content.rpartition("\n")
+        if newline:
+            self.line = [tail]
+        else:
+            self.line.append(content)
+        self.dirty = True
+
+    def delete(self, start, end):
+        self.parts, self.line, self.dirty = [], [], True
+
+    def see(self, index):
+        pass
+
+    def update(self):
+        self.idle_redraw()
+
+    def idle_redraw(self):
+        if not self.dirty:
+            return
+        line = "".join(self.line)
+        self.line = [line]
+        self.display_lines = [line[i:i + self.WRAP_CHARS] for i in range(0, len(line), self.WRAP_CHARS)]
+        self.dirty = False
+        self.redraws += 1
+
+
+class FakeReader:
+    """Feeds a fixed number of chunks per frame, like a StreamReader whose queue filled up during 16 ms."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.finished = False
+
+    def drain(self):
+        contents = []
+        try:
+            while True:
+                contents.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return contents
+
+
+class LegacyState:
+    def __init__(self):
+        self.temp_generated_text = ""
+
+
+def legacy_frame(state, text_box, chunks: "queue.Queue[str]"):
+    # 原来的轮询：每取出一个片段就写入控件并强制刷新
+    while not chunks.empty():
+        content = chunks.get_nowait()
+        text_box.configure(state="normal")
+        state.temp_generated_text += content
+        text_box.insert("end", content)
+        text_box.see("end")
+        text_box.update()
+        text_box.configure(state="disabled")
+    text_box.idle_redraw()
+
+
+def batched_frame(renderer: StreamRenderer):
+    renderer.flush()
+    renderer.text_box.idle_redraw()
+
+
+def run(total_chunks: int, chunks_per_frame: int, chunk: str):
+    checkpoints = {total_chunks * i // 4 for i in range(1, 5)}
+    results = {"legacy": {}, "batched": {}}
+    redraws = {}
+
+    state, legacy_box, legacy_queue = LegacyState(), FakeTextBox(), queue.Queue()
+    reader, batched_box = FakeReader(), FakeTextBox()
+    renderer = StreamRenderer(batched_box, reader, TextBuffer())
+    for name, box, enqueue, frame in (
+        ("legacy", legacy_box, legacy_queue.put, lambda: legacy_frame(state, legacy_box, legacy_queue)),
+        ("batched", batched_box, reader.queue.put, lambda: batched_frame(renderer)),
+    ):
+        timings = []
+        for produced in range(chunks_per_frame, total_chunks + 1, chunks_per_frame):
+            for _ in range(chunks_per_frame):
+                enqueue(chunk)
+            start = time.perf_counter()
+            frame()
+            timings.append(time.perf_counter() - start)
+            if produced in checkpoints:
+                results[name][produced] = statistics.mean(timings[-32:])
+        redraws[name] = box.redraws / len(timings)
+    return results, redraws
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=4000, help="total streamed chunks")
+    parser.add_argument("--chunks-per-frame", type=int, default=8, help="chunks queued per 16 ms frame")
+    parser.add_argument("--chunk", default="token ", help="text of each chunk")
+    args = parser.parse_args()
+
+    results, redraws = run(args.chunks, args.chunks_per_frame, args.chunk)
+    print(f"{'chunks so far':>14} | {'legacy frame (us)':>18} | {'batched frame (us)':>19} | {'speedup':>8}")
+    for produced in sorted(results["batched"]):
+        legacy, batched = results["legacy"][produced], results["batched"][produced]
+        print(f"{produced:>14} | {legacy * 1e6:>18.2f} | {batched * 1e6:>19.2f} | {legacy / batched:>7.1f}x")
+    print(f"\nredraws per frame: legacy {redraws['legacy']:.1f}, batched {redraws['batched']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark for per-task generation profiles.
+
+Runs every task prompt through LLM.generate with and without its GenerationProfile against the fake
+server, which plays a model that answers and then keeps rambling until max_tokens: a short keyword
+list followed by an explanation. Without a profile every task decodes the full `max_tokens` from the
+settings; with one, max_tokens scales with the input, the stop sequences apply, and the keyword list
+ends as soon as it is complete.
+
+Usage (from the repository root):
+    python benchmarks/bench_task_profiles.py [--words 300] [--token-delay 0.002]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+sys.path.insert(0, BENCH_DIR)
+
+# 导入 bench_prompt_layout 和 run_benchmarks 时会切换到临时目录，日志和缓存不会写进仓库
+from bench_prompt_layout import make_text  # noqa: E402
+from fake_server import FakeOpenAIServer, FakeServerConfig  # noqa: E402
+from run_benchmarks import make_llm  # noqa: E402
+from utils.chat.prompts import EDITOR_NAMES, TASK_NAMES, prompt_registry  # noqa: E402
+
+REPLY = (
+    "Keywords:\n\n- prefix cache\n- first token\n- prefill\n\n"
+    "These keywords were picked because they describe the main topics of the text, and the text keeps "
+    "coming back to them in almost every sentence. "
+)
+
+
+def run(llm, prompt: str, profile, iterations: int):
+    latencies, chars = [], 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        output = "".join(chunk.choices[0].delta.content or "" for chunk in llm.generate(prompt, profile=profile) if chunk.choices)
+        latencies.append(time.perf_counter() - start)
+        chars = len(output)
+    return statistics.median(latencies) * 1000, chars
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=300, help="words in the input text")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--max-tokens", type=int, default=2048, help="max_tokens from the settings")
+    args = parser.parse_args()
+
+    config = FakeServerConfig(ttft=0.02, token_delay=args.token_delay, output_tokens=args.max_tokens, reply_text=REPLY)
+    server = FakeOpenAIServer(config).start()
+    llm = make_llm(server.base_url, stream=True)
+    llm.defult_config["params"]["max_tokens"] = args.max_tokens
+    text = make_text(0, args.words)
+    print(f"input of {args.words} words, settings max_tokens={args.max_tokens}, {args.token_delay * 1000:.1f} ms/token\n")
+    print(f"{'task':<18} {'default ms':>11} {'profile ms':>11} {'chars':>13}")
+    try:
+        for name in TASK_NAMES + EDITOR_NAMES[:1]:
+            template = prompt_registry.get(name)
+            prompt = template.build(text)[0]
+            default_ms, default_chars = run(llm, prompt, None, args.iterations)
+            profile_ms, profile_chars = run(llm, prompt, template.profile, args.iterations)
+            print(f"{name:<18} {default_ms:>11.1f} {profile_ms:>11.1f} {default_chars:>6} -> {profile_chars:<5}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
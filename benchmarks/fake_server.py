@@ -0,0 +1,255 @@
+"""
+Local stand-in for an OpenAI-compatible server (`POST /v1/chat/completions` and `GET /v1/models`).
+
+Supports streaming (SSE) and non-streaming responses, and tool calls: when the request carries
+`tools` and the last message is not a tool result, the server answers with a call to
+`tool_calculator`. Time-to-first-token, inter-token delay, chunk size and output length are
+configurable, so benchmarks get repeatable numbers without a live Ollama.
+
+With `prefill_per_token` set, time-to-first-token also grows with the prompt length, and the server
+keeps the last prompt like a single llama.cpp slot: only the part after the prefix it shares with the
+previous request is charged, which approximates server-side prefix caching.
+
+Usage (from the repository root):
+    python benchmarks/fake_server.py --port 8808 --ttft 0.2 --token-delay 0.01
+"""
+import os
+import re
+import json
+import time
+import socket
+import uuid
+import argparse
+import threading
+from dataclasses import dataclass, asdict
+from typing import List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class FakeServerConfig:
+    ttft: float = 0.05  # 收到请求到第一个 chunk 的时间（秒）
+    token_delay: float = 0.005  # 相邻 chunk 之间的间隔（秒）
+    chunk_size: int = 1  # 每个 chunk 包含的 token 数
+    output_tokens: int = 64  # 每次回复的 token 数
+    token_text: str = "lorem "
+    reply_text: str = ""  # 非空时按单词逐个输出这段文本，循环直到 output_tokens
+    tool_name: str = "tool_calculator"
+    tool_arguments: str = '{"expression": "(3+5)*8/2"}'
+    prefill_per_token: float = 0.0  # 每个未命中前缀缓存的提示词 token 的预填充时间（秒），0 表示不模拟
+    chars_per_token: int = 4
+
+
+class FakeOpenAIServer:
+    """Runs the fake server on a background thread."""
+
+    def __init__(self, config: FakeServerConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeServerConfig()
+        self.requests = 0
+        self.prefilled_tokens = 0
+        self.cached_tokens = 0
+        self._cached_prompt = ""
+        self._lock = threading.Lock()
+        handler = type("Handler", (_Handler,), {"server_state": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-openai", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def prefill_seconds(self, prompt: str) -> float:
+        """按与上一个提示词不同的部分计算预填充时间，并把这个提示词记为新的缓存"""
+        if self.config.prefill_per_token <= 0:
+            return 0.0
+        with self._lock:
+            cached = len(os.path.commonprefix([self._cached_prompt, prompt]))
+            self._cached_prompt = prompt
+            uncached_tokens = (len(prompt) - cached) // self.config.chars_per_token
+            self.prefilled_tokens += uncached_tokens
+            self.cached_tokens += cached // self.config.chars_per_token
+        return uncached_tokens * self.config.prefill_per_token
+
+
+def _reply_tokens(config: FakeServerConfig, count: int, stop=None) -> List[str]:
+    """回复的 token 列表，遇到停止序列时截断"""
+    if not config.reply_text:
+        return [config.token_text] * count
+    words = re.findall(r"\S+\s*", config.reply_text)
+    text = "".join(words[i % len(words)] for i in range(count))
+    if isinstance(stop, str):
+        stop = [stop]
+    for sequence in stop or []:
+        if sequence in text:
+            text = text[:text.index(sequence)]
+    return re.findall(r"\S+\s*", text)
+
+
+def _prompt_text(messages) -> str:
+    """模拟对话模板把消息拼接成模型实际看到的提示词"""
+    return "".join(f"<|{message.get('role')}|>{message.get('content') or ''}\n" for message in messages)
+
+
+def _completion_id() -> str:
+    return f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_state: FakeOpenAIServer = None
+
+    def setup(self):
+        super().setup()
+        # 关闭 Nagle 算法，避免小 chunk 被延迟发送而扭曲 TTFT
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # 健康检查使用的模型列表接口
+        if not self.path.rstrip("/").endswith("/models"):
+            self.send_error(404)
+            return
+        self._send_json({"object": "list", "data": [{"id": "fake-model", "object": "model", "created": 0, "owned_by": "fake"}]})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server_state.count_request()
+        config = self.server_state.config
+        messages = body.get("messages", [])
+        wants_tool = bool(body.get("tools")) and (not messages or messages[-1].get("role") != "tool")
+        model = body.get("model", "fake-model")
+        max_tokens = body.get("max_tokens") or config.output_tokens
+        tokens = _reply_tokens(config, min(config.output_tokens, max_tokens), body.get("stop"))
+
+        time.sleep(config.ttft + self.server_state.prefill_seconds(_prompt_text(messages)))
+        try:
+            if body.get("stream"):
+                self._stream(model, tokens, wants_tool, config)
+            else:
+                time.sleep(config.token_delay * max(0, len(tokens) - 1))
+                self._complete(model, tokens, wants_tool, config)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消了请求（例如对冲请求中落后的一路）
+            self.close_connection = True
+
+    def _send_json(self, payload) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _complete(self, model, tokens, wants_tool, config) -> None:
+        if wants_tool:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": "call_fake0001",
+                    "type": "function",
+                    "function": {"name": config.tool_name, "arguments": config.tool_arguments},
+                }],
+            }
+            finish_reason = "tool_calls"
+        else:
+            message = {"role": "assistant", "content": "".join(tokens)}
+            finish_reason = "stop"
+        self._send_json({
+            "id": _completion_id(),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+        })
+
+    def _stream(self, model, tokens, wants_tool, config) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        completion_id = _completion_id()
+
+        def send(delta, finish_reason=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+        if wants_tool:
+            # 把参数拆成两段发送，模拟真实服务逐步输出工具参数
+            arguments = config.tool_arguments
+            half = len(arguments) // 2
+            send({"role": "assistant", "tool_calls": [{
+                "index": 0, "id": "call_fake0001", "type": "function",
+                "function": {"name": config.tool_name, "arguments": arguments[:half]},
+            }]})
+            time.sleep(config.token_delay)
+            send({"tool_calls": [{"index": 0, "function": {"arguments": arguments[half:]}}]})
+            send({}, finish_reason="tool_calls")
+        else:
+            sent = 0
+            while sent < len(tokens):
+                count = min(config.chunk_size, len(tokens) - sent)
+                if sent:
+                    time.sleep(config.token_delay * count)
+                send({"role": "assistant", "content": "".join(tokens[sent:sent + count])})
+                sent += count
+            send({}, finish_reason="stop")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--ttft", type=float, default=FakeServerConfig.ttft)
+    parser.add_argument("--token-delay", type=float, default=FakeServerConfig.token_delay)
+    parser.add_argument("--chunk-size", type=int, default=FakeServerConfig.chunk_size)
+    parser.add_argument("--output-tokens", type=int, default=FakeServerConfig.output_tokens)
+    parser.add_argument("--prefill-per-token", type=float, default=FakeServerConfig.prefill_per_token)
+    args = parser.parse_args()
+
+    config = FakeServerConfig(
+        ttft=args.ttft, token_delay=args.token_delay, chunk_size=args.chunk_size, output_tokens=args.output_tokens,
+        prefill_per_token=args.prefill_per_token,
+    )
+    server = FakeOpenAIServer(config, args.host, args.port)
+    print(f"Fake OpenAI server listening on {server.base_url} with {asdict(config)}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
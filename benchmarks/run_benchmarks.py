@@ -0,0 +1,230 @@
+"""
+End-to-end benchmark suite against the local fake OpenAI-compatible server.
+
+Drives LLM.generate (streaming and blocking), create_tools_call_completion (streaming and
+blocking, with a tool call) and the stream-to-text path used by the result window
+(StreamReader drained once per frame). Reports p50/p95/p99 latency, time-to-first-token
+and chunks/s, and saves the results as JSON so runs can be compared between commits.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmarks.py [--iterations 20] [--ttft 0.05] [--token-delay 0.005]
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<old>.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from dataclasses import asdict
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+sys.path.insert(0, BENCH_DIR)
+
+# 缓存、日志和工具能力缓存都写在当前目录下，切换到临时目录以免污染仓库
+ORIGINAL_CWD = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="ragent-bench-"))
+
+from fake_server import FakeOpenAIServer, FakeServerConfig  # noqa: E402
+from utils.chat.llm import LLM  # noqa: E402
+from utils.chat.cache import ResponseCache  # noqa: E402
+from utils.chat.streaming import FRAME_INTERVAL_MS, StreamReader, TextBuffer  # noqa: E402
+from utils.tools.toolkits import TOOLS_LIST, TOOLS_MAP  # noqa: E402
+from utils.tools.tool_utils import create_tools_call_completion  # noqa: E402
+
+MODEL = "fake-model"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))]
+
+
+def summarize(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    """把每次迭代的测量结果汇总为百分位数（毫秒）和平均 chunks/s"""
+    result = {}
+    for field in ("latency", "ttft"):
+        values = [sample[field] * 1000 for sample in samples if sample.get(field) is not None]
+        if values:
+            for q in (0.5, 0.95, 0.99):
+                result[f"{field}_p{int(q * 100)}_ms"] = round(percentile(values, q), 3)
+    rates = [sample["chunks_per_s"] for sample in samples if sample.get("chunks_per_s")]
+    if rates:
+        result["chunks_per_s"] = round(sum(rates) / len(rates), 2)
+    return result
+
+
+def consume_chunks(stream, start: float) -> Dict[str, float]:
+    first, chunks = None, 0
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first is None:
+                first = time.perf_counter()
+            chunks += 1
+    end = time.perf_counter()
+    return {
+        "latency": end - start,
+        "ttft": (first - start) if first is not None else None,
+        "chunks_per_s": (chunks - 1) / (end - first) if first is not None and chunks > 1 and end > first else None,
+    }
+
+
+def make_llm(base_url: str, stream: bool) -> LLM:
+    config = {
+        "model": MODEL,
+        "api_key": "noneed",
+        "base_url": base_url,
+        "params": {"temperature": 0.3, "top_p": 0.5, "max_tokens": 2048, "stream": stream},
+    }
+    # 关闭响应缓存，每次迭代都真正请求服务端
+    return LLM(config_list=[config], cache=ResponseCache(path=None, max_memory_items=0))
+
+
+def bench_llm_stream(base_url: str) -> Callable[[int], Dict[str, float]]:
+    llm = make_llm(base_url, stream=True)
+
+    def run(i: int) -> Dict[str, float]:
+        start = time.perf_counter()
+        return consume_chunks(llm.generate(f"Summarize benchmark text #{i}"), start)
+    return run
+
+
+def bench_llm_blocking(base_url: str) -> Callable[[int], Dict[str, float]]:
+    llm = make_llm(base_url, stream=False)
+
+    def run(i: int) -> Dict[str, float]:
+        start = time.perf_counter()
+        llm.generate(f"Summarize benchmark text #{i}")
+        return {"latency": time.perf_counter() - start}
+    return run
+
+
+def bench_tools(base_url: str, stream: bool) -> Callable[[int], Dict[str, float]]:
+    def run(i: int) -> Dict[str, float]:
+        messages = [{"role": "user", "content": f"What is (3+5)*8/2? #{i}"}]
+        start = time.perf_counter()
+        response = create_tools_call_completion(
+            messages, TOOLS_LIST, TOOLS_MAP, model=MODEL, base_url=base_url, stream=stream
+        )
+        if stream:
+            return consume_chunks(response, start)
+        return {"latency": time.perf_counter() - start}
+    return run
+
+
+def bench_stream_to_text(base_url: str) -> Callable[[int], Dict[str, float]]:
+    llm = make_llm(base_url, stream=True)
+    frame = FRAME_INTERVAL_MS / 1000
+
+    def run(i: int) -> Dict[str, float]:
+        start = time.perf_counter()
+        reader = StreamReader(llm.generate(f"Summarize benchmark text #{i}")).start()
+        buffer, first, chunks = TextBuffer(), None, 0
+        # 与结果窗口相同：每帧取出队列中的全部内容
+        while True:
+            finished = reader.finished
+            pending = reader.drain()
+            if pending:
+                if first is None:
+                    first = time.perf_counter()
+                chunks += len(pending)
+                buffer.append("".join(pending))
+            if finished:
+                break
+            time.sleep(frame)
+        end = time.perf_counter()
+        return {
+            "latency": end - start,
+            "ttft": (first - start) if first is not None else None,
+            "chunks_per_s": chunks / (end - start) if chunks else None,
+        }
+    return run
+
+
+def run_scenario(name: str, run: Callable[[int], Dict[str, float]], iterations: int, warmup: int) -> Dict[str, float]:
+    for i in range(warmup):
+        run(-1 - i)
+    samples = [run(i) for i in range(iterations)]
+    summary = summarize(samples)
+    print(f"{name:<22} " + "  ".join(f"{key}={value}" for key, value in summary.items()))
+    return summary
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: Dict, baseline_path: str) -> None:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparison with {baseline.get('commit')} ({baseline_path}):")
+    for scenario, metrics in current["results"].items():
+        old_metrics = baseline.get("results", {}).get(scenario)
+        if not old_metrics:
+            continue
+        for key, value in metrics.items():
+            old = old_metrics.get(key)
+            if old:
+                print(f"  {scenario:<22} {key:<16} {old:>10} -> {value:>10} ({(value - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--ttft", type=float, default=FakeServerConfig.ttft)
+    parser.add_argument("--token-delay", type=float, default=FakeServerConfig.token_delay)
+    parser.add_argument("--chunk-size", type=int, default=FakeServerConfig.chunk_size)
+    parser.add_argument("--output-tokens", type=int, default=FakeServerConfig.output_tokens)
+    parser.add_argument("--output", help="result JSON path (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="baseline result JSON to compare against")
+    args = parser.parse_args()
+
+    config = FakeServerConfig(
+        ttft=args.ttft, token_delay=args.token_delay, chunk_size=args.chunk_size, output_tokens=args.output_tokens
+    )
+    server = FakeOpenAIServer(config).start()
+    base_url = server.base_url
+    scenarios = {
+        "llm_generate_stream": bench_llm_stream(base_url),
+        "llm_generate_blocking": bench_llm_blocking(base_url),
+        "tools_call_stream": bench_tools(base_url, stream=True),
+        "tools_call_blocking": bench_tools(base_url, stream=False),
+        "stream_to_text": bench_stream_to_text(base_url),
+    }
+    try:
+        results = {name: run_scenario(name, run, args.iterations, args.warmup) for name, run in scenarios.items()}
+    finally:
+        server.stop()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.time(),
+        "iterations": args.iterations,
+        "server_config": asdict(config),
+        "results": results,
+    }
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{commit}.json")
+    output = os.path.join(ORIGINAL_CWD, output)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        compare(report, os.path.join(ORIGINAL_CWD, args.compare))
+
+
+if __name__ == "__main__":
+    main()
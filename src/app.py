@@ -1,30 +1,69 @@
 import os
 import sys
+from utils.startup.profiler import startup_profiler
+
+# 需要在其他导入之前启用，才能统计到每个模块的导入耗时
+if "--profile-startup" in sys.argv:
+    startup_profiler.enable()
+
 import time
 import queue
 import json
 # import signal
-import pystray
 import tkinter as tk
-import keyboard
-import pyautogui
 import threading
 import customtkinter as ctk
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
+from functools import partial
 from tkinter import messagebox
-from pystray import MenuItem as item, Menu
-from plyer import notification
-from PIL import Image
-from typing import Generator, Union
+from typing import Callable, Generator, Optional, Tuple, Union
+from utils.startup.lazy_import import lazy_import, preload_modules
 from utils.chat.llm import LLM
+from utils.chat.scheduler import BACKGROUND, EDIT, RequestCancelled
+from utils.chat.warmup import WarmupScheduler
+from utils.metrics.metrics import RequestTrace, start_metrics_server
+from utils.tools.capabilities import tool_capability_cache
+from utils.chat.streaming import (
+    CancellationToken,
+    StreamReader,
+    StreamRenderer,
+    TextBuffer,
+    FRAME_INTERVAL_MS,
+    generation_stats,
+    iter_content,
+)
 from loguru import logger
-from utils.chat.prompts import get_task_prompts, get_editor_prompts
-from utils.log.logger_config import setup_logger
-# TODO：先使用环境变量控制语言
-from utils.chat.prompts import LANGUAGE
+from utils.chat.prompts import EDITOR_NAMES, TASK_NAMES, get_chunk_prompts, prompt_registry
+from utils.chat.speculative import SpeculativeRewrites
+from utils.chat.similarity import NearDuplicateIndex
+from utils.chat.cache import tee_stream
+from utils.chat.chunking import DEFAULT_CHUNK_TOKENS, map_reduce_stream, should_chunk, split_for_budget
+from utils.log.logger_config import setup_logger, clip
 
 import pyperclip
 
+# 以下模块只在窗口出现、托盘图标或快捷键线程中才会用到，延迟到首次使用时导入
+pystray = lazy_import("pystray")
+keyboard = lazy_import("keyboard")
+pyautogui = lazy_import("pyautogui")
+plyer = lazy_import("plyer")
+Image = lazy_import("PIL.Image")
+clients = lazy_import("utils.chat.clients")
+# 首次请求会用到的模块，在界面就绪后于后台线程预先导入
+PRELOAD_MODULES = ["openai", "utils.chat.clients", "utils.tools.tool_utils", "pyautogui"]
+
+
+def run_in_background(func: Callable, *args) -> None:
+    """
+    在守护线程中执行任务。并发数由 LLM 的请求调度器限制，这里不再使用固定大小的线程池，
+    否则排队中的后台请求会占满线程，使用户的请求连调度器都进不去。
+    """
+    threading.Thread(target=logger.catch(func), args=args, daemon=True).start()
+
+
+def speculative_queue_key(task: str) -> str:
+    return f"speculative:{task}"
+
 
 class CopilotApp:
     """
@@ -34,17 +73,36 @@ class CopilotApp:
 
     def __init__(self, root: ctk.CTk):
         self.llm = LLM()
-        self.prompts = get_task_prompts()
-        self.editor_prompts = get_editor_prompts()
+        self.warmup_scheduler = WarmupScheduler(self.llm)
+        self.prompts = prompt_registry
+        self.chunk_prompts = get_chunk_prompts()
+        self.speculative_rewrites = SpeculativeRewrites(self.speculative_rewrite)
+        # 最近的输入和结果，选区只有细微差别时先显示之前的结果
+        self.near_duplicates = NearDuplicateIndex()
         self.root = root
         self._initialize_root_window()
         self._create_layout()
         self._create_buttons()
-        self.executor = ThreadPoolExecutor(max_workers=5)
         self.drag_data = {"x": 0, "y": 0}  # Store the drag data
         self.border_color = "#363537"
         self.is_pinned = False
-        self.temp_generated_text = ""  # Temporary storage for generated text
+        self.generated_buffer = TextBuffer()  # Temporary storage for generated text
+        self.current_cancel_token = CancellationToken()  # Token of the latest main-task generation
+
+    def reload_settings(self):
+        """
+        Apply the saved settings to the model client and warm the (possibly new) model up.
+        """
+        self.llm.reload_settings()
+        self.warmup_scheduler.request_warmup()
+
+    @property
+    def temp_generated_text(self) -> str:
+        return self.generated_buffer.text
+
+    @temp_generated_text.setter
+    def temp_generated_text(self, text: str):
+        self.generated_buffer = TextBuffer(text)
 
     def _initialize_root_window(self):
         """
@@ -135,28 +193,113 @@ class CopilotApp:
         Handle button click events by triggering the corresponding task.
         """
         self.toggle_window()
-        self.executor.submit(self.handle_button_click, task_index)
+        # 新的请求会取代旧的请求，取消仍在进行的生成（已完成的生成不受影响）
+        self.current_cancel_token.cancel()
+        self.current_cancel_token = CancellationToken()
+        trace = RequestTrace(TASK_NAMES[task_index])
+        run_in_background(self.handle_button_click, task_index, self.current_cancel_token, trace)
         self.border_color = color
 
-    def handle_button_click(self, task_index):
+    def handle_button_click(self, task_index, cancel_token: CancellationToken, trace: RequestTrace):
         """
         Execute the task corresponding to the clicked button.
         """
-        prompt = self.prompts[task_index]["prompt"]
-        # 模仿用户点击Ctrl+C
-        pyautogui.hotkey('ctrl', 'c')
-        # 读取剪贴板内容作为用户输入
-        prompt = prompt.format(text=pyperclip.paste(), language=LANGUAGE)
-        logger.info(f"Prompt: {prompt}")
-        generated_text = self.llm.generate(prompt)
-        logger.info(f"Generated text: {generated_text}")
-        self.root.after(0, self.show_generated_text, generated_text)
+        trace.start()
+        task = TASK_NAMES[task_index]
+        with trace.stage("capture"):
+            # 模仿用户点击Ctrl+C
+            pyautogui.hotkey('ctrl', 'c')
+            # 读取剪贴板内容作为用户输入
+            clipboard_text = pyperclip.paste()
+        if cancel_token.cancelled:
+            logger.info("Generation cancelled before it was sent")
+            return
+        # 与之前的输入几乎相同时先显示之前的结果，新的结果生成后替换它
+        refresh = None
+        approximate = self.near_duplicates.lookup(task, clipboard_text, self.llm.similarity_threshold)
+        if approximate is not None:
+            refresh = Future()
+            self.root.after(
+                0, self.show_generated_text, approximate.result, cancel_token,
+                f"Approximate ({approximate.similarity:.0%} similar input), refreshing…", refresh,
+            )
+        try:
+            generated_text, notice = self.generate_task(task, clipboard_text, cancel_token, trace)
+        except BaseException as e:
+            if refresh is not None:
+                refresh.set_exception(e)
+            raise
+        if generated_text is None:
+            if refresh is not None:
+                refresh.set_result(None)
+            return
+        generated_text = self.record_result(task, clipboard_text, generated_text)
+        logger.opt(lazy=True).info("Generated text: {}", lambda: clip(generated_text))
+        if refresh is not None:
+            refresh.set_result((generated_text, notice))
+            return
+        self.root.after(0, self.show_generated_text, generated_text, cancel_token, notice)
 
-    def show_generated_text(self, text: Union[Generator, str]):
+    def generate_task(
+        self, task, text, cancel_token: CancellationToken, trace: RequestTrace
+    ) -> Tuple[Union[Generator, str, None], Optional[str]]:
+        """
+        Run task on text, in parts when it is too long. Returns the result (None if it was cancelled while
+        queued) and the notice for the result window, e.g. that the input was chunked or truncated.
+        """
+        # 在结果窗口中说明输入是否被分块或截断
+        notice = None
+        token_budget = self.llm.prompt_budget()
+        if should_chunk(task, text, self.chunk_prompts, token_budget):
+            # 长文本分块并行处理，再合并各块的结果
+            chunks = split_for_budget(text, min(DEFAULT_CHUNK_TOKENS, token_budget))
+            notice = f"Long input: processed in {len(chunks)} parts, then combined"
+            generated_text = map_reduce_stream(
+                self.llm, chunks, self.chunk_prompts[task],
+                cancel_token=cancel_token, trace=trace, token_budget=token_budget,
+            )
+        else:
+            template = self.prompts.get(task)
+            prompt, truncated = template.build(text, token_budget)
+            if truncated:
+                notice = f"Input truncated to fit the {self.llm.context_window}-token context window"
+                logger.warning(f"Input of {len(text)} chars truncated to fit the prompt budget of {token_budget} tokens")
+            logger.opt(lazy=True).info("Prompt: {}", lambda: clip(prompt))
+            try:
+                generated_text = self.llm.generate(prompt, cancel_token=cancel_token, trace=trace, profile=template.profile)
+            except RequestCancelled:
+                logger.info("Generation cancelled while waiting for a free slot")
+                return None, notice
+        return generated_text, notice
+
+    def record_result(self, task, text, generated_text: Union[Generator, str]) -> Union[Generator, str]:
+        """Add the result to the near-duplicate index once it is complete; a stream is passed through."""
+        if isinstance(generated_text, str):
+            self.near_duplicates.add(task, text, generated_text)
+            return generated_text
+        return tee_stream(generated_text, partial(self.near_duplicates.add, task, text))
+
+    def show_generated_text(
+        self,
+        text: Union[Generator, str],
+        cancel_token: CancellationToken,
+        notice: Optional[str] = None,
+        refresh: Optional[Future] = None,
+    ):
         """
         Display the generated text in a new, borderless window near the mouse cursor.
+        Destroying the window cancels the generation bound to it.
+        If given, the notice (e.g. that the input was truncated) is shown in the top bar.
+        With `refresh`, text is an approximate result that is replaced by the one the future resolves to.
         """
+        if cancel_token.cancelled:
+            logger.info("Generation was cancelled, not showing result window")
+            return
         new_window = tk.Toplevel(self.root)
+        # 窗口令牌在窗口销毁时取消，并连带取消该窗口中的所有生成
+        window_cancel_token = CancellationToken()
+        window_cancel_token.add_callback(cancel_token.cancel)
+        new_window.bind("<Destroy>", lambda event: self.on_result_window_destroy(event, new_window, window_cancel_token))
         new_window.title("Generated Text")
         new_window.geometry("1200x900")
         new_window.overrideredirect(True)
@@ -225,6 +368,16 @@ class CopilotApp:
         )
         close_button.pack(side="right", padx=10)
 
+        notice_label = None
+        if notice:
+            notice_label = ctk.CTkLabel(
+                blank_bar,
+                text=notice,
+                font=("Roboto", 13, "normal"),
+                text_color="#ED7D3A",
+            )
+            notice_label.pack(side="left", padx=10)
+
         text_box = ctk.CTkTextbox(
             center_frame,
             wrap=tk.WORD,
@@ -243,9 +396,21 @@ class CopilotApp:
             # update the temporary generated text, which will be used for editing
             self.temp_generated_text = text
             text_box.insert(tk.END, text)
+            if refresh is None:
+                self.schedule_speculative_rewrites(text, window_cancel_token)
+            else:
+                refresh.add_done_callback(
+                    lambda future: self.root.after(
+                        0, self.show_refreshed_text, future, text_box, new_window, notice_label,
+                        cancel_token, window_cancel_token,
+                    )
+                )
         elif hasattr(text, '__iter__'):
             logger.debug(f"Generator")
-            self.insert_text_generator(text_box, text, new_window)
+            self.insert_text_generator(
+                text_box, text, new_window, cancel_token,
+                on_complete=lambda generated: self.schedule_speculative_rewrites(generated, window_cancel_token),
+            )
 
         text_box.configure(state="disabled")
 
@@ -275,7 +440,7 @@ class CopilotApp:
             edit_button = ctk.CTkButton(
                 edit_buttons_frame,
                 text=task,
-                command=lambda t=task: self.edit_text(t, self.temp_generated_text, text_box),
+                command=lambda t=task: self.edit_text(t, self.temp_generated_text, text_box, window_cancel_token),
                 **edit_button_options,
             )
             edit_button.grid(row=0, column=i, padx=5)
@@ -299,27 +464,95 @@ class CopilotApp:
         )
         blank_bar.bind("<B1-Motion>", lambda event: self.do_drag_new_window(event, new_window))
 
-    def insert_text_generator(self, text_box, text_generator, new_window):
-        if not text_box.winfo_exists():
-            logger.debug("Text box does not exist")
+    def show_refreshed_text(
+        self, future: Future, text_box, new_window, notice_label, cancel_token: CancellationToken,
+        window_cancel_token: CancellationToken,
+    ):
+        """
+        Replace the approximate result in a result window with the freshly generated one. A stream replaces
+        the old text on its first chunk. Nothing is replaced once the user has started a tone edit.
+        """
+        if not text_box.winfo_exists() or cancel_token.cancelled:
             return
         try:
-            chunk = next(text_generator)
-            logger.debug(f"Generated chunk: {chunk}")
-            text_box.configure(state="normal")  # Make the text box editable
-
-            content = chunk.choices[0].delta.content
-            self.temp_generated_text += content
-            text_box.insert(tk.END, content)
-
-            text_box.see(tk.END)
-            text_box.update()
-            text_box.configure(state="disabled")  # Make the text box read-only again
-            new_window.after(100, self.insert_text_generator, text_box, text_generator, new_window)
-        except StopIteration:
-            logger.debug(f"StopIteration")
-            text_box.configure(state="disabled")  # Ensure the text box is read-only after generator ends
-            pass
+            result = future.result()
+        except Exception as e:
+            logger.warning(f"Failed to refresh approximate result: {e}")
+            notice_label.configure(text="Approximate result, refresh failed")
+            return
+        if result is None:
+            return
+        generated_text, notice = result
+        if getattr(text_box, "edit_cancel_token", None) is not None:
+            logger.info("Tone edit already started on the approximate result, dropping the refreshed one")
+            cancel_token.cancel()
+            notice_label.configure(text="Approximate result")
+            return
+        notice_label.configure(text=notice or "")
+        if isinstance(generated_text, str):
+            self.temp_generated_text = generated_text
+            text_box.configure(state="normal")
+            text_box.delete("1.0", tk.END)
+            text_box.insert(tk.END, generated_text)
+            text_box.configure(state="disabled")
+            self.schedule_speculative_rewrites(generated_text, window_cancel_token)
+            return
+        self.insert_text_generator(
+            text_box, generated_text, new_window, cancel_token,
+            on_complete=lambda generated: self.schedule_speculative_rewrites(generated, window_cancel_token),
+            replace=True,
+        )
+
+    def on_result_window_destroy(self, event, window, window_cancel_token: CancellationToken):
+        # <Destroy> 会对窗口中的每个子控件触发一次，只处理窗口本身
+        if event.widget is not window:
+            return
+        if window_cancel_token.cancel():
+            logger.info(
+                f"Result window closed, generation stats: {generation_stats.snapshot()}, "
+                f"connection stats: {clients.client_registry.stats()}, "
+                f"endpoint stats: {self.llm.router.stats()}"
+            )
+
+    def insert_text_generator(
+        self,
+        text_box,
+        text_generator,
+        new_window,
+        cancel_token: CancellationToken,
+        on_complete: Optional[Callable[[str], None]] = None,
+        replace: bool = False,
+    ):
+        """
+        Start a background reader for the stream and render its output once per frame.
+        If the stream completes without error or cancellation, on_complete receives the full text.
+        With replace, the text already in the box stays until the first chunk arrives.
+        """
+        self.generated_buffer = TextBuffer()
+        reader = StreamReader(text_generator, cancel_token).start()
+        renderer = StreamRenderer(text_box, reader, self.generated_buffer, replace=replace)
+        self._poll_stream(renderer, new_window, on_complete)
+
+    def _poll_stream(self, renderer: StreamRenderer, new_window, on_complete: Optional[Callable[[str], None]] = None):
+        if not renderer.text_box.winfo_exists():
+            logger.debug("Text box does not exist")
+            return
+        if renderer.flush():
+            logger.debug(f"Stream finished, {len(renderer.buffer)} characters generated")
+            reader = renderer.reader
+            cancelled = reader.cancel_token is not None and reader.cancel_token.cancelled
+            if on_complete is not None and reader.error is None and not cancelled:
+                on_complete(renderer.buffer.text)
+            return
+        new_window.after(FRAME_INTERVAL_MS, self._poll_stream, renderer, new_window, on_complete)
+
+    def schedule_speculative_rewrites(self, text: str, window_cancel_token: CancellationToken):
+        """
+        Pre-generate every tone rewrite of a finished result in the background (opt-in via the
+        speculative_rewrites setting). Closing the result window cancels the ones still pending.
+        """
+        if self.llm.speculative_rewrites:
+            self.speculative_rewrites.schedule(text, EDITOR_NAMES, window_cancel_token)
 
     def toggle_pin(self, window):
         self.is_pinned = not self.is_pinned
@@ -348,38 +581,147 @@ class CopilotApp:
         y = window.winfo_y() + event.y - self.drag_data["y"]
         window.geometry(f"+{x}+{y}")
 
-    def edit_text(self, task, text, text_box):
+    def edit_text(self, task, text, text_box, window_cancel_token: CancellationToken):
         """
         Handle text editing tasks. Implement the logic as needed.
         """
-        self.show_loading_overlay(text_box)
-        self.executor.submit(self.async_edit_text, task, text, text_box)
-
-    def async_edit_text(self, task, text, text_box):
-        editor_prompt = next(
-            (item for item in self.editor_prompts if item["editor"] == task), None
-        )
-
-        if editor_prompt:
-            prompt = editor_prompt["prompt"]
-            prompt = prompt.format(text=text, language=LANGUAGE)
-            logger.info(f"Prompt for {task}: {prompt}")
-            generated_text = self.llm.generate(prompt)
-            
-            # Handle generator
-            if isinstance(generated_text, str):
-                pass
-            else:
-                generated_text_itered = ""
-                for chunk in generated_text:
-                    message = chunk.choices[0].delta.content
-                    logger.debug(f"Chunk message is {message}")
-                    generated_text_itered += message
-                generated_text = generated_text_itered
-
-            logger.info(f"Generated text for {task}: {generated_text}")
+        overlay = self.show_loading_overlay(text_box)
+        # 编辑任务有自己的令牌，但在结果窗口关闭时一并取消
+        cancel_token = CancellationToken()
+        window_cancel_token.add_callback(cancel_token.cancel)
+        # 同一个文本框中还在进行的改写被新的改写取代，避免两路输出交错
+        previous_token = getattr(text_box, "edit_cancel_token", None)
+        if previous_token is not None:
+            previous_token.cancel()
+        text_box.edit_cancel_token = cancel_token
+        trace = RequestTrace(task)
+        run_in_background(self.async_edit_text, task, text, text_box, overlay, cancel_token, trace)
+
+    def start_rewrite(
+        self,
+        task,
+        text,
+        cancel_token: CancellationToken,
+        trace: Optional[RequestTrace] = None,
+        priority: int = EDIT,
+        queue_key: Optional[str] = None,
+    ) -> Union[Generator, str, None]:
+        """
+        Send the rewrite request for text with the editor prompt of task. Returns the stream (or the full
+        text when streaming is off), or None if it was cancelled before being sent.
+        `priority` and `queue_key` are passed to the request scheduler, see LLM.generate.
+        """
+        template = self.prompts.get(task)
+        prompt, truncated = template.build(text, self.llm.prompt_budget())
+        if truncated:
+            logger.warning(f"Text for {task} truncated to fit the prompt budget")
+        logger.opt(lazy=True).info("Prompt for {}: {}", lambda: task, lambda: clip(prompt))
+        if cancel_token.cancelled:
+            return None
+        try:
+            return self.llm.generate(
+                prompt, cancel_token=cancel_token, trace=trace, profile=template.profile,
+                priority=priority, queue_key=queue_key,
+            )
+        except RequestCancelled:
+            return None
+
+    def rewrite_text(
+        self,
+        task,
+        text,
+        cancel_token: CancellationToken,
+        trace: Optional[RequestTrace] = None,
+        priority: int = EDIT,
+        queue_key: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Rewrite text with the editor prompt of task and return the full result, or None if it was cancelled.
+        """
+        generated_text = self.start_rewrite(task, text, cancel_token, trace, priority, queue_key)
+        if generated_text is None:
+            return None
+
+        # Handle generator
+        if not isinstance(generated_text, str):
+            generated_text = "".join(iter_content(generated_text, cancel_token))
+        if cancel_token.cancelled:
+            return None
+        return generated_text
+
+    def speculative_rewrite(self, task, text, cancel_token: CancellationToken) -> Optional[str]:
+        """
+        Rewrite for SpeculativeRewrites: queued behind every request the user is waiting for, and replaced
+        in the queue by the same rewrite of a newer result.
+        """
+        return self.rewrite_text(task, text, cancel_token, priority=BACKGROUND, queue_key=speculative_queue_key(task))
+
+    def async_edit_text(self, task, text, text_box, overlay, cancel_token: CancellationToken, trace: RequestTrace):
+        trace.start()
+        if task in self.prompts:
+            generated_text = None
+            # 预生成的结果已完成时直接使用，仍在生成时等待它，而不是重复发出请求
+            future = self.speculative_rewrites.take(task, text)
+            if future is not None:
+                # 预生成请求可能还在调度器中以后台优先级排队
+                self.llm.scheduler.promote(speculative_queue_key(task), EDIT)
+                try:
+                    generated_text = future.result()
+                    logger.info(f"Using speculatively generated {task} rewrite")
+                    trace.first_token()
+                    trace.complete(0)
+                except Exception as e:
+                    logger.debug(f"Speculative {task} rewrite unavailable: {e}")
+            if generated_text is None:
+                generated_text = self.start_rewrite(task, text, cancel_token, trace)
+            if generated_text is None:
+                logger.info(f"Edit task {task} cancelled")
+                self.root.after(0, overlay.destroy)
+                return
+            self.root.after(0, self.show_edited_text, task, text_box, overlay, generated_text, cancel_token)
+
+    def show_edited_text(
+        self, task, text_box, overlay, generated_text: Union[Generator, str], cancel_token: CancellationToken
+    ):
+        """
+        Show a rewrite in the result text box. A stream replaces the old text on its first chunk and is
+        rendered as it arrives; the result is copied to the clipboard once it is complete.
+        """
+        if not text_box.winfo_exists():
+            return
+        if cancel_token.cancelled:
+            overlay.destroy()
+            return
+        if isinstance(generated_text, str):
+            logger.opt(lazy=True).info("Generated text for {}: {}", lambda: task, lambda: clip(generated_text))
             pyperclip.copy(generated_text)
-            self.root.after(0, self.update_text_box, text_box, generated_text)
+            self.update_text_box(text_box, generated_text, overlay)
+            return
+        reader = StreamReader(generated_text, cancel_token).start()
+        self._poll_edit_stream(task, StreamRenderer(text_box, reader, replace=True), overlay)
+
+    def _poll_edit_stream(self, task, renderer: StreamRenderer, overlay):
+        if not renderer.text_box.winfo_exists():
+            return
+        reader = renderer.reader
+        if reader.cancel_token.cancelled:
+            # 被新的改写取代，剩余的片段不再显示
+            overlay.destroy()
+            logger.info(f"Edit task {task} cancelled, clipboard left unchanged")
+            return
+        finished = renderer.flush()
+        # 第一个片段显示出来后就移除“Loading...”遮罩
+        if overlay.winfo_exists() and (finished or len(renderer.buffer)):
+            overlay.destroy()
+        if not finished:
+            renderer.text_box.after(FRAME_INTERVAL_MS, self._poll_edit_stream, task, renderer, overlay)
+            return
+        if reader.error is not None or reader.cancel_token.cancelled:
+            logger.info(f"Edit task {task} did not complete, clipboard left unchanged")
+            return
+        generated_text = renderer.buffer.text
+        logger.opt(lazy=True).info("Generated text for {}: {}", lambda: task, lambda: clip(generated_text))
+        pyperclip.copy(generated_text)
 
     def show_loading_overlay(self, text_box):
         overlay = tk.Frame(text_box, bg="#212230")
@@ -388,13 +730,14 @@ class CopilotApp:
         loading_label = tk.Label(overlay, text="Loading...", font=("Roboto", 18), bg="#212230", fg="white")
         loading_label.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
         self.overlay = overlay  # Store the overlay reference
+        return overlay
 
-    def update_text_box(self, text_box, generated_text):
+    def update_text_box(self, text_box, generated_text, overlay=None):
         text_box.configure(state="normal")
         text_box.delete("1.0", tk.END)
         text_box.insert(tk.END, generated_text)
         text_box.configure(state="disabled")
-        self.overlay.destroy()  # Remove the overlay
+        (overlay or self.overlay).destroy()  # Remove the overlay
 
     def create_right_click_menu(self):
         """
@@ -421,7 +764,7 @@ class CopilotApp:
 
 
 def show_notification():
-    notification.notify(
+    plyer.notification.notify(
         app_name="RAGENT-Copilot",
         app_icon="assets\RAGenT_logo.ico",  # Replace with the path to your icon file
         # ticker="RAGENT-Copilot",
@@ -436,6 +779,9 @@ def monitor_keys(app):
         if not keyboard.add_hotkey("ctrl+shift+space", app.toggle_window):
             logger.error("Failed to register hotkey")
             return
+        startup_profiler.mark("hotkey ready")
+        # 报告由 report() 写入日志
+        startup_profiler.report()
         while True:
             time.sleep(1)
     except Exception as e:
@@ -460,6 +806,7 @@ def restart_action(icon, item):
 
 def create_tray_icon(app):
     image = Image.open("assets\RAGenT_logo.png")  # Replace "icon.png" with the path to your icon file
+    item, Menu = pystray.MenuItem, pystray.Menu
     menu = (item('Settings', open_settings_window), item('Restart', restart_action), item('Quit', exit_action),)
     icon = pystray.Icon("name", image, "RAGENT-Copilot", menu)
 
@@ -538,7 +885,11 @@ def create_settings_window():
         "Temperature:": "temperature",
         "Max Tokens:": "max_tokens",
         "Top P:": "top_p",
-        "Frequency Penalty:": "frequency_penalty"
+        "Frequency Penalty:": "frequency_penalty",
+        "Keep-Alive Interval (s):": "keep_alive_interval",
+        "Context Window:": "context_window",
+        "Max Concurrency:": "max_concurrency",
+        "Similarity Threshold:": "similarity_threshold",
     }
     advanced_labels = []
     advanced_entries = []
@@ -571,6 +922,34 @@ def create_settings_window():
     frequency_penalty_entry = ctk.CTkEntry(tab_advanced, width=300)
     frequency_penalty_entry.pack(padx=10, pady=5)
     advanced_entries.append(frequency_penalty_entry)
+    # Keep-alive interval
+    keep_alive_label = ctk.CTkLabel(tab_advanced, text="Keep-Alive Interval (s):")
+    keep_alive_label.pack(padx=10, pady=5, anchor='w')
+    advanced_labels.append(keep_alive_label)
+    keep_alive_entry = ctk.CTkEntry(tab_advanced, width=300, placeholder_text="240, 0 to disable")
+    keep_alive_entry.pack(padx=10, pady=5)
+    advanced_entries.append(keep_alive_entry)
+    # Context window
+    context_window_label = ctk.CTkLabel(tab_advanced, text="Context Window:")
+    context_window_label.pack(padx=10, pady=5, anchor='w')
+    advanced_labels.append(context_window_label)
+    context_window_entry = ctk.CTkEntry(tab_advanced, width=300, placeholder_text="4096 (Ollama num_ctx)")
+    context_window_entry.pack(padx=10, pady=5)
+    advanced_entries.append(context_window_entry)
+    # Max concurrency
+    max_concurrency_label = ctk.CTkLabel(tab_advanced, text="Max Concurrency:")
+    max_concurrency_label.pack(padx=10, pady=5, anchor='w')
+    advanced_labels.append(max_concurrency_label)
+    max_concurrency_entry = ctk.CTkEntry(tab_advanced, width=300, placeholder_text="2 (parallel requests of the server)")
+    max_concurrency_entry.pack(padx=10, pady=5)
+    advanced_entries.append(max_concurrency_entry)
+    # Similarity threshold
+    similarity_threshold_label = ctk.CTkLabel(tab_advanced, text="Similarity Threshold:")
+    similarity_threshold_label.pack(padx=10, pady=5, anchor='w')
+    advanced_labels.append(similarity_threshold_label)
+    similarity_threshold_entry = ctk.CTkEntry(tab_advanced, width=300, placeholder_text="0.85, 0 to disable")
+    similarity_threshold_entry.pack(padx=10, pady=5)
+    advanced_entries.append(similarity_threshold_entry)
 
     # 加载已保存的设置
     def load_settings():
@@ -602,6 +981,14 @@ def create_settings_window():
             "general": {},
             "advanced": {}
         }
+        # 保留设置窗口中没有的字段（额外接口、对冲请求等只能在 settings.json 中配置）
+        if os.path.exists("settings/settings.json"):
+            with open("settings/settings.json", "r") as file:
+                saved_settings = json.load(file)
+            for section, labels_map in (("general", general_labels_map), ("advanced", advanced_labels_map)):
+                settings[section].update({
+                    k: v for k, v in saved_settings.get(section, {}).items() if k not in labels_map.values()
+                })
 
         # 更新"general"部分
         general_data = {general_labels_map[label.cget("text")]: entry.get() for label, entry in zip(general_labels, general_entries)}
@@ -622,6 +1009,8 @@ def create_settings_window():
         with open("settings/settings.json", "w") as file:
             json.dump(settings, file)
             logger.info("Settings saved successfully.")
+        tool_capability_cache.invalidate()
+        app.reload_settings()
             # 弹出提示框
 
         response = messagebox.askyesno("Settings Saved", "Settings saved successfully.\nDo you want to close all windows?", default=messagebox.NO)
@@ -637,6 +1026,8 @@ def create_settings_window():
             # 删除本地的settings.json文件
             if os.path.exists("settings/settings.json"):
                 os.remove("settings/settings.json")
+                tool_capability_cache.invalidate()
+                app.reload_settings()
                 logger.info("Settings reset successfully.")
                 # 弹出提示框
                 messagebox.showinfo("Settings Reset", "Settings reset successfully.")
@@ -655,10 +1046,13 @@ settings_window_queue = queue.Queue()
 
 
 def main():
-    global root
+    global root, app
+    startup_profiler.mark("imports")
     root = ctk.CTk()
+    startup_profiler.mark("create root window")
     app = CopilotApp(root)
     app.create_right_click_menu()  # Add this line to create the right-click menu
+    startup_profiler.mark("create app")
 
     # Start key monitoring in a separate thread
     monitor_thread = threading.Thread(target=monitor_keys, args=(app,))
@@ -670,6 +1064,12 @@ def main():
     tray_thread.daemon = True
     tray_thread.start()
 
+    start_metrics_server()
+    preload_modules(PRELOAD_MODULES)
+    # 后台预热模型，并定期保活，避免首次按下快捷键时等待模型加载
+    app.warmup_scheduler.start()
+    app.llm.router.start_health_checks()
+
     # Handle settings window queue in the main thread
     root.after(100, handle_settings_window_queue)
 
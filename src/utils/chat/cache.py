@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from loguru import logger
+from typing import Any, Callable, Dict, Generator, Iterable, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionChunk
+
+
+DEFAULT_CACHE_PATH = "cache/responses.sqlite3"
+DEFAULT_MEMORY_ITEMS = 128
+DEFAULT_DISK_ITEMS = 2048
+DEFAULT_TTL = 7 * 24 * 3600  # 秒
+
+
+def make_chunk(content: Optional[str], model: str, finish_reason: Optional[str] = None) -> "ChatCompletionChunk":
+    """
+    构造一个与 OpenAI 流式输出格式一致的 chunk，使调用方无需区分真实流和本地回放。
+
+    :param content: chunk 中的文本内容
+    :param model: 模型名称
+    :param finish_reason: 结束原因，最后一个 chunk 为 "stop"
+    :return: ChatCompletionChunk 对象
+    """
+    # 在函数内导入，避免启动时加载 openai
+    from openai.types.chat import ChatCompletionChunk
+    from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+
+    return ChatCompletionChunk(
+        id=f"chatcmpl-local-{uuid.uuid4().hex[:12]}",
+        object="chat.completion.chunk",
+        created=int(time.time()),
+        model=model,
+        choices=[
+            Choice(
+                index=0,
+                delta=ChoiceDelta(role="assistant", content=content),
+                finish_reason=finish_reason,
+            )
+        ],
+    )
+
+
+def replay_as_stream(text: str, model: str, chunk_size: int = 0) -> Generator["ChatCompletionChunk", None, None]:
+    """
+    将完整文本回放为流式 chunk 生成器。
+
+    :param text: 要回放的文本
+    :param model: 模型名称
+    :param chunk_size: 每个 chunk 的字符数，为 0 时整段文本作为一个 chunk 返回
+    """
+    if chunk_size <= 0 or len(text) <= chunk_size:
+        yield make_chunk(text, model, finish_reason="stop")
+        return
+    pieces = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    for piece in pieces[:-1]:
+        yield make_chunk(piece, model)
+    yield make_chunk(pieces[-1], model, finish_reason="stop")
+
+
+def tee_stream(stream: Iterable, on_complete: Callable[[str], None]) -> Generator:
+    """
+    透传流式输出，同时收集文本内容；只有在流被完整消费后才调用 on_complete，
+    避免把被中断的半截回复写入缓存。
+
+    :param stream: OpenAI 流式输出
+    :param on_complete: 流结束后接收完整文本的回调
+    """
+    parts = []
+    completed = False
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            on_complete("".join(parts))
+        elif hasattr(stream, "close"):
+            stream.close()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for model responses: an in-memory LRU in front of a SQLite store with TTL and size limits.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_CACHE_PATH,
+        max_memory_items: int = DEFAULT_MEMORY_ITEMS,
+        max_disk_items: int = DEFAULT_DISK_ITEMS,
+        ttl: float = DEFAULT_TTL,
+    ):
+        """
+        :param path: SQLite 文件路径，为 None 时只使用内存缓存
+        :param max_memory_items: 内存 LRU 的最大条目数
+        :param max_disk_items: 磁盘缓存的最大条目数，超出时按最近访问时间淘汰
+        :param ttl: 条目的有效期（秒）
+        """
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            try:
+                folder = os.path.dirname(path)
+                if folder:
+                    os.makedirs(folder, exist_ok=True)
+                self._conn = sqlite3.connect(path, check_same_thread=False)
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON responses (accessed_at)")
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to open response cache at {path}: {e}, using memory cache only.")
+                self._conn = None
+
+    @staticmethod
+    def make_key(base_url: str, model: str, system_prompt: str, prompt: str, params: Dict[str, Any]) -> str:
+        """
+        根据请求的所有影响输出的因素生成缓存键。
+
+        :param base_url: 接口地址
+        :param model: 模型名称
+        :param system_prompt: 系统提示词
+        :param prompt: 完整的用户提示词
+        :param params: 采样参数，只取 temperature、top_p、max_tokens 和 stop
+        :return: sha256 十六进制字符串
+        """
+        fields = {
+            "base_url": base_url,
+            "model": model,
+            "system": system_prompt,
+            "prompt": prompt,
+            "temperature": params.get("temperature"),
+            "top_p": params.get("top_p"),
+            "max_tokens": params.get("max_tokens"),
+        }
+        # 没有停止序列时不加入这个字段，已有的缓存键保持不变
+        if params.get("stop"):
+            fields["stop"] = params["stop"]
+        payload = json.dumps(
+            fields,
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                created_at, value = item
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, created_at, value)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        if not value:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._conn is None:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_disk_items,),
+            )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def _remember(self, key: str, created_at: float, value: str) -> None:
+        """写入内存 LRU，调用方需持有锁"""
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
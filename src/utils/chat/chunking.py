@@ -0,0 +1,262 @@
+import re
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+from typing import Dict, Generator, List, Optional, Tuple
+
+from utils.chat.cache import make_chunk
+from utils.chat.profiles import GenerationProfile
+from utils.chat.prompts import PromptTemplate
+from utils.chat.streaming import CancellationToken
+from utils.chat.tokens import estimate_tokens
+from utils.metrics.metrics import RequestTrace, observe_stream
+
+
+# 超过这个长度（token）的输入按块处理，即使能放进上下文，预填充也会很慢
+CHUNKING_THRESHOLD = 2000
+DEFAULT_CHUNK_TOKENS = 1500
+# 相邻块之间重复的 token 数，避免在块边界丢失上下文
+DEFAULT_OVERLAP_TOKENS = 75
+# split_text 以字符为单位，这两个值用于直接调用时的默认值
+DEFAULT_CHUNK_CHARS = 6000
+DEFAULT_OVERLAP_CHARS = 300
+# 本地推理服务的并发能力有限，同时处理的块数不宜过多
+MAX_CHUNK_WORKERS = 3
+
+_chunk_executor = ThreadPoolExecutor(max_workers=MAX_CHUNK_WORKERS, thread_name_prefix="chunk")
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# 句子包含结尾的标点、引号和空白，拼接时可以还原原文
+_SENTENCE = re.compile(r".+?(?:[.!?]+[\"'”’)\]]*(?:\s+|$)|[。！？；]+[”’」』）]*\s*|$)", re.S)
+
+
+def _split_sentences(paragraph: str) -> List[str]:
+    return [sentence for sentence in _SENTENCE.findall(paragraph) if sentence]
+
+
+def _units(text: str, chunk_size: int) -> List[Tuple[str, str]]:
+    """
+    把文本拆成 (分隔符, 片段) 列表：能放进一个块的段落整段保留，过长的段落按句子拆分，过长的句子按长度硬拆。
+    """
+    units = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_size:
+            units.append(("\n\n", paragraph))
+            continue
+        separator = "\n\n"
+        for sentence in _split_sentences(paragraph):
+            while len(sentence) > chunk_size:
+                units.append((separator, sentence[:chunk_size]))
+                separator, sentence = "", sentence[chunk_size:]
+            units.append((separator, sentence))
+            separator = ""
+    return units
+
+
+def split_text(text: str, chunk_size: int = DEFAULT_CHUNK_CHARS, overlap: int = DEFAULT_OVERLAP_CHARS) -> List[str]:
+    """
+    在段落和句子边界把长文本切成不超过 chunk_size 个字符的块，相邻块之间重叠约 overlap 个字符。
+
+    :param text: 要切分的文本
+    :param chunk_size: 每块的最大字符数
+    :param overlap: 每块开头重复上一块结尾的最大字符数
+    :return: 文本块列表
+    """
+    chunks: List[str] = []
+    current: List[Tuple[str, str]] = []
+    size = 0
+    for separator, unit in _units(text, chunk_size):
+        if current and size + len(separator) + len(unit) > chunk_size:
+            chunks.append(_join(current))
+            tail = _overlap_tail(current, overlap)
+            tail_size = sum(len(item[0]) + len(item[1]) for item in tail)
+            if tail_size + len(separator) + len(unit) > chunk_size:
+                tail, tail_size = [], 0
+            current, size = tail, tail_size
+        current.append((separator, unit))
+        size += len(separator) + len(unit)
+    if current:
+        chunks.append(_join(current))
+    return chunks
+
+
+def _overlap_tail(units: List[Tuple[str, str]], overlap: int) -> List[Tuple[str, str]]:
+    """
+    上一块结尾不超过 overlap 个字符的内容：先取完整的片段，剩余的长度用前一个片段结尾的句子补足，
+    一句也放不下时取其结尾的字符（从单词边界开始）。段落通常比 overlap 长，只取完整片段时相邻块没有重叠。
+    """
+    tail: List[Tuple[str, str]] = []
+    size = 0
+    index = len(units)
+    while index > 0 and size + len(units[index - 1][0]) + len(units[index - 1][1]) <= overlap:
+        index -= 1
+        tail.insert(0, units[index])
+        size += len(units[index][0]) + len(units[index][1])
+    remaining = overlap - size
+    if index == 0 or remaining <= 0:
+        return tail
+    sentences = _split_sentences(units[index - 1][1])
+    partial = ""
+    while sentences and len(partial) + len(sentences[-1]) <= remaining:
+        partial = sentences.pop() + partial
+    if not partial:
+        partial = units[index - 1][1][-remaining:]
+        cut = partial.find(" ")
+        if 0 <= cut < len(partial) - 1:
+            partial = partial[cut + 1:]
+    if partial.strip():
+        tail.insert(0, ("", partial))
+    return tail
+
+
+def _join(units: List[Tuple[str, str]]) -> str:
+    return "".join(separator + unit for separator, unit in units).strip()
+
+
+def split_for_budget(text: str, chunk_tokens: int = DEFAULT_CHUNK_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS) -> List[str]:
+    """
+    按 token 预算切分文本：根据整段文本的字符/token 比例换算为字符数后调用 split_text。
+
+    :param text: 要切分的文本
+    :param chunk_tokens: 每块的最大估算 token 数
+    :param overlap_tokens: 相邻块重叠的估算 token 数
+    """
+    chars_per_token = len(text) / max(1, estimate_tokens(text))
+    return split_text(text, max(1, int(chunk_tokens * chars_per_token)), int(overlap_tokens * chars_per_token))
+
+
+def should_chunk(
+    task: str,
+    text: str,
+    chunk_prompts: Dict[str, Dict[str, PromptTemplate]],
+    token_budget: Optional[int] = None,
+) -> bool:
+    """
+    任务支持分块处理，且输入超过 CHUNKING_THRESHOLD 或提示词的 token 预算时返回 True。
+
+    :param token_budget: 提示词可用的 token 数，见 LLM.prompt_budget
+    """
+    if task not in chunk_prompts:
+        return False
+    threshold = CHUNKING_THRESHOLD if token_budget is None else min(CHUNKING_THRESHOLD, token_budget)
+    return estimate_tokens(text) > threshold
+
+
+def _run_map(
+    llm,
+    prompt: str,
+    profile: Optional[GenerationProfile],
+    cancel_token: Optional[CancellationToken],
+    output: queue.SimpleQueue,
+) -> None:
+    """生成一个块的结果，把文本片段逐个放入 output，结束时放入 None，出错时放入异常"""
+    try:
+        result = llm.generate(prompt, cancel_token=cancel_token, profile=profile)
+        if isinstance(result, str):
+            output.put(result)
+        else:
+            for chunk in result:
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
+                if chunk.choices and chunk.choices[0].delta.content:
+                    output.put(chunk.choices[0].delta.content)
+    except Exception as e:
+        output.put(e)
+    finally:
+        output.put(None)
+
+
+def _stream_text(result, model: str) -> Generator:
+    """把 LLM.generate 的返回值统一为流式 chunk"""
+    if isinstance(result, str):
+        yield make_chunk(result, model, finish_reason="stop")
+    else:
+        yield from result
+
+
+def map_reduce_stream(
+    llm,
+    chunks: List[str],
+    prompts: Dict[str, PromptTemplate],
+    cancel_token: Optional[CancellationToken] = None,
+    trace: Optional[RequestTrace] = None,
+    token_budget: Optional[int] = None,
+) -> Generator:
+    """
+    Process a long text in chunks: run the map prompt on every chunk in parallel (at most MAX_CHUNK_WORKERS at a time),
+    then combine the partial outputs with the reduce prompt.
+
+    Partial outputs are streamed in document order as they are generated, so the first part shows up while later
+    chunks are still running; the combined result streams after them.
+
+    :param llm: LLM 实例
+    :param chunks: 切分好的文本块，见 split_for_budget
+    :param prompts: 包含 'map' 和 'reduce' 的提示词模板，见 get_chunk_prompts
+    :param cancel_token: 取消令牌，取消时所有块的请求都会停止
+    :param trace: 整个流程的时间线
+    :param token_budget: 每个提示词的 token 预算，合并时超出预算的部分结果会被截断
+    :return: 与 OpenAI 流式输出格式相同的 chunk 生成器
+    """
+    logger.info(f"Processing {sum(len(chunk) for chunk in chunks)} chars in {len(chunks)} chunks")
+    if trace is not None:
+        trace.request_sent()
+    return observe_stream(_map_reduce(llm, chunks, prompts, cancel_token, token_budget), trace)
+
+
+def _map_reduce(
+    llm,
+    chunks: List[str],
+    prompts: Dict[str, PromptTemplate],
+    cancel_token: Optional[CancellationToken],
+    token_budget: Optional[int],
+) -> Generator:
+    model = llm.defult_config["model"]
+    total = len(chunks)
+    outputs = [queue.SimpleQueue() for _ in chunks]
+    futures = [
+        _chunk_executor.submit(
+            _run_map,
+            llm,
+            prompts["map"].build(chunk, token_budget, index=index, total=total)[0],
+            prompts["map"].profile,
+            cancel_token,
+            output,
+        )
+        for index, (chunk, output) in enumerate(zip(chunks, outputs), start=1)
+    ]
+    completed = False
+    try:
+        partials = []
+        for index, output in enumerate(outputs, start=1):
+            yield make_chunk(f"[{index}/{total}] ", model)
+            parts = []
+            while True:
+                item = output.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                parts.append(item)
+                yield make_chunk(item, model)
+            partials.append("".join(parts).strip())
+            yield make_chunk("\n\n", model)
+
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        combined = "\n\n".join(f"Part {index}:\n{partial}" for index, partial in enumerate(partials, start=1))
+        yield make_chunk("[Combined]\n", model)
+        reduce_prompt, truncated = prompts["reduce"].build(combined, token_budget)
+        if truncated:
+            logger.warning("Partial results exceed the prompt budget, the reduce step only sees the first parts")
+        yield from _stream_text(
+            llm.generate(reduce_prompt, cancel_token=cancel_token, profile=prompts["reduce"].profile), model
+        )
+        completed = True
+    finally:
+        if not completed:
+            # 还没开始的块不再需要
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,118 @@
+import threading
+import httpx
+from openai import OpenAI
+from loguru import logger
+from typing import Dict, Tuple
+
+
+# 本地推理服务同时只能处理少量请求，连接池不需要很大，但要保持长连接
+DEFAULT_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=8, keepalive_expiry=120.0)
+# 流式输出时 read 超时是两个 chunk 之间的最大间隔，本地模型冷启动可能需要较长时间
+DEFAULT_TIMEOUT = httpx.Timeout(connect=5.0, read=120.0, write=30.0, pool=30.0)
+# httpcore 在打开新连接时发出的 trace 事件
+_CONNECT_EVENTS = ("connection.connect_tcp.started", "connection.connect_unix_socket.started")
+
+
+class ConnectionStats:
+    """Counts requests per endpoint and how many of them rode an already open connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.reused = 0
+        self.new_connections = 0
+
+    def record(self, reused: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+            else:
+                self.new_connections += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "reused": self.reused,
+                "new_connections": self.new_connections,
+                "reuse_ratio": self.reused / self.requests if self.requests else 0.0,
+            }
+
+
+class _TrackingTransport(httpx.HTTPTransport):
+    """HTTP transport that reports whether each request opened a new connection."""
+
+    def __init__(self, stats: ConnectionStats, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        # 连接池被并发请求共享，只统计本次请求自己触发的建连事件（httpcore 的 trace 扩展）
+        connected = []
+        inner_trace = request.extensions.get("trace")
+
+        def trace(event_name: str, info: dict) -> None:
+            if event_name in _CONNECT_EVENTS:
+                connected.append(event_name)
+            if inner_trace is not None:
+                inner_trace(event_name, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        response = super().handle_request(request)
+        self._stats.record(reused=not connected)
+        return response
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of OpenAI clients keyed by (base_url, api_key), so the LLM and the
+    tool-calling path share one keep-alive connection pool per endpoint.
+    """
+
+    def __init__(self, limits: httpx.Limits = DEFAULT_LIMITS, timeout: httpx.Timeout = DEFAULT_TIMEOUT):
+        self.limits = limits
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str], OpenAI] = {}
+        self._stats: Dict[str, ConnectionStats] = {}
+
+    def get(self, base_url: str, api_key: str) -> OpenAI:
+        """
+        获取（或创建）指定接口的共享客户端。
+
+        :param base_url: 接口地址
+        :param api_key: API Key
+        :return: OpenAI 客户端
+        """
+        key = (base_url, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                stats = self._stats.setdefault(base_url, ConnectionStats())
+                http_client = httpx.Client(
+                    transport=_TrackingTransport(stats, limits=self.limits),
+                    timeout=self.timeout,
+                )
+                client = OpenAI(base_url=base_url, api_key=api_key, http_client=http_client)
+                self._clients[key] = client
+                logger.info(f"Created shared client for {base_url}")
+            return client
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """按接口地址返回连接复用统计"""
+        with self._lock:
+            return {base_url: stats.snapshot() for base_url, stats in self._stats.items()}
+
+    def close_all(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+client_registry = ClientRegistry()
+
+
+def get_client(base_url: str, api_key: str) -> OpenAI:
+    return client_registry.get(base_url, api_key)
@@ -0,0 +1,208 @@
+import weakref
+import threading
+from loguru import logger
+from typing import Callable, Dict, Generator, Iterator, List, Optional, Tuple
+
+from utils.chat.streaming import CancellationToken
+
+
+# 最后一个订阅者离开后，上游请求再保留的秒数：重新点击同一个按钮时，旧的令牌会在新请求发出之前被取消
+DEFAULT_GRACE_SECONDS = 1.0
+
+_END = object()
+
+
+class SharedStream:
+    """
+    One upstream stream read by any number of subscribers. Received chunks are buffered, so a subscriber
+    that joins late first replays what the others already got; whichever subscriber needs a chunk that is
+    not buffered yet pulls it from the upstream. Once every subscriber has left, the upstream is cancelled
+    after a short grace period in which a re-triggered request can still join. The upstream's resources
+    (HTTP response, scheduler slot, endpoint) are tied to `cancel_token`, which is cancelled whenever the
+    stream finishes, so they are released even if the upstream generator never ran.
+    """
+
+    def __init__(self, key: str, on_finish: Callable[["SharedStream"], None], grace: float = DEFAULT_GRACE_SECONDS):
+        """
+        :param key: 请求的缓存键，相同的键表示相同的模型、参数和消息
+        :param on_finish: 上游结束、出错或被放弃时调用，用于从 InFlightRequests 中移除
+        :param grace: 没有订阅者之后等待多久再取消上游
+        """
+        self.key = key
+        self.grace = grace
+        # 上游请求使用自己的令牌，单个订阅者取消不会影响其他订阅者
+        self.cancel_token = CancellationToken()
+        self._on_finish = on_finish
+        self._upstream: Optional[Iterator] = None
+        self._ready = threading.Event()
+        self._chunks: List = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._abandoned = False
+        self._subscribers = 0
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()  # 保护订阅者计数和状态
+        self._pull_lock = threading.Lock()  # 同一时间只有一个订阅者读取上游
+
+    def attach(self, upstream: Iterator) -> None:
+        """发出请求的一方在上游流打开后调用"""
+        self._upstream = upstream
+        self._ready.set()
+
+    def fail(self, error: BaseException) -> None:
+        """上游请求没能发出，等待中的订阅者收到同样的异常"""
+        self._finish(error)
+        self._ready.set()
+
+    def subscribe(self, cancel_token: Optional[CancellationToken] = None) -> Optional[Generator]:
+        """
+        订阅上游输出，先重放已收到的 chunk。订阅者的令牌被取消或生成器被关闭时离开。
+
+        :return: 流式输出；上游已经被放弃时返回 None
+        """
+        with self._lock:
+            if self._abandoned or self._error is not None:
+                return None
+            self._subscribers += 1
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        left = threading.Event()
+
+        def leave():
+            if not left.is_set():
+                left.set()
+                self._leave()
+
+        if cancel_token is not None:
+            cancel_token.add_callback(leave)
+        stream = self._replay(leave, cancel_token)
+        # 没有开始迭代就被丢弃的生成器不会执行 finally，回收时也要离开
+        weakref.finalize(stream, leave)
+        return stream
+
+    def _replay(self, leave: Callable[[], None], cancel_token: Optional[CancellationToken]) -> Generator:
+        index = 0
+        try:
+            while cancel_token is None or not cancel_token.cancelled:
+                chunk = self._get(index)
+                if chunk is _END:
+                    return
+                index += 1
+                yield chunk
+        finally:
+            leave()
+
+    def _get(self, index: int):
+        # 已缓冲的 chunk 不需要等待正在读取上游的订阅者
+        if index < len(self._chunks):
+            return self._chunks[index]
+        self._ready.wait()
+        with self._pull_lock:
+            if index < len(self._chunks):
+                return self._chunks[index]
+            if self._done:
+                if self._error is not None:
+                    raise self._error
+                return _END
+            try:
+                chunk = next(self._upstream)
+            except StopIteration:
+                self._finish()
+                return _END
+            except BaseException as e:
+                self._finish(e)
+                raise
+            self._chunks.append(chunk)
+            return chunk
+
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+            self._error = error
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self._on_finish(self)
+        # 关闭从未开始迭代的生成器不会执行其中的 finally，直接通过令牌释放上游占用的资源
+        self.cancel_token.cancel()
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._subscribers -= 1
+            if self._subscribers > 0 or self._done:
+                return
+            self._timer = threading.Timer(self.grace, self._abandon)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _abandon(self) -> None:
+        with self._lock:
+            if self._subscribers > 0 or self._done:
+                return
+            self._abandoned = True
+            self._timer = None
+        logger.info(f"No subscribers left for request {self.key[:12]}, cancelling it")
+        self._on_finish(self)
+        # 取消会关闭 HTTP 连接，正在读取上游的线程随即返回，之后再关闭上游以释放调度器的 slot
+        self.cancel_token.cancel()
+        with self._pull_lock:
+            if self._upstream is not None and hasattr(self._upstream, "close"):
+                self._upstream.close()
+            self._finish()
+
+
+class InFlightRequests:
+    """
+    Single-flight registry for streaming requests: while a request is running, identical requests (same
+    cache key) subscribe to its stream instead of making the backend decode the same output again.
+    """
+
+    def __init__(self, grace: float = DEFAULT_GRACE_SECONDS):
+        self.grace = grace
+        self._flights: Dict[str, SharedStream] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def join(self, key: str, cancel_token: Optional[CancellationToken] = None) -> Optional[Generator]:
+        """订阅进行中的相同请求，没有时返回 None"""
+        with self._lock:
+            return self._join(key, cancel_token)
+
+    def start(self, key: str, cancel_token: Optional[CancellationToken] = None) -> Tuple[Optional[SharedStream], Generator]:
+        """
+        订阅进行中的相同请求；没有时登记一个新请求。
+
+        :return: (SharedStream, 订阅)；SharedStream 为 None 表示加入了已有的请求，
+            否则调用方需要用 SharedStream.cancel_token 发出请求并 attach 上游（失败时调用 fail）
+        """
+        with self._lock:
+            stream = self._join(key, cancel_token)
+            if stream is not None:
+                return None, stream
+            flight = SharedStream(key, self._remove, self.grace)
+            self._flights[key] = flight
+            self.started += 1
+            return flight, flight.subscribe(cancel_token)
+
+    def _join(self, key: str, cancel_token: Optional[CancellationToken]) -> Optional[Generator]:
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        stream = flight.subscribe(cancel_token)
+        if stream is not None:
+            self.coalesced += 1
+            logger.info(f"Identical request {key[:12]} already in flight, subscribing to its stream")
+        return stream
+
+    def _remove(self, flight: SharedStream) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {"all": {"in_flight": len(self._flights), "started": self.started, "coalesced": self.coalesced}}
@@ -0,0 +1,226 @@
+import time
+import queue
+import threading
+from loguru import logger
+from typing import Callable, Dict, Generator, Iterator, List, Optional
+
+from utils.chat.scheduler import Slot
+from utils.chat.streaming import CancellationToken
+from utils.metrics.metrics import RollingHistogram, metrics
+
+
+# 在首个 token 延迟的这个百分位处发出对冲请求
+DEFAULT_HEDGE_PERCENTILE = 0.95
+# 对冲请求最多占全部请求的比例
+DEFAULT_HEDGE_MAX_RATIO = 0.1
+# 样本不足时使用的对冲等待时间（秒）
+DEFAULT_HEDGE_DELAY = 2.0
+# 对冲等待时间的下限，避免在很快的接口上也频繁对冲
+MIN_HEDGE_DELAY = 0.2
+MIN_SAMPLES = 20
+
+
+class HedgePolicy:
+    """
+    Decides how long to wait for the first token before hedging (a percentile of recent time-to-first-token)
+    and caps hedged requests at `max_ratio` of all streamed requests.
+    """
+
+    def __init__(
+        self,
+        percentile: float = DEFAULT_HEDGE_PERCENTILE,
+        max_ratio: float = DEFAULT_HEDGE_MAX_RATIO,
+        default_delay: float = DEFAULT_HEDGE_DELAY,
+        min_delay: float = MIN_HEDGE_DELAY,
+    ):
+        """
+        :param percentile: 使用首个 token 延迟的哪个百分位作为对冲等待时间
+        :param max_ratio: 对冲请求数占请求总数的上限
+        :param default_delay: 样本不足 MIN_SAMPLES 时的等待时间（秒）
+        :param min_delay: 等待时间的下限（秒）
+        """
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self._ttft = RollingHistogram(window=256)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self) -> float:
+        """等待首个 token 的时间（秒），超过后发出对冲请求"""
+        if len(self._ttft) < MIN_SAMPLES:
+            return self.default_delay
+        return max(self.min_delay, self._ttft.percentile(self.percentile))
+
+    def observe_ttft(self, seconds: float) -> None:
+        self._ttft.observe(seconds)
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def try_acquire(self) -> bool:
+        """预算允许时占用一次对冲名额"""
+        with self._lock:
+            if self.hedges + 1 > self.max_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def record_hedge_win(self) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {"all": {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_ratio": self.hedges / self.requests if self.requests else 0.0,
+                "delay_seconds": self.delay(),
+            }}
+
+
+class _Leg:
+    """
+    One request of a hedged pair. A background thread opens the stream and reads up to the first content
+    chunk; the consumer then continues iterating the same iterator once this leg has won. The leg's scheduler
+    slot (if any) is released as soon as it is cancelled or closed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        open_stream: Callable[[CancellationToken], Iterator],
+        results: queue.Queue,
+        slot: Optional[Slot] = None,
+    ):
+        self.name = name
+        self.cancel_token = CancellationToken()
+        self.slot = slot
+        if slot is not None:
+            self.cancel_token.add_callback(slot.release)
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.buffered: List = []
+        self.iterator: Optional[Iterator] = None
+        self.error: Optional[BaseException] = None
+        self._open_stream = open_stream
+        self._results = results
+        self._lock = threading.Lock()
+        self._finished = False
+        self._discarded = False
+        threading.Thread(target=self._run, name=f"hedge-{name}", daemon=True).start()
+
+    def _run(self) -> None:
+        try:
+            self.iterator = iter(self._open_stream(self.cancel_token))
+            for chunk in self.iterator:
+                self.buffered.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    self.first_token_at = time.perf_counter()
+                    break
+        except Exception as e:
+            self.error = e
+        with self._lock:
+            self._finished = True
+            discarded = self._discarded
+        if discarded:
+            self._close()
+        else:
+            self._results.put(self)
+
+    def discard(self) -> None:
+        """取消这一路请求；读取线程已经结束时直接关闭迭代器，否则由读取线程自己关闭"""
+        self.cancel_token.cancel()
+        with self._lock:
+            self._discarded = True
+            finished = self._finished
+        if finished:
+            self._close()
+
+    def _close(self) -> None:
+        if self.iterator is not None and hasattr(self.iterator, "close"):
+            self.iterator.close()
+        if self.slot is not None:
+            self.slot.release()
+
+
+def hedged_stream(
+    open_primary: Callable[[CancellationToken], Iterator],
+    open_hedge: Callable[[CancellationToken], Iterator],
+    policy: HedgePolicy,
+    cancel_token: Optional[CancellationToken] = None,
+    acquire_slot: Optional[Callable[[], Optional[Slot]]] = None,
+) -> Generator:
+    """
+    Stream from the primary request, and if it has produced no content after `policy.delay()` seconds,
+    start a second request; whichever produces content first is streamed and the other one is cancelled.
+    Cancelling a leg releases its endpoint and slot right away; its HTTP response is closed as soon as
+    it exists (a leg still waiting for response headers has nothing to close yet).
+
+    :param open_primary: 发出主请求并返回流式输出，参数是这一路请求的取消令牌
+    :param open_hedge: 发出对冲请求并返回流式输出
+    :param policy: 对冲等待时间和预算
+    :param cancel_token: 调用方的取消令牌，取消时两路请求都会被取消
+    :param acquire_slot: 为对冲请求占用一个调度器 slot，没有空闲 slot 时返回 None，此时不发出对冲请求；
+        主请求使用调用方已经占用的 slot
+    """
+    policy.record_request()
+    results: "queue.Queue[_Leg]" = queue.Queue()
+    primary = _Leg("primary", open_primary, results)
+    legs = [primary]
+    if cancel_token is not None:
+        cancel_token.add_callback(primary.cancel_token.cancel)
+
+    delay = policy.delay()
+    try:
+        winner = results.get(timeout=delay)
+    except queue.Empty:
+        winner = None
+        slot = acquire_slot() if acquire_slot is not None else None
+        if acquire_slot is not None and slot is None:
+            logger.info(f"No first token after {delay:.2f}s, but no free slot for a hedged request")
+        elif policy.try_acquire():
+            logger.info(f"No first token after {delay:.2f}s, sending hedged request")
+            metrics.observe("hedge_delay_seconds", delay)
+            hedge = _Leg("hedge", open_hedge, results, slot)
+            legs.append(hedge)
+            if cancel_token is not None:
+                cancel_token.add_callback(hedge.cancel_token.cancel)
+        elif slot is not None:
+            slot.release()
+
+    # 先到的一路如果失败了，继续等另一路
+    pending = len(legs) - (winner is not None)
+    while winner is None or (winner.error is not None and pending):
+        winner = results.get()
+        pending -= 1
+
+    for leg in legs:
+        if leg is not winner:
+            leg.discard()
+    if winner is not primary and winner.slot is not None:
+        # 主请求已取消，调用方的 slot 空了出来，胜出的对冲请求改用它
+        winner.slot.release()
+    if primary.first_token_at is not None:
+        policy.observe_ttft(primary.first_token_at - primary.started_at)
+    elif winner is not primary:
+        # 主请求被取消时还没有输出，用已等待的时间作为其延迟的下限
+        policy.observe_ttft(time.perf_counter() - primary.started_at)
+    if winner.error is not None:
+        winner._close()
+        raise winner.error
+    if winner is not primary:
+        policy.record_hedge_win()
+        logger.info(f"Hedged request won after {time.perf_counter() - primary.started_at:.2f}s")
+
+    try:
+        yield from winner.buffered
+        yield from winner.iterator
+    finally:
+        winner._close()
@@ -1,17 +1,33 @@
 import json
+import time
 
 # from llama_cpp import Llama
-from openai import OpenAI
 from loguru import logger
-from utils.log.logger_config import setup_logger
-from utils.tools.toolkits import TOOLS_LIST, TOOLS_MAP
-from utils.tools.tool_utils import create_tools_call_completion
+from utils.log.logger_config import setup_logger, clip
+from utils.chat.cache import ResponseCache, replay_as_stream, tee_stream
+from utils.chat.coalesce import InFlightRequests
+from utils.chat.streaming import CancellationToken
+from utils.chat.router import Endpoint, EndpointRouter, Lease, DEFAULT_MAX_CONCURRENCY
+from utils.chat.scheduler import BACKGROUND, INTERACTIVE, RequestCancelled, RequestScheduler, hold_slot
+from utils.chat.tokens import token_estimator
+from utils.chat.hedging import HedgePolicy, hedged_stream, DEFAULT_HEDGE_MAX_RATIO, DEFAULT_HEDGE_PERCENTILE
+from utils.chat.profiles import GenerationProfile
+from utils.chat.similarity import DEFAULT_SIMILARITY_THRESHOLD
+from utils.metrics.metrics import metrics, RequestTrace, observe_stream
 
-from typing import List, Dict, Generator, Optional
+from typing import Any, List, Dict, Generator, Iterable, Optional, Tuple
 from functools import partial
 
 
 DEFAULT_MODEL = "qwen2:1.5b"
+# Ollama 默认在模型空闲 5 分钟后将其卸载，保活请求的间隔需要比这个时间短
+DEFAULT_KEEP_ALIVE_INTERVAL = 240  # 秒
+# 预热请求超过这个耗时，认为模型是从磁盘重新加载的（冷启动）
+COLD_START_THRESHOLD = 1.0  # 秒
+# Ollama 默认的上下文长度（num_ctx），超出部分会被服务端静默截断
+DEFAULT_CONTEXT_WINDOW = 4096
+# 至少为回复保留的 token 数
+MIN_OUTPUT_TOKENS = 256
 DEFAULT_CONFIG = [
     {
         "model": DEFAULT_MODEL,
@@ -23,6 +39,10 @@ DEFAULT_CONFIG = [
             "max_tokens": 2048,
             "stream": True,
         },
+        "keep_alive_interval": DEFAULT_KEEP_ALIVE_INTERVAL,
+        "context_window": DEFAULT_CONTEXT_WINDOW,
+        "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+        "similarity_threshold": DEFAULT_SIMILARITY_THRESHOLD,
     }
 ]
 
@@ -32,8 +52,33 @@ class LLM:
     LLM class encapsulates the logic to load a pre-trained language model and generate text based on input prompts.
     """
 
-    def __init__(self, config_list: Optional[List] = None):
+    def __init__(self, config_list: Optional[List] = None, cache: Optional[ResponseCache] = None):
         logger.info("Loading model...")
+        self._explicit_config_list = config_list
+        # 在 config_list 中的所有接口之间分配请求
+        self.router = EndpointRouter()
+        metrics.register_gauges("endpoint", self.router.stats, label="endpoint")
+        # 请求按优先级排队，同时进行的请求数不超过所有接口的 max_concurrency 之和
+        self.scheduler = RequestScheduler(self.router.capacity)
+        metrics.register_gauges("scheduler", self.scheduler.stats, label="priority")
+        # 相同的流式请求进行中时，新的调用订阅它的输出，而不是再发一次
+        self.in_flight = InFlightRequests()
+        metrics.register_gauges("coalescing", self.in_flight.stats, label="scope")
+        self._load_config()
+        self.system_prompt = (
+            "You are responsible for rephrasing, summarizing, or editing various text snippets to make them more "
+            "concise, coherent, and engaging. You are also responsible for writing emails, messages, and other forms "
+            "of communication."
+        )
+        
+        # openai 客户端在第一次使用时才创建，避免启动时导入 openai/httpx
+        self._client = None
+        self.cache = cache if cache is not None else ResponseCache()
+        # 最近一次用户请求的时间（time.monotonic），供保活调度判断用户是否空闲
+        self.last_activity = time.monotonic()
+        logger.info("Model loaded successfully.")
+
+    def _load_config(self) -> None:
         try:
             with open("settings/settings.json", "r", encoding="utf-8") as f:
                 settings: Dict[str,Dict] = json.load(f)
@@ -46,53 +91,455 @@ class LLM:
                         "top_p": settings["advanced"].get("top_p", 0.5),
                         "max_tokens": settings["advanced"].get("max_tokens", 2048),
                         "stream": settings["advanced"].get("stream", True)
-                    }
+                    },
+                    "keep_alive_interval": float(
+                        settings["advanced"].get("keep_alive_interval", DEFAULT_KEEP_ALIVE_INTERVAL)
+                    ),
+                    "context_window": int(settings["advanced"].get("context_window", DEFAULT_CONTEXT_WINDOW)),
+                    "max_concurrency": int(settings["advanced"].get("max_concurrency", DEFAULT_MAX_CONCURRENCY)),
+                    # 基础结果生成完毕后在后台预生成所有语气的改写
+                    "speculative_rewrites": bool(settings["advanced"].get("speculative_rewrites", False)),
+                    # 与之前的输入足够相似时先显示之前的结果，0 表示关闭
+                    "similarity_threshold": float(
+                        settings["advanced"].get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD)
+                    ),
+                    "hedge": {
+                        "enabled": bool(settings["advanced"].get("hedging", False)),
+                        "model": settings["advanced"].get("hedge_model"),
+                        "max_ratio": float(settings["advanced"].get("hedge_max_ratio", DEFAULT_HEDGE_MAX_RATIO)),
+                        "percentile": float(settings["advanced"].get("hedge_percentile", DEFAULT_HEDGE_PERCENTILE)),
+                    },
                 }
                 saved_config_list = [config]
+                # 额外的接口只需填写与主接口不同的字段，采样参数与主接口相同
+                for extra in settings["general"].get("endpoints", []):
+                    saved_config_list.append({**config, **{k: v for k, v in extra.items() if k not in ("params", "hedge")}})
                 logger.info("Settings loaded successfully, using custom config."+str(config))
         except Exception as e:
             logger.error(f"Failed to load settings.json: {e}, using default config instead.")
             saved_config_list = DEFAULT_CONFIG
-        self.config_list = config_list if config_list else saved_config_list
+        self.config_list = self._explicit_config_list if self._explicit_config_list else saved_config_list
         self.defult_config = self.config_list[0]
-        self.system_prompt = (
-            "You are responsible for rephrasing, summarizing, or editing various text snippets to make them more "
-            "concise, coherent, and engaging. You are also responsible for writing emails, messages, and other forms "
-            "of communication."
+        self.router.configure(self.config_list)
+        if len(self.config_list) > 1:
+            logger.info(f"Routing requests across {len(self.config_list)} endpoints: {list(self.router.stats())}")
+
+        self.hedge_policy = None
+        hedge = self.defult_config.get("hedge") or {}
+        if hedge.get("enabled"):
+            if hedge.get("model") or len(self.config_list) > 1:
+                self.hedge_policy = HedgePolicy(
+                    percentile=hedge.get("percentile", DEFAULT_HEDGE_PERCENTILE),
+                    max_ratio=hedge.get("max_ratio", DEFAULT_HEDGE_MAX_RATIO),
+                )
+                metrics.register_gauges("hedging", self.hedge_policy.stats, label="scope")
+                logger.info(f"Hedged requests enabled: {hedge}")
+            else:
+                logger.warning("Hedging needs a second endpoint or a hedge_model, hedged requests disabled")
+
+    def reload_settings(self) -> None:
+        """
+        Re-read settings/settings.json after it was saved or reset. The client is recreated on next use.
+        """
+        self._load_config()
+        self._client = None
+        logger.info(f"Settings reloaded, using model {self.defult_config['model']} at {self.defult_config['base_url']}")
+
+    @property
+    def keep_alive_interval(self) -> float:
+        """保活请求的间隔（秒），小于等于 0 表示关闭保活"""
+        return float(self.defult_config.get("keep_alive_interval", DEFAULT_KEEP_ALIVE_INTERVAL))
+
+    @property
+    def context_window(self) -> int:
+        """模型的上下文长度（token）"""
+        return int(self.defult_config.get("context_window", DEFAULT_CONTEXT_WINDOW))
+
+    @property
+    def speculative_rewrites(self) -> bool:
+        """是否预生成语气改写，默认关闭（会额外发出请求）"""
+        return bool(self.defult_config.get("speculative_rewrites", False))
+
+    @property
+    def similarity_threshold(self) -> float:
+        """复用相似输入的结果所需的最低相似度，小于等于 0 表示关闭"""
+        return float(self.defult_config.get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD))
+
+    def output_reserve(self) -> int:
+        """为回复保留的 token 数：上下文的四分之一，介于 MIN_OUTPUT_TOKENS 和配置的 max_tokens 之间"""
+        max_tokens = int(self.defult_config["params"]["max_tokens"])
+        return min(max_tokens, max(MIN_OUTPUT_TOKENS, self.context_window // 4))
+
+    def prompt_budget(self) -> int:
+        """
+        Tokens available for the user prompt, after the system prompt and the space reserved for the reply.
+        """
+        system_tokens = token_estimator.count_messages([{"role": "system", "content": self.system_prompt}])
+        return max(0, self.context_window - self.output_reserve() - system_tokens)
+
+    def fit_max_tokens(self, messages: List[Dict]) -> int:
+        """
+        Estimate the prompt size and choose max_tokens so that prompt and reply fit the context window.
+        Oversized prompts are logged rather than sent silently.
+
+        :param messages: 要发送的消息
+        :return: 本次请求使用的 max_tokens
+        """
+        prompt_tokens = token_estimator.count_messages(messages)
+        metrics.observe("prompt_tokens", prompt_tokens)
+        max_tokens = int(self.defult_config["params"]["max_tokens"])
+        remaining = self.context_window - prompt_tokens
+        if remaining < MIN_OUTPUT_TOKENS:
+            logger.warning(
+                f"Prompt of ~{prompt_tokens} tokens leaves {remaining} of the {self.context_window}-token "
+                f"context window for the reply, the server may truncate the prompt"
+            )
+        return max(1, min(max_tokens, max(remaining, MIN_OUTPUT_TOKENS)))
+
+    def warm_up(self) -> Dict[str, float]:
+        """
+        Send a one-token request to every endpoint so the servers load the model (and the system prompt)
+        before the user needs it. Bypasses the response cache and does not count as user activity.
+        The pings wait for a BACKGROUND scheduler slot, so they never compete with user requests, and
+        endpoints that are already serving a request (and so have the model loaded) are skipped.
+        Failures are logged and reported to the router instead of raised.
+
+        :return: Request latency in seconds per endpoint that answered.
+        """
+        latencies = {}
+        slot = self.scheduler.acquire(BACKGROUND)
+        try:
+            for endpoint in self.router.endpoints:
+                if not self.router.acquire_if_idle(endpoint):
+                    logger.info(f"Skipping warm-up of {endpoint.name}, it is serving requests")
+                    continue
+                try:
+                    elapsed = self._ping(endpoint)
+                finally:
+                    self.router.release(endpoint)
+                if elapsed is not None:
+                    latencies[endpoint.name] = elapsed
+        finally:
+            slot.release()
+        return latencies
+
+    def _ping(self, endpoint: Endpoint) -> Optional[float]:
+        """向 endpoint 发送预热请求，返回耗时（秒），失败时返回 None"""
+        model = endpoint.config["model"]
+        start = time.perf_counter()
+        try:
+            self._client_for(endpoint.config).chat.completions.create(
+                model = model,
+                messages=[
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": "Hi"},
+                ],
+                max_tokens=1,
+                stream=False,
+            )
+        except Exception as e:
+            logger.warning(f"Warm-up of {endpoint.name} failed: {e}")
+            self.router.record_failure(endpoint, e)
+            return None
+        elapsed = time.perf_counter() - start
+        # 预热延迟包含模型加载时间，不计入路由的 EWMA
+        self.router.record_success(endpoint)
+        metrics.observe("warmup_seconds", elapsed)
+        if elapsed >= COLD_START_THRESHOLD:
+            metrics.observe("cold_start_seconds", elapsed)
+            logger.warning(f"Cold start detected: warm-up of {endpoint.name} took {elapsed:.2f}s")
+        else:
+            logger.info(f"Warm-up of {endpoint.name} took {elapsed:.3f}s")
+        return elapsed
+
+    @property
+    def llm(self):
+        if self._client is None:
+            from utils.chat.clients import get_client
+            self._client = get_client(
+                base_url = self.defult_config["base_url"],
+                api_key = self.defult_config["api_key"], 
+            )
+        return self._client
+
+    @llm.setter
+    def llm(self, client):
+        self._client = client
+
+    def _client_for(self, config: Dict):
+        """
+        返回指定接口的客户端。有多个接口时关闭客户端自身的重试，失败后直接换下一个接口。
+        """
+        if config is self.defult_config:
+            client = self.llm
+        else:
+            from utils.chat.clients import get_client
+            client = get_client(base_url=config["base_url"], api_key=config["api_key"])
+        if len(self.router) > 1:
+            client = client.with_options(max_retries=0)
+        return client
+
+    def _cache_identity(self) -> Tuple[str, str]:
+        """缓存键中使用的接口地址和模型：同一组接口返回的结果视为可以互相替代"""
+        return (
+            ",".join(config["base_url"] for config in self.config_list),
+            ",".join(config["model"] for config in self.config_list),
         )
-        
-        self.llm = OpenAI(
-            base_url = self.defult_config["base_url"],
-            api_key = self.defult_config["api_key"], 
+
+    def _create_completion(
+        self,
+        messages: List[Dict],
+        first: Optional[Endpoint] = None,
+        exclude: Iterable[Endpoint] = (),
+        cancel_token: Optional[CancellationToken] = None,
+        **kwargs: Any,
+    ) -> Tuple[Lease, Any, float]:
+        """
+        Send the request to the best endpoint, failing over to the next one on connection errors,
+        timeouts, rate limiting and server errors.
+
+        :param first: 已经通过 router.acquire 选好的接口，优先使用
+        :param exclude: 不使用的接口
+        :param cancel_token: 取消时立即归还接口，不必等流被读取或关闭
+        :param kwargs: 覆盖接口配置中的请求参数，例如 model 和 stream
+        :return: The lease on the endpoint that accepted the request, the response and the send time.
+        """
+        from openai import APIConnectionError, InternalServerError, RateLimitError
+
+        tried: List[Endpoint] = list(exclude)
+        endpoint = first
+        last_error: Optional[Exception] = None
+        while True:
+            if endpoint is None:
+                # 可用的接口都已满载时在这里等待，保证每个接口的并发数不超过 max_concurrency
+                endpoint = self.router.acquire(exclude=tried, cancel_token=cancel_token)
+            if endpoint is None:
+                if cancel_token is not None and cancel_token.cancelled:
+                    raise RequestCancelled("Request cancelled while waiting for a free endpoint")
+                raise last_error or RuntimeError("No endpoint available: all endpoints failed or stayed busy")
+            lease = Lease(self.router, endpoint)
+            if cancel_token is not None:
+                cancel_token.add_callback(lease.release)
+            config = endpoint.config
+            params = config["params"]
+            request = {
+                "model": config["model"],
+                "temperature": params["temperature"],
+                "max_tokens": int(params["max_tokens"]),
+                "stream": params["stream"],
+            }
+            request.update((key, value) for key, value in kwargs.items() if value is not None)
+            start = time.perf_counter()
+            try:
+                response = self._client_for(config).chat.completions.create(messages=messages, **request)
+            except (APIConnectionError, InternalServerError, RateLimitError) as e:
+                lease.release()
+                self.router.record_failure(endpoint, e)
+                tried.append(endpoint)
+                last_error = e
+                endpoint = None
+                if len(tried) < len(self.router):
+                    logger.warning(f"Request to {request['model']}@{config['base_url']} failed: {e}, retrying on another endpoint")
+                continue
+            except Exception:
+                lease.release()
+                raise
+            return lease, response, start
+
+    def _track_stream(
+        self,
+        lease: Lease,
+        stream: Iterable,
+        start: float,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Generator:
+        """透传流式输出，把首个 token 的延迟和流的成败报告给路由；取消导致的中断不算接口故障"""
+        endpoint = lease.endpoint
+        first_token = True
+        completed = False
+        try:
+            for chunk in stream:
+                if first_token and chunk.choices and chunk.choices[0].delta.content:
+                    first_token = False
+                    self.router.record_success(endpoint, time.perf_counter() - start)
+                yield chunk
+            completed = True
+        except Exception as e:
+            if cancel_token is None or not cancel_token.cancelled:
+                self.router.record_failure(endpoint, e)
+            elif first_token:
+                # 被取消时还没有输出（例如对冲请求中落后的一路），已等待的时间是首个 token 延迟的下限
+                self.router.record_latency(endpoint, time.perf_counter() - start)
+            raise
+        finally:
+            lease.release()
+            if not completed and hasattr(stream, "close"):
+                stream.close()
+
+    def _open_stream(
+        self,
+        messages: List[Dict],
+        cancel_token: Optional[CancellationToken],
+        first: Optional[Endpoint] = None,
+        exclude: Iterable[Endpoint] = (),
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+    ) -> Generator:
+        """
+        发出流式请求；取消令牌被取消时立即关闭 HTTP 连接并归还接口。
+        流在第一次迭代之前被取消或丢弃时 _track_stream 的 finally 不会执行，因此归还接口也挂在令牌上。
+        """
+        lease, response, start = self._create_completion(
+            messages, first=first, exclude=exclude, cancel_token=cancel_token,
+            model=model, max_tokens=max_tokens, stop=stop, stream=True,
         )
-        self.generate_with_tools = partial(create_tools_call_completion, tools = TOOLS_LIST, function_map = TOOLS_MAP)
-        logger.info("Model loaded successfully.")
+        config = lease.endpoint.config
+        logger.info(f"Streaming response from {model or config['model']}@{config['base_url']}")
+        if cancel_token is not None:
+            cancel_token.add_callback(response.close)
+        return self._track_stream(lease, response, start, cancel_token)
+
+    def _hedged_stream(
+        self,
+        messages: List[Dict],
+        cancel_token: Optional[CancellationToken],
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+    ) -> Generator:
+        """
+        主请求迟迟没有首个 token 时，向另一个接口（或配置的 hedge_model）发出相同的请求，先出 token 的一路胜出。
+        """
+        hedge_model = self.defult_config["hedge"].get("model")
+        primary: List[Endpoint] = []
+
+        def open_primary(token: CancellationToken) -> Generator:
+            endpoint = self.router.acquire(cancel_token=token)
+            if endpoint is None:
+                if token.cancelled:
+                    raise RequestCancelled("Request cancelled while waiting for a free endpoint")
+                raise RuntimeError("No endpoint available: all endpoints stayed busy")
+            primary.append(endpoint)
+            return self._open_stream(messages, token, first=primary[0], max_tokens=max_tokens, stop=stop)
+
+        def open_hedge(token: CancellationToken) -> Generator:
+            # 配置了 hedge_model 时可以使用同一个接口上的另一个模型，否则必须换一个接口
+            return self._open_stream(
+                messages, token, exclude=() if hedge_model else primary, model=hedge_model, max_tokens=max_tokens, stop=stop
+            )
+
+        # 对冲请求占用自己的 slot，总并发数仍不超过调度器的容量
+        return hedged_stream(
+            open_primary, open_hedge, self.hedge_policy, cancel_token, acquire_slot=self.scheduler.try_acquire
+        )
+
+    def generate_with_tools(self, messages: List[Dict], **kwargs):
+        """
+        Generate a response that may call the local tools. Tool schemas are built on the first call.
+        """
+        from utils.tools.toolkits import TOOLS_MAP, get_tools_list
+        from utils.tools.tool_utils import create_tools_call_completion
+        self.last_activity = time.monotonic()
+        return create_tools_call_completion(messages, tools=get_tools_list(), function_map=TOOLS_MAP, **kwargs)
 
     def generate(
-        self, text: str
+        self,
+        text: str,
+        cancel_token: Optional[CancellationToken] = None,
+        trace: Optional[RequestTrace] = None,
+        profile: Optional[GenerationProfile] = None,
+        priority: int = INTERACTIVE,
+        queue_key: Optional[str] = None,
     ) -> str | Generator:
         """
         Generate a response from the language model based on the provided text.
+        The request goes to the fastest healthy endpoint in `config_list` and fails over to the others.
 
         :param text: Input text prompt for the model.
-        :param max_tokens: Maximum number of tokens to generate.
-        :param temperature: Sampling temperature for generation.
+        :param cancel_token: Cancelling it closes the underlying HTTP stream immediately, unless identical
+            requests coalesced onto the same stream are still reading it.
+        :param trace: Timeline of the request, receives time-to-first-token and decode rate.
+        :param profile: Per-task max_tokens scaling, stop sequences and early stopping, see PromptTemplate.profile.
+        :param priority: Scheduling class, see utils.chat.scheduler; higher-priority requests get free slots first.
+        :param queue_key: A newer request with the same key replaces this one while it is still queued.
         :return: Generated text response.If "stream" is True, a generator is returned.
+        :raises RequestCancelled: Cancelled or superseded while waiting for a free slot.
         """
-        logger.info(f"Generating response for text: {text}")
-        response = self.llm.chat.completions.create(
-            model = self.defult_config["model"],
-            messages=[
+        logger.opt(lazy=True).info("Generating response for text: {}", lambda: clip(text))
+        self.last_activity = time.monotonic()
+        params = self.defult_config["params"]
+        if profile is not None:
+            # 设置中的 max_tokens 仍是上限
+            params = {
+                **params,
+                "max_tokens": min(int(params["max_tokens"]), profile.max_tokens_for(text)),
+                "stop": profile.stop or None,
+            }
+        stop = params.get("stop")
+        base_url, model = self._cache_identity()
+        cache_key = ResponseCache.make_key(base_url, model, self.system_prompt, text, params)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.info("Cache hit, replaying cached response")
+            if params["stream"]:
+                return observe_stream(replay_as_stream(cached, self.defult_config["model"]), trace)
+            if trace is not None:
+                trace.first_token()
+                trace.complete(0)
+            return cached
+        if params["stream"]:
+            shared = self.in_flight.join(cache_key, cancel_token)
+            if shared is not None:
+                return observe_stream(shared, trace)
+
+        slot = self.scheduler.acquire(priority, cancel_token, key=queue_key)
+        flight = None
+        if params["stream"]:
+            # 排队期间相同的请求可能已经发出
+            flight, shared = self.in_flight.start(cache_key, cancel_token)
+            if flight is None:
+                slot.release()
+                return observe_stream(shared, trace)
+            # 上游请求使用共享的令牌，所有订阅者都离开后才会被取消
+            cancel_token = flight.cancel_token
+        if cancel_token is not None:
+            # 被取消的流可能不会再被读取，不能只依赖流结束时释放
+            cancel_token.add_callback(slot.release)
+        try:
+            if trace is not None:
+                trace.request_sent()
+            messages = [
                 {"role": "system", "content": self.system_prompt},
                 {"role": "user", "content": text},
-            ],
-            temperature=self.defult_config["params"]["temperature"],
-            max_tokens=self.defult_config["params"]["max_tokens"],
-            stream=self.defult_config["params"]["stream"],
-        )
-        if self.defult_config["params"]["stream"]:
-            logger.info("Streaming response")
-            return response
-        else:
-            logger.info("Response: {}".format(response))
-            return response.choices[0].message.content
\ No newline at end of file
+            ]
+            max_tokens = min(self.fit_max_tokens(messages), int(params["max_tokens"]))
+            if params["stream"]:
+                if self.hedge_policy is not None:
+                    stream = self._hedged_stream(messages, cancel_token, max_tokens=max_tokens, stop=stop)
+                else:
+                    stream = self._open_stream(messages, cancel_token, max_tokens=max_tokens, stop=stop)
+                stream = hold_slot(stream, slot)
+                if profile is not None:
+                    stream = profile.apply_early_stop(stream, self.defult_config["model"], text)
+                flight.attach(tee_stream(stream, partial(self.cache.set, cache_key)))
+                return observe_stream(shared, trace)
+            lease, response, start = self._create_completion(messages, max_tokens=max_tokens, stop=stop, stream=False)
+        except BaseException as e:
+            slot.release()
+            if flight is not None:
+                flight.fail(e)
+            raise
+        finally:
+            if not params["stream"]:
+                slot.release()
+        self.router.record_success(lease.endpoint, time.perf_counter() - start)
+        lease.release()
+        logger.opt(lazy=True).info("Response: {}", lambda: clip(response))
+        content = response.choices[0].message.content
+        if profile is not None:
+            content = profile.trim(content, text)
+        if trace is not None:
+            trace.first_token()
+            trace.complete(response.usage.completion_tokens if response.usage else 0)
+        self.cache.set(cache_key, content)
+        return content
\ No newline at end of file
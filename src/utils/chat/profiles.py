@@ -0,0 +1,165 @@
+import re
+from typing import Callable, Generator, Iterable, List, Optional
+
+from loguru import logger
+
+from utils.chat.cache import make_chunk
+from utils.chat.tokens import estimate_tokens
+
+
+# 接口最多接受 4 个停止序列
+MAX_STOP_SEQUENCES = 4
+
+# 一行以逗号、顿号分隔的关键词中每一项的最大长度，更长说明模型在输出句子
+MAX_ITEM_CHARS = 40
+# 至少有这么多项才认为列表已经输出
+MIN_LIST_ITEMS = 2
+MIN_INLINE_ITEMS = 3
+_LIST_ITEM = re.compile(r"^\s*(?:[-*•]|\d+[.)、]|[（(]?\d+[)）])\s*\S")
+_INLINE_SEPARATOR = re.compile(r"\s*[,，、;；]\s*")
+# 回复正文之后另起一段的说明，例如“注：……”
+# 流式输出时只在出现空行之后的这么多个字符内调用 complete_at，足够覆盖“**Explanation**:”之类的标记
+COMPLETION_WINDOW = 32
+_BLANK_LINE = re.compile(r"\n[ \t\r]*\n")
+_TRAILING_NOTE = re.compile(r"\n\s*\n\s*(?:\*\*)?(?:Note|Notes|Explanation|注|注意|说明|解释)(?:\*\*)?\s*[:：]", re.I)
+
+
+def _inline_list(line: str) -> bool:
+    """一行以逗号、顿号或分号分隔的关键词"""
+    if line.endswith((":", "：")):
+        return False
+    items = [item for item in _INLINE_SEPARATOR.split(line.rstrip("。.")) if item]
+    return len(items) >= MIN_INLINE_ITEMS and all(len(item) <= MAX_ITEM_CHARS for item in items)
+
+
+def list_complete(text: str) -> Optional[int]:
+    """
+    关键词列表输出完毕的位置：空行之前是至少 MIN_LIST_ITEMS 个带列表标记的行，或一行以逗号、顿号分隔的关键词。
+    列表之前不带列表标记的行（如“关键词：”“以下是提取的关键词”）视为标题，其后的空行不算列表结束。
+
+    :return: 应保留的文本长度，列表尚未完整时返回 None
+    """
+    index = text.find("\n\n", len(text) - len(text.lstrip()))
+    while index != -1:
+        lines = [line.strip() for line in text[:index].splitlines() if line.strip()]
+        start = 0
+        while start < len(lines) and not _LIST_ITEM.match(lines[start]) and not _inline_list(lines[start]):
+            start += 1
+        items = lines[start:]
+        if items:
+            if len(items) == 1 and _inline_list(items[0]):
+                return index
+            if len(items) >= MIN_LIST_ITEMS and all(_LIST_ITEM.match(line) for line in items):
+                return index
+            # 列表之后紧跟着其他内容，不是单纯的关键词列表
+            return None
+        index = text.find("\n\n", index + 2)
+    return None
+
+
+def trailing_note(text: str) -> Optional[int]:
+    """正文之后开始输出附加说明的位置，改写、翻译等任务只需要正文"""
+    match = _TRAILING_NOTE.search(text)
+    return match.start() if match else None
+
+
+class GenerationProfile:
+    """
+    Per-task generation settings: a decode budget that scales with the input, stop sequences, and an
+    optional check that ends the stream as soon as the output format is satisfied.
+    """
+
+    __slots__ = ("name", "base_tokens", "tokens_per_input_token", "max_tokens", "stop", "complete_at", "unless_in_prompt")
+
+    def __init__(
+        self,
+        name: str,
+        base_tokens: int = 256,
+        tokens_per_input_token: float = 1.0,
+        max_tokens: Optional[int] = None,
+        stop: Iterable[str] = (),
+        complete_at: Optional[Callable[[str], Optional[int]]] = None,
+        unless_in_prompt: bool = False,
+    ):
+        """
+        :param name: 配置名称，用于日志和缓存键
+        :param base_tokens: 与输入长度无关的基础 token 数
+        :param tokens_per_input_token: 每个输入 token 额外允许的输出 token 数
+        :param max_tokens: 上限，None 表示只受设置中的 max_tokens 限制
+        :param stop: 停止序列，最多 MAX_STOP_SEQUENCES 个
+        :param complete_at: 接收已输出的文本，输出格式已经完整时返回应保留的长度，否则返回 None；
+            流式输出时只在空行及其后 COMPLETION_WINDOW 个字符内调用
+        :param unless_in_prompt: complete_at 在提示词上也成立时不提前结束，例如原文本身就有“注：”段落，
+            改写或翻译的结果中也应保留
+        """
+        self.name = name
+        self.base_tokens = base_tokens
+        self.tokens_per_input_token = tokens_per_input_token
+        self.max_tokens = max_tokens
+        self.stop: List[str] = list(stop)[:MAX_STOP_SEQUENCES]
+        self.complete_at = complete_at
+        self.unless_in_prompt = unless_in_prompt
+
+    def max_tokens_for(self, prompt: str) -> int:
+        """根据提示词长度计算本次请求的 max_tokens"""
+        budget = self.base_tokens + int(self.tokens_per_input_token * estimate_tokens(prompt))
+        return budget if self.max_tokens is None else min(budget, self.max_tokens)
+
+    def completion_check(self, prompt: Optional[str] = None) -> Optional[Callable[[str], Optional[int]]]:
+        """本次请求使用的 complete_at，不需要检查时返回 None"""
+        if self.complete_at is None:
+            return None
+        if self.unless_in_prompt and prompt is not None and self.complete_at(prompt) is not None:
+            logger.debug(f"Prompt of {self.name} already matches its completion check, not stopping early")
+            return None
+        return self.complete_at
+
+    def trim(self, text: str, prompt: Optional[str] = None) -> str:
+        """非流式回复：去掉输出格式完整之后的部分"""
+        complete_at = self.completion_check(prompt)
+        end = complete_at(text) if complete_at is not None else None
+        return text if end is None else text[:end]
+
+    def apply_early_stop(self, stream: Iterable, model: str, prompt: Optional[str] = None) -> Generator:
+        """
+        Pass the stream through until `complete_at` reports the output complete, then emit the kept part
+        of the last chunk and close the upstream so the server stops decoding.
+        Both formats end at a paragraph break, so the check only runs when a blank line has just arrived
+        and for the next COMPLETION_WINDOW characters, not on every chunk.
+        """
+        complete_at = self.completion_check(prompt)
+        if complete_at is None:
+            yield from stream
+            return
+        parts: List[str] = []
+        length = 0
+        tail = ""  # 上一个 chunk 结尾的几个字符，空行可能跨越两个 chunk
+        window = -1  # 空行之后还需要检查的字符数，小于 0 表示不检查
+        try:
+            for chunk in stream:
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if not content:
+                    yield chunk
+                    continue
+                previous, length = length, length + len(content)
+                parts.append(content)
+                if any(match.end() > len(tail) for match in _BLANK_LINE.finditer(tail + content)):
+                    window = COMPLETION_WINDOW
+                else:
+                    window -= len(content)
+                tail = (tail + content)[-8:]
+                end = complete_at("".join(parts)) if window >= 0 else None
+                if end is None:
+                    yield chunk
+                    continue
+                if end > previous:
+                    yield make_chunk(content[:end - previous], model)
+                yield make_chunk(None, model, finish_reason="stop")
+                logger.info(f"Output of {self.name} complete after {end} chars, stopping early")
+                return
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+
+    def __repr__(self) -> str:
+        return f"GenerationProfile({self.name!r})"
@@ -1,3 +1,8 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.chat.profiles import GenerationProfile, list_complete, trailing_note
+from utils.chat.tokens import estimate_tokens, truncate_to_tokens
+
+# TODO：先使用环境变量控制语言
 # LANGUAGE = "English"
 LANGUAGE = "Chinese"
 
@@ -7,6 +12,191 @@ ANSWER_USER_WITH_TOOLS_SYSTEM_PROMPT = """You are an intelligent assistant that
 If you use tools, just answer the question based on the output of the tool without any additional explanation. 
 On the other hand, if you don't use tools, answer the question directly as best as you can."""
 
+
+class PromptTemplate:
+    """
+    A prompt compiled once from a static instruction and a per-request body.
+
+    The instruction (with the session-wide fields such as the language filled in) always comes first and is
+    byte-for-byte identical across requests, so inference servers with prefix caching (llama.cpp/Ollama,
+    vLLM) can reuse the prefill of the system prompt and the instruction. The body holds everything that
+    changes per request, with the user text as early as the remaining fields allow.
+    """
+
+    __slots__ = ("name", "instruction", "body", "prefix", "profile")
+
+    def __init__(
+        self,
+        name: str,
+        instruction: str,
+        body: str = "{text}",
+        language: str = LANGUAGE,
+        profile: Optional[GenerationProfile] = None,
+    ):
+        """
+        :param name: 任务名，也是在 PromptRegistry 中的键
+        :param instruction: 固定的指令部分，只能包含 {language}
+        :param body: 每次请求不同的部分，包含 {text} 以及 index、total 等字段
+        :param language: 输出语言
+        :param profile: 这个任务的生成配置，传给 LLM.generate
+        """
+        self.name = name
+        self.instruction = instruction
+        self.body = body
+        self.prefix = instruction.format(language=language)
+        self.profile = profile
+
+    @property
+    def template(self) -> str:
+        """完整的模板字符串，可以用 format(text=..., language=...) 填充"""
+        return self.instruction + self.body
+
+    def render(self, text: str, **fields) -> str:
+        return self.prefix + self.body.format(text=text, **fields)
+
+    def build(self, text: str, token_budget: Optional[int] = None, **fields) -> Tuple[str, bool]:
+        """
+        Fill the template with the user text. If the result is over the token budget, the text is truncated
+        (at a paragraph or sentence boundary where possible) so that the whole prompt fits.
+
+        :param text: User text.
+        :param token_budget: Maximum estimated tokens for the whole prompt, None for no limit.
+        :param fields: Other body fields, e.g. index and total.
+        :return: The prompt, and whether the text had to be truncated.
+        """
+        prompt = self.render(text, **fields)
+        if token_budget is None or estimate_tokens(prompt) <= token_budget:
+            return prompt, False
+        overhead = estimate_tokens(self.render("", **fields))
+        return self.render(truncate_to_tokens(text, token_budget - overhead), **fields), True
+
+    def __repr__(self) -> str:
+        return f"PromptTemplate({self.name!r})"
+
+
+class PromptRegistry:
+    """Compiled prompt templates keyed by task name."""
+
+    def __init__(self, templates: Iterable[PromptTemplate] = ()):
+        self._templates: Dict[str, PromptTemplate] = {}
+        for template in templates:
+            self.register(template)
+
+    def register(self, template: PromptTemplate) -> None:
+        self._templates[template.name] = template
+
+    def get(self, name: str) -> PromptTemplate:
+        """:raises KeyError: 没有这个任务"""
+        return self._templates[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._templates
+
+    def names(self) -> List[str]:
+        return list(self._templates)
+
+
+TASK_NAMES = ["Summarize", "Compose Mail", "Fix Grammar", "Extract Keywords", "Explain", "Translate"]
+EDITOR_NAMES = ["Casual", "Formal", "Professional", "Technical", "Simple"]
+CHUNKED_TASK_NAMES = ["Summarize", "Extract Keywords", "Explain"]
+
+# 用户文本放在最后，前面的系统提示词和指令在同一任务的多次请求之间保持不变
+_TASK_INSTRUCTIONS = {
+    "Summarize": "Summarize the text below in {language}. Reply with the summary only.\n\nText:\n",
+    "Compose Mail": "Compose an email about the text below in {language}. Reply with the email only.\n\nText:\n",
+    "Fix Grammar": "Fix the grammar in the text below. Reply with the corrected text only.\n\nText:\n",
+    "Extract Keywords": "List the keywords in the text below in {language}. Reply with the keywords only.\n\nText:\n",
+    "Explain": "Explain the text below in {language}.\n\nText:\n",
+    "Translate": (
+        "Translate the following source text to **{language}**, Output translation directly without any additional text."
+        "\n\nSource Text:\n"
+    ),
+}
+
+# 所有语气共用同一段指令，语气放在文本之后：同一段文本常被连续改写成多种语气，这样文本部分也能命中前缀缓存
+_EDITOR_INSTRUCTION = (
+    "Rewrite the text below in {language} in the tone given after it. Reply with the rewritten text only.\n\nText:\n"
+)
+
+# 分块处理时 map 提示词的块序号放在文本之前，其余部分与普通任务一样保持不变
+_CHUNK_INSTRUCTIONS = {
+    "Summarize": (
+        "Summarize one part of a longer text in {language}. Reply with the summary only.\n\n",
+        "The following are summaries of consecutive parts of a longer text. "
+        "Combine them into one coherent summary in {language}. Reply with the summary only.\n\n",
+    ),
+    "Extract Keywords": (
+        "List the keywords in one part of a longer text in {language}. Reply with the keywords only.\n\n",
+        "The following are keyword lists extracted from consecutive parts of a longer text. Merge them into one list "
+        "in {language}, removing duplicates and keeping the most important keywords first. Reply with the keywords only.\n\n",
+    ),
+    "Explain": (
+        "Explain one part of a longer text in {language}.\n\n",
+        "The following are explanations of consecutive parts of a longer text. "
+        "Combine them into one coherent explanation of the whole text in {language}.\n\n",
+    ),
+}
+
+
+# 输出长度按输入长度缩放：关键词列表很短，改写和翻译与原文相当，摘要只有原文的一部分
+_PROMPT_ECHO = "\nText:"
+_TASK_PROFILES = {
+    "Summarize": GenerationProfile("Summarize", base_tokens=128, tokens_per_input_token=0.5, max_tokens=1024, stop=[_PROMPT_ECHO]),
+    "Compose Mail": GenerationProfile("Compose Mail", base_tokens=512, tokens_per_input_token=0.5, stop=[_PROMPT_ECHO]),
+    "Fix Grammar": GenerationProfile(
+        "Fix Grammar", base_tokens=32, tokens_per_input_token=1.2, stop=[_PROMPT_ECHO],
+        complete_at=trailing_note, unless_in_prompt=True,
+    ),
+    "Extract Keywords": GenerationProfile(
+        "Extract Keywords", base_tokens=64, tokens_per_input_token=0.1, max_tokens=256, stop=[_PROMPT_ECHO],
+        complete_at=list_complete,
+    ),
+    "Explain": GenerationProfile("Explain", base_tokens=256, tokens_per_input_token=1.0, stop=[_PROMPT_ECHO]),
+    # 译文的 token 数可能明显多于原文，例如英译中
+    "Translate": GenerationProfile(
+        "Translate", base_tokens=64, tokens_per_input_token=2.0, stop=["\nSource Text:"],
+        complete_at=trailing_note, unless_in_prompt=True,
+    ),
+}
+_EDITOR_PROFILE = GenerationProfile(
+    "Rewrite", base_tokens=64, tokens_per_input_token=1.5, stop=["\nTone:", _PROMPT_ECHO],
+    complete_at=trailing_note, unless_in_prompt=True,
+)
+
+
+def map_prompt_name(task: str) -> str:
+    return f"{task}/map"
+
+
+def reduce_prompt_name(task: str) -> str:
+    return f"{task}/reduce"
+
+
+def build_registry(language: str = LANGUAGE) -> PromptRegistry:
+    """
+    Compile the task, editor and chunk (map/reduce) prompts for the given output language.
+
+    :param language: 输出语言
+    """
+    registry = PromptRegistry()
+    for task in TASK_NAMES:
+        registry.register(PromptTemplate(task, _TASK_INSTRUCTIONS[task], language=language, profile=_TASK_PROFILES[task]))
+    for editor in EDITOR_NAMES:
+        registry.register(PromptTemplate(
+            editor, _EDITOR_INSTRUCTION, "{text}\n\nTone: " + editor.lower(), language=language, profile=_EDITOR_PROFILE
+        ))
+    for task, (map_instruction, reduce_instruction) in _CHUNK_INSTRUCTIONS.items():
+        profile = _TASK_PROFILES[task]
+        registry.register(PromptTemplate(
+            map_prompt_name(task), map_instruction, "Part {index} of {total}:\n{text}", language=language, profile=profile
+        ))
+        registry.register(PromptTemplate(reduce_prompt_name(task), reduce_instruction, language=language, profile=profile))
+    return registry
+
+
+prompt_registry = build_registry()
+
+
 def get_task_prompts():
     """
     Return a list of task prompts for various text processing tasks. Each prompt is designed to guide the language model
@@ -14,66 +204,7 @@ def get_task_prompts():
 
     :return: List of dictionaries, each containing a 'task' and its corresponding 'prompt'.
     """
-    return [
-        {
-            "task": "Summarize",
-            "prompt": """
-Summarize the text below in {language}:
-
-{text}
-
-Summary:
-""".strip(),
-        },
-        {
-            "task": "Compose Mail",
-            "prompt": """
-Compose an email about the text below in {language}:
-
-{text}
-
-Email:
-""".strip(),
-        },
-        {
-            "task": "Fix Grammar",
-            "prompt": """
-Fix the grammar in the text below:
-
-{text}
-
-Corrected Text:
-""".strip(),
-        },
-        {
-            "task": "Extract Keywords",
-            "prompt": """
-List the keywords in the text below in {language}:
-
-{text}
-
-Keywords:
-""".strip(),
-        },
-        {
-            "task": "Explain",
-            "prompt": """
-Explain the text below in {language}:
-
-{text}
-
-Explanation:
-""".strip(),
-        },
-        {
-            "task": "Translate",
-            "prompt": """
-Translate the following source text to **{language}**, Output translation directly without any additional text.
-Source Text: {text}
-Translated Text:
-""".strip(),
-        }
-    ]
+    return [{"task": task, "prompt": prompt_registry.get(task).template} for task in TASK_NAMES]
 
 
 def get_editor_prompts():
@@ -83,59 +214,17 @@ def get_editor_prompts():
 
     :return: List of dictionaries, each containing an 'editor' and its corresponding 'prompt'.
     """
+    return [{"editor": editor, "prompt": prompt_registry.get(editor).template} for editor in EDITOR_NAMES]
 
-    # ["Casual", "Formal", "Professional", "Technical", "Simple"]
-
-    return [
-        {
-            "editor": "Casual",
-            "prompt": """
-Rewrite the text below in a casual tone in {language}:
-
-{text}
-
-Rewritten Text:
-""".strip(),
-        },
-        {
-            "editor": "Formal",
-            "prompt": """
-Rewrite the text below in a formal tone in {language}:
-
-{text}
-
-Rewritten Text:
-""".strip(),
-        },
-        {
-            "editor": "Professional",
-            "prompt": """
-Rewrite the text below in a professional tone in {language}:
-
-{text}
-
-Rewritten Text:
-""".strip(),
-        },
-        {
-            "editor": "Technical",
-            "prompt": """
-Rewrite the text below in a technical tone in {language}:
-
-{text}
-
-Rewritten Text:
-
-""".strip(),
-        },
-        {
-            "editor": "Simple",
-            "prompt": """
-Rewrite the text below in a simple tone in {language}:
-
-{text}
-
-Rewritten Text:
-""".strip(),
-        },
-    ]
+
+def get_chunk_prompts() -> Dict[str, Dict[str, PromptTemplate]]:
+    """
+    Return the map and reduce prompts for tasks that can process a long text in chunks. The map prompt is applied to each
+    chunk separately, and the reduce prompt combines the partial outputs into the final answer.
+
+    :return: Dictionary mapping a task name to a dictionary with a 'map' and a 'reduce' template.
+    """
+    return {
+        task: {"map": prompt_registry.get(map_prompt_name(task)), "reduce": prompt_registry.get(reduce_prompt_name(task))}
+        for task in CHUNKED_TASK_NAMES
+    }
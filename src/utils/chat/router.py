@@ -0,0 +1,279 @@
+import time
+import threading
+from loguru import logger
+from typing import Dict, Iterable, List, Optional
+
+from utils.chat.streaming import CancellationToken
+from utils.log.logger_config import clip
+
+
+DEFAULT_EWMA_ALPHA = 0.3
+# 连续失败达到这个次数后熔断，熔断期间不再把请求发往该接口
+DEFAULT_FAILURE_THRESHOLD = 3
+# 熔断后多久允许一个试探请求通过（秒）
+DEFAULT_COOLDOWN = 30.0
+HEALTH_CHECK_INTERVAL = 15.0  # 秒
+# 每个接口同时处理的请求数，与服务端的并行能力一致（Ollama 的 OLLAMA_NUM_PARALLEL）
+DEFAULT_MAX_CONCURRENCY = 2
+# 所有可用接口都已满载时，等待空闲名额的最长时间（秒）
+DEFAULT_ACQUIRE_TIMEOUT = 30.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class Endpoint:
+    """One configured backend (base_url + model) with its latency estimate and circuit-breaker state."""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.name = endpoint_name(config)
+        self.max_concurrency = max(1, int(config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)))
+        self.ewma_latency: Optional[float] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.last_error = ""
+
+    def score(self) -> float:
+        """越小越优先；还没有延迟样本的接口得分为 0，会先被尝试"""
+        return (self.ewma_latency or 0.0) * (self.in_flight + 1)
+
+    def snapshot(self) -> Dict:
+        return {
+            "ewma_latency_seconds": round(self.ewma_latency, 4) if self.ewma_latency is not None else None,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "circuit_open": int(self.state != CLOSED),
+            "state": self.state,
+            "last_error": self.last_error,
+        }
+
+
+class Lease:
+    """An endpoint acquired for one request; release is idempotent so it can be tied to several exits."""
+
+    def __init__(self, router: "EndpointRouter", endpoint: Endpoint):
+        self.endpoint = endpoint
+        self._router = router
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._router.release(self.endpoint)
+
+
+def endpoint_name(config: Dict) -> str:
+    return f"{config['model']}@{config['base_url']}"
+
+
+class EndpointRouter:
+    """
+    Picks an endpoint for each request by EWMA time-to-first-token weighted by in-flight requests.
+    Endpoints that fail `failure_threshold` times in a row are taken out of rotation until a probe
+    (a live request after `cooldown`, or a background health check) succeeds.
+    """
+
+    def __init__(
+        self,
+        config_list: Iterable[Dict] = (),
+        alpha: float = DEFAULT_EWMA_ALPHA,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        cooldown: float = DEFAULT_COOLDOWN,
+    ):
+        """
+        :param config_list: 接口配置列表，格式与 LLM 的 config_list 相同
+        :param alpha: EWMA 中新样本的权重
+        :param failure_threshold: 触发熔断的连续失败次数
+        :param cooldown: 熔断后等待多久再放行试探请求（秒）
+        """
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        # 接口的并发数减少或配置变化时唤醒等待空闲名额的请求
+        self._freed = threading.Condition(self._lock)
+        self._endpoints: List[Endpoint] = []
+        self._health_thread: Optional[threading.Thread] = None
+        self.configure(config_list)
+
+    def configure(self, config_list: Iterable[Dict]) -> None:
+        """更新接口列表，保留仍在列表中的接口的统计数据"""
+        with self._lock:
+            existing = {endpoint.name: endpoint for endpoint in self._endpoints}
+            endpoints = []
+            for config in config_list:
+                endpoint = existing.get(endpoint_name(config)) or Endpoint(config)
+                endpoint.config = config
+                endpoint.max_concurrency = max(1, int(config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)))
+                endpoints.append(endpoint)
+            self._endpoints = endpoints
+            self._freed.notify_all()
+
+    @property
+    def endpoints(self) -> List[Endpoint]:
+        with self._lock:
+            return list(self._endpoints)
+
+    def __len__(self) -> int:
+        return len(self._endpoints)
+
+    def capacity(self) -> int:
+        """所有接口同时能处理的请求数之和"""
+        with self._lock:
+            return sum(endpoint.max_concurrency for endpoint in self._endpoints)
+
+    def acquire(
+        self,
+        exclude: Iterable[Endpoint] = (),
+        timeout: Optional[float] = DEFAULT_ACQUIRE_TIMEOUT,
+        cancel_token: Optional[CancellationToken] = None,
+    ) -> Optional[Endpoint]:
+        """
+        选出下一个请求使用的接口，并计入其并发数；使用完毕后必须调用 release。
+        可用的接口都已达到 max_concurrency 时等待其中一个空出名额。
+
+        :param exclude: 本次请求已经失败过的接口
+        :param timeout: 最多等待多久（秒），为 0 时不等待，为 None 时一直等待
+        :param cancel_token: 取消时停止等待
+        :return: 选中的接口；所有接口都已排除、等待超时或被取消时返回 None
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if cancel_token is not None:
+            cancel_token.add_callback(self._wake)
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                candidates = [endpoint for endpoint in self._endpoints if endpoint not in exclude]
+                if not candidates:
+                    return None
+                available = [
+                    endpoint for endpoint in candidates
+                    if endpoint.state == CLOSED or (endpoint.state == OPEN and now - endpoint.opened_at >= self.cooldown)
+                ]
+                if not available:
+                    # 所有接口都在熔断中，仍然尝试最早熔断的那个，而不是直接报错
+                    endpoint = min(candidates, key=lambda e: e.opened_at)
+                    break
+                free = [e for e in available if e.in_flight < e.max_concurrency]
+                if free:
+                    endpoint = min(free, key=lambda e: (e.score(), e.in_flight))
+                    if endpoint.state == OPEN:
+                        # 熔断冷却结束，放行这一个请求作为试探
+                        endpoint.state = HALF_OPEN
+                    break
+                remaining = None if deadline is None else deadline - now
+                if (cancel_token is not None and cancel_token.cancelled) or (remaining is not None and remaining <= 0):
+                    return None
+                self._freed.wait(remaining)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def acquire_if_idle(self, endpoint: Endpoint) -> bool:
+        """
+        没有请求在处理时计入 endpoint 的并发数，用于保活请求：接口正在处理请求说明模型已经加载。
+        返回 True 时使用完毕后必须调用 release。
+        """
+        with self._lock:
+            if endpoint.in_flight > 0:
+                return False
+            endpoint.in_flight += 1
+            return True
+
+    def _wake(self) -> None:
+        with self._lock:
+            self._freed.notify_all()
+
+    def release(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.in_flight -= 1
+            self._freed.notify_all()
+
+    def record_success(self, endpoint: Endpoint, latency: Optional[float] = None) -> None:
+        """
+        :param latency: 首个 token 的延迟（秒），为 None 时只更新熔断状态
+        """
+        with self._lock:
+            if latency is not None:
+                self._update_latency(endpoint, latency)
+            endpoint.consecutive_failures = 0
+            recovered = endpoint.state != CLOSED
+            endpoint.state = CLOSED
+        if recovered:
+            logger.info(f"Endpoint {endpoint.name} recovered, circuit closed")
+
+    def record_latency(self, endpoint: Endpoint, latency: float) -> None:
+        """只更新延迟估计，例如请求在首个 token 之前被取消时，用已等待的时间作为下限"""
+        with self._lock:
+            self._update_latency(endpoint, latency)
+
+    def _update_latency(self, endpoint: Endpoint, latency: float) -> None:
+        """调用方需持有锁"""
+        if endpoint.ewma_latency is None:
+            endpoint.ewma_latency = latency
+        else:
+            endpoint.ewma_latency += self.alpha * (latency - endpoint.ewma_latency)
+
+    def record_failure(self, endpoint: Endpoint, error: BaseException) -> None:
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            endpoint.last_error = clip(f"{type(error).__name__}: {error}", 200)
+            tripped = endpoint.state == HALF_OPEN or (
+                endpoint.state == CLOSED and endpoint.consecutive_failures >= self.failure_threshold
+            )
+            if tripped or endpoint.state == OPEN:
+                endpoint.state = OPEN
+                endpoint.opened_at = time.monotonic()
+        if tripped:
+            logger.warning(
+                f"Endpoint {endpoint.name} failed {endpoint.consecutive_failures} time(s) in a row, "
+                f"circuit opened for {self.cooldown:.0f}s: {endpoint.last_error}"
+            )
+
+    def check_health(self) -> None:
+        """探测处于熔断中的接口，能正常列出模型即视为恢复"""
+        from utils.chat.clients import get_client
+
+        for endpoint in self.endpoints:
+            if endpoint.state == CLOSED:
+                continue
+            client = get_client(endpoint.config["base_url"], endpoint.config["api_key"])
+            try:
+                client.with_options(max_retries=0).models.list()
+            except Exception as e:
+                self.record_failure(endpoint, e)
+                continue
+            self.record_success(endpoint)
+
+    def start_health_checks(self, interval: float = HEALTH_CHECK_INTERVAL) -> threading.Thread:
+        """启动后台健康检查线程，重复调用时返回已有的线程"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check_health()
+                except Exception as e:
+                    logger.warning(f"Health check failed: {e}")
+
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=run, name="endpoint-health", daemon=True)
+                self._health_thread.start()
+            return self._health_thread
+
+    def stats(self) -> Dict[str, Dict]:
+        """按接口返回延迟、并发数、失败次数和熔断状态"""
+        with self._lock:
+            return {endpoint.name: endpoint.snapshot() for endpoint in self._endpoints}
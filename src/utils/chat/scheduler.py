@@ -0,0 +1,202 @@
+import time
+import heapq
+import itertools
+import threading
+from loguru import logger
+from typing import Callable, Dict, Generator, Iterable, List, Optional
+
+from utils.chat.streaming import CancellationToken
+from utils.metrics.metrics import metrics
+
+
+# 优先级数值越小越先执行
+INTERACTIVE = 0  # 主界面的任务按钮，包括长文本分块的每个块
+EDIT = 1  # 结果窗口中的语气改写
+BACKGROUND = 2  # 预生成等用户没有在等待的请求
+PRIORITY_NAMES = {INTERACTIVE: "interactive", EDIT: "edit", BACKGROUND: "background"}
+
+
+class RequestCancelled(Exception):
+    """The request was cancelled, or superseded by a newer one, while it was waiting for a slot."""
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "key", "enqueued_at", "cancelled", "admitted")
+
+    def __init__(self, priority: int, seq: int, key: Optional[str]):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.enqueued_at = time.perf_counter()
+        self.cancelled = False
+        self.admitted = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Slot:
+    """A backend slot held by one request; release is idempotent so it can be tied to several exits."""
+
+    def __init__(self, scheduler: "RequestScheduler"):
+        self._scheduler = scheduler
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._scheduler._release()
+
+
+def hold_slot(stream: Iterable, slot: Slot) -> Generator:
+    """透传流式输出，流结束或被关闭时释放 slot"""
+    try:
+        yield from stream
+    finally:
+        slot.release()
+
+
+class RequestScheduler:
+    """
+    Admits model requests in priority order (interactive > edit > background, FIFO within a class) once the
+    backends have a free slot, so bursts queue here instead of piling up on a server that decodes one or two
+    requests at a time. A queued request is dropped when its cancellation token fires or a newer request
+    with the same key arrives.
+    """
+
+    def __init__(self, capacity: Callable[[], int]):
+        """
+        :param capacity: 返回当前允许同时进行的请求数，通常是所有接口的 max_concurrency 之和
+        """
+        self._capacity = capacity
+        self._cond = threading.Condition()
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.running = 0
+        self._admitted = {priority: 0 for priority in PRIORITY_NAMES}
+        self._dropped = {priority: 0 for priority in PRIORITY_NAMES}
+
+    def acquire(
+        self,
+        priority: int = INTERACTIVE,
+        cancel_token: Optional[CancellationToken] = None,
+        key: Optional[str] = None,
+    ) -> Slot:
+        """
+        等待直到可以发出请求，返回的 Slot 必须在请求（包括流式输出）结束后释放。
+
+        :param priority: INTERACTIVE、EDIT 或 BACKGROUND
+        :param cancel_token: 取消时放弃排队
+        :param key: 排队中的同 key 请求会被这个请求取代
+        :raises RequestCancelled: 排队时被取消或被取代
+        """
+        waiter = _Waiter(priority, next(self._seq), key)
+        with self._cond:
+            if key is not None:
+                for other in self._waiting:
+                    if other.key == key and not other.cancelled:
+                        other.cancelled = True
+                        logger.info(f"Queued {PRIORITY_NAMES[other.priority]} request {key!r} superseded by a newer one")
+            heapq.heappush(self._waiting, waiter)
+            self._cond.notify_all()
+        if cancel_token is not None:
+            cancel_token.add_callback(lambda: self._cancel(waiter))
+
+        with self._cond:
+            while True:
+                # 先清理队首已经取消的请求，它们的线程醒来后自行退出
+                while self._waiting and self._waiting[0].cancelled:
+                    heapq.heappop(self._waiting)
+                if waiter.cancelled:
+                    if waiter in self._waiting:
+                        self._waiting.remove(waiter)
+                        heapq.heapify(self._waiting)
+                    self._dropped[priority] += 1
+                    self._cond.notify_all()
+                    raise RequestCancelled(f"{PRIORITY_NAMES[priority]} request dropped from the queue")
+                if self._waiting[0] is waiter and self.running < max(1, self._capacity()):
+                    heapq.heappop(self._waiting)
+                    waiter.admitted = True
+                    self.running += 1
+                    self._admitted[priority] += 1
+                    # 后面的请求可能也能立即执行
+                    self._cond.notify_all()
+                    break
+                self._cond.wait()
+
+        waited = time.perf_counter() - waiter.enqueued_at
+        metrics.observe("scheduler_wait_seconds", waited)
+        metrics.observe(f"scheduler_wait_seconds_{PRIORITY_NAMES[priority]}", waited)
+        if waited >= 0.5:
+            logger.info(f"{PRIORITY_NAMES[priority].capitalize()} request waited {waited:.2f}s for a free slot")
+        return Slot(self)
+
+    def try_acquire(self, priority: int = INTERACTIVE) -> Optional[Slot]:
+        """
+        不排队：没有排队中的请求且有空闲 slot 时立即占用，否则返回 None。用于对冲请求等可有可无的请求，
+        它们不应该挤占排队中的请求。
+        """
+        with self._cond:
+            if any(not waiter.cancelled for waiter in self._waiting) or self.running >= max(1, self._capacity()):
+                return None
+            self.running += 1
+            self._admitted[priority] += 1
+        return Slot(self)
+
+    def promote(self, key: str, priority: int) -> bool:
+        """
+        提高排队中 key 对应请求的优先级，例如用户点击了正在后台排队的预生成改写。
+
+        :return: 是否找到了排队中的请求
+        """
+        with self._cond:
+            for waiter in self._waiting:
+                if waiter.key == key and not waiter.cancelled:
+                    if priority < waiter.priority:
+                        waiter.priority = priority
+                        heapq.heapify(self._waiting)
+                        self._cond.notify_all()
+                    return True
+        return False
+
+    def _cancel(self, waiter: _Waiter) -> None:
+        with self._cond:
+            if waiter.admitted or waiter.cancelled:
+                return
+            waiter.cancelled = True
+            self._cond.notify_all()
+
+    def _release(self) -> None:
+        with self._cond:
+            self.running -= 1
+            self._cond.notify_all()
+
+    def queue_depth(self) -> Dict[int, int]:
+        with self._cond:
+            depth = {priority: 0 for priority in PRIORITY_NAMES}
+            for waiter in self._waiting:
+                if not waiter.cancelled:
+                    depth[waiter.priority] += 1
+            return depth
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """按优先级返回排队数、已放行数和被丢弃数，以及总的并发数和容量"""
+        depth = self.queue_depth()
+        with self._cond:
+            result = {
+                name: {
+                    "queued": depth[priority],
+                    "admitted": self._admitted[priority],
+                    "dropped": self._dropped[priority],
+                }
+                for priority, name in PRIORITY_NAMES.items()
+            }
+            result["all"] = {
+                "queued": sum(depth.values()),
+                "running": self.running,
+                "capacity": self._capacity(),
+            }
+        return result
@@ -0,0 +1,207 @@
+import re
+import zlib
+import random
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from loguru import logger
+from typing import Dict, List, Optional, Set, Tuple
+
+
+# 估计的 Jaccard 相似度不低于该值时复用之前的结果，0 表示关闭
+DEFAULT_SIMILARITY_THRESHOLD = 0.85
+# 每个任务保留的最近输入数
+DEFAULT_MAX_ENTRIES = 100
+# 按字符切分的 shingle 长度，对中文和英文都适用
+DEFAULT_SHINGLE_SIZE = 5
+# 签名长 64，分成 16 个 band，每个 band 4 行：相似度 0.8 的文本几乎总能成为候选
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+
+_PRIME = (1 << 61) - 1
+_EMPTY = _PRIME
+_WHITESPACE = re.compile(r"\s+")
+# 标点前后有没有空格（例如中英文标点混用）不影响相似度
+_PUNCTUATION_SPACE = re.compile(r"\s*([,.;:!?、])\s*")
+# 选区首尾常多带或少带的标点和引号
+_EDGE_PUNCTUATION = " \t\n.,;:!?…'\"“”‘’()[]{}<>。，；：！？、（）【】《》「」"
+
+
+def normalize_text(text: str) -> str:
+    """统一全角/半角和大小写，合并空白，去掉首尾的标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _PUNCTUATION_SPACE.sub(r"\1", _WHITESPACE.sub(" ", text))
+    return text.strip(_EDGE_PUNCTUATION)
+
+
+class MinHasher:
+    """
+    MinHash signatures over character shingles; the fraction of equal positions estimates Jaccard similarity.
+    Uses one-permutation hashing: a single hash splits the shingles into `num_perm` bins and each bin keeps its
+    minimum, so a signature costs one pass over the text instead of one per hash function. Empty bins
+    (short texts) borrow the value of the next non-empty bin.
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._a, self._b = rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)
+
+    def shingles(self, text: str) -> Set[int]:
+        size = self.shingle_size
+        if len(text) <= size:
+            return {zlib.crc32(text.encode("utf-8"))}
+        return {zlib.crc32(text[i:i + size].encode("utf-8")) for i in range(len(text) - size + 1)}
+
+    def signature(self, normalized: str) -> Tuple[int, ...]:
+        a, b, num_perm = self._a, self._b, self.num_perm
+        bins = [_EMPTY] * num_perm
+        for h in self.shingles(normalized):
+            value = (a * h + b) % _PRIME
+            slot, value = value % num_perm, value // num_perm
+            if value < bins[slot]:
+                bins[slot] = value
+        if _EMPTY in bins:
+            # 循环向后找最近的非空 bin，加上距离以免不同的空 bin 取到相同的值
+            for slot in range(num_perm):
+                if bins[slot] == _EMPTY:
+                    for distance in range(1, num_perm):
+                        value = bins[(slot + distance) % num_perm]
+                        if value < _EMPTY:
+                            bins[slot] = _EMPTY + value * num_perm + distance
+                            break
+        return tuple(bins)
+
+    @staticmethod
+    def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+
+class NearDuplicate:
+    """A previous result whose input was similar to the one being looked up."""
+
+    __slots__ = ("similarity", "text", "result")
+
+    def __init__(self, similarity: float, text: str, result: str):
+        self.similarity = similarity
+        self.text = text
+        self.result = result
+
+
+class _Entry:
+    __slots__ = ("digest", "text", "normalized", "signature", "result")
+
+    def __init__(self, digest: str, text: str, normalized: str, signature: Tuple[int, ...], result: str):
+        self.digest = digest
+        self.text = text
+        self.normalized = normalized
+        self.signature = signature
+        self.result = result
+
+
+class _TaskIndex:
+    def __init__(self, bands: int):
+        self.entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.normalized: Dict[str, str] = {}
+        self.buckets: List[Dict[Tuple[int, ...], Set[str]]] = [{} for _ in range(bands)]
+
+
+class NearDuplicateIndex:
+    """
+    Recent inputs and results of each task, indexed with MinHash LSH so that a selection differing only in
+    whitespace, surrounding punctuation or a few words finds the earlier result without an exact-key match.
+    Identical inputs are left to the response cache.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        num_perm: int = DEFAULT_NUM_PERM,
+        bands: int = DEFAULT_BANDS,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+    ):
+        """
+        :param max_entries: 每个任务最多保留的输入数，超出时丢弃最早的
+        :param num_perm: MinHash 签名长度，需要能被 bands 整除
+        :param bands: LSH 的 band 数，越多越容易成为候选
+        :param shingle_size: 字符 shingle 长度
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self._tasks: Dict[str, _TaskIndex] = {}
+        self._lock = threading.Lock()
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [signature[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    def add(self, task: str, text: str, result: str) -> None:
+        """记录 task 对 text 的完整结果"""
+        normalized = normalize_text(text)
+        if not normalized or not result.strip():
+            return
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        entry = _Entry(digest, text, normalized, self.hasher.signature(normalized), result)
+        with self._lock:
+            index = self._tasks.setdefault(task, _TaskIndex(self.bands))
+            self._remove(index, digest)
+            index.entries[digest] = entry
+            index.normalized[normalized] = digest
+            for band, key in zip(index.buckets, self._band_keys(entry.signature)):
+                band.setdefault(key, set()).add(digest)
+            while len(index.entries) > self.max_entries:
+                self._remove(index, next(iter(index.entries)))
+
+    def _remove(self, index: _TaskIndex, digest: str) -> None:
+        entry = index.entries.pop(digest, None)
+        if entry is None:
+            return
+        if index.normalized.get(entry.normalized) == digest:
+            del index.normalized[entry.normalized]
+        for band, key in zip(index.buckets, self._band_keys(entry.signature)):
+            bucket = band.get(key)
+            if bucket is not None:
+                bucket.discard(digest)
+                if not bucket:
+                    del band[key]
+
+    def lookup(self, task: str, text: str, threshold: float = DEFAULT_SIMILARITY_THRESHOLD) -> Optional[NearDuplicate]:
+        """
+        查找 task 最相似的历史输入。
+
+        :param threshold: 最低的估计相似度，小于等于 0 时不查找
+        :return: 相似度不低于 threshold 的结果；与历史输入完全相同时返回 None，交给响应缓存处理
+        """
+        if threshold <= 0:
+            return None
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            index = self._tasks.get(task)
+            if index is None or digest in index.entries:
+                return None
+            exact = index.normalized.get(normalized)
+            if exact is not None:
+                entry = index.entries[exact]
+                return NearDuplicate(1.0, entry.text, entry.result)
+        signature = self.hasher.signature(normalized)
+        best: Optional[NearDuplicate] = None
+        with self._lock:
+            candidates: Set[str] = set()
+            for band, key in zip(index.buckets, self._band_keys(signature)):
+                candidates |= band.get(key, set())
+            for candidate in candidates:
+                entry = index.entries[candidate]
+                similarity = self.hasher.similarity(signature, entry.signature)
+                if similarity >= threshold and (best is None or similarity > best.similarity):
+                    best = NearDuplicate(similarity, entry.text, entry.result)
+        if best is not None:
+            logger.info(f"Input for {task} is {best.similarity:.0%} similar to an earlier one ({len(candidates)} candidates)")
+        return best
@@ -0,0 +1,92 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from loguru import logger
+from typing import Callable, Iterable, Optional, Tuple
+
+from utils.chat.streaming import CancellationToken
+
+
+# 最多保留的预生成结果数（每个结果窗口 5 个语气）
+DEFAULT_MAX_ENTRIES = 50
+
+
+def rewrite_key(task: str, text: str) -> Tuple[str, str]:
+    return task, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SpeculativeRewrites:
+    """
+    Pre-generates the tone rewrites of a finished result in the background, one at a time so they never
+    compete with more than one foreground request, and keeps them by (task, hash of the source text).
+    A tone click then takes the finished result, or waits for the one already running.
+    """
+
+    def __init__(
+        self,
+        rewrite: Callable[[str, str, CancellationToken], Optional[str]],
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        """
+        :param rewrite: 执行一次改写并返回完整文本，参数为任务名、原文和取消令牌；被取消时返回 None
+        :param max_entries: 最多保留的结果数，超出时丢弃最早的
+        """
+        self.rewrite = rewrite
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative")
+        self._results: "OrderedDict[Tuple[str, str], Future]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def schedule(self, text: str, tasks: Iterable[str], cancel_token: CancellationToken) -> None:
+        """
+        为 text 排队生成 tasks 中的每种改写；cancel_token 取消时（例如结果窗口关闭）未完成的改写全部取消。
+        """
+        if not text.strip() or cancel_token.cancelled:
+            return
+        scheduled = []
+        with self._lock:
+            for task in tasks:
+                key = rewrite_key(task, text)
+                if key in self._results:
+                    continue
+                future = self._executor.submit(self._run, task, text, cancel_token)
+                self._results[key] = future
+                scheduled.append((key, future))
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        if scheduled:
+            logger.info(f"Speculatively generating {len(scheduled)} rewrite(s) of {len(text)} chars")
+        for key, future in scheduled:
+            cancel_token.add_callback(lambda key=key, future=future: self._discard(key, future))
+
+    def _run(self, task: str, text: str, cancel_token: CancellationToken) -> str:
+        result = None if cancel_token.cancelled else self.rewrite(task, text, cancel_token)
+        if result is None:
+            raise RuntimeError(f"Speculative {task} rewrite cancelled")
+        return result
+
+    def _discard(self, key: Tuple[str, str], future: Future) -> None:
+        """取消未完成的改写；已完成的结果保留"""
+        if future.done() and not future.cancelled() and future.exception() is None:
+            return
+        future.cancel()
+        with self._lock:
+            if self._results.get(key) is future:
+                del self._results[key]
+
+    def take(self, task: str, text: str) -> Optional[Future]:
+        """
+        Return the finished or running rewrite of text. A rewrite that has not started yet is cancelled
+        so the caller can run it in the foreground right away.
+        """
+        key = rewrite_key(task, text)
+        with self._lock:
+            future = self._results.get(key)
+            if future is None:
+                return None
+            if future.cancel() or (future.done() and future.exception() is not None):
+                del self._results[key]
+                return None
+            self._results.move_to_end(key)
+            return future
@@ -0,0 +1,220 @@
+import queue
+import threading
+import tkinter as tk
+from loguru import logger
+from utils.metrics.metrics import metrics
+from typing import Callable, Dict, Generator, Iterable, List, Optional
+
+
+# UI 每帧从队列中取数据的间隔（毫秒），约等于 60 FPS
+FRAME_INTERVAL_MS = 16
+
+
+class CancellationToken:
+    """
+    Signals that nobody is consuming a generation any more. Callbacks registered on the token
+    (e.g. closing the underlying HTTP stream) run once, as soon as it is cancelled.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """注册取消回调；如果已经取消，则立即执行"""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def cancel(self) -> bool:
+        """
+        取消生成并执行所有回调。
+
+        :return: 本次调用是否真正触发了取消（重复取消返回 False）
+        """
+        with self._lock:
+            if self._cancelled.is_set():
+                return False
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+        return True
+
+    @staticmethod
+    def _run_callback(callback: Callable[[], None]) -> None:
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Cancellation callback failed: {e}")
+
+
+class GenerationStats:
+    """Thread-safe counters of how generations ended."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {"completed": 0, "cancelled": 0, "failed": 0}
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self._counts[outcome] = self._counts.get(outcome, 0) + 1
+        logger.debug(f"Generation {outcome}, totals: {self._counts}")
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+generation_stats = GenerationStats()
+
+
+def iter_content(stream: Iterable, cancel_token: Optional[CancellationToken] = None) -> Generator[str, None, None]:
+    """
+    遍历流式输出中的文本内容，并在结束时把结果（完成/取消/失败）记录到 generation_stats。
+
+    :param stream: OpenAI 流式输出，或任何产出 ChatCompletionChunk 的可迭代对象
+    :param cancel_token: 取消令牌，取消后停止读取
+    """
+    try:
+        for chunk in stream:
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
+    except Exception:
+        # 取消时底层连接被关闭，读取会抛出异常，这属于正常的取消流程
+        if cancel_token is not None and cancel_token.cancelled:
+            generation_stats.record("cancelled")
+            return
+        generation_stats.record("failed")
+        raise
+    if cancel_token is not None and cancel_token.cancelled:
+        generation_stats.record("cancelled")
+    else:
+        generation_stats.record("completed")
+
+
+class StreamReader:
+    """
+    Drain a chat completion stream into a thread-safe queue on a background thread,
+    so the Tk main loop never blocks on network reads.
+    """
+
+    def __init__(self, stream: Iterable, cancel_token: Optional[CancellationToken] = None):
+        """
+        :param stream: OpenAI 流式输出，或任何产出 ChatCompletionChunk 的可迭代对象
+        :param cancel_token: 取消令牌，取消后停止读取
+        """
+        self.stream = stream
+        self.cancel_token = cancel_token
+        self.queue: "queue.Queue[str]" = queue.Queue()
+        self.error: Optional[BaseException] = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stream-reader", daemon=True)
+
+    def start(self) -> "StreamReader":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        try:
+            for content in iter_content(self.stream, self.cancel_token):
+                self.queue.put(content)
+        except Exception as e:
+            logger.error(f"Stream reader failed: {e}")
+            self.error = e
+        finally:
+            self._done.set()
+
+    def drain(self) -> List[str]:
+        """取出当前队列中的全部文本片段，不阻塞"""
+        contents = []
+        try:
+            while True:
+                contents.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return contents
+
+    @property
+    def finished(self) -> bool:
+        """流已读完且队列中没有剩余数据"""
+        return self._done.is_set() and self.queue.empty()
+
+
+class TextBuffer:
+    """
+    List-backed text accumulator. Appending is O(1) amortized and the joined text is cached until the next append;
+    the length is kept as a running total so checking it never joins the parts.
+    """
+
+    def __init__(self, text: str = ""):
+        self._parts: List[str] = [text] if text else []
+        self._joined: Optional[str] = text
+        self._length = len(text)
+
+    def append(self, content: str) -> None:
+        self._parts.append(content)
+        self._joined = None
+        self._length += len(content)
+
+    @property
+    def text(self) -> str:
+        if self._joined is None:
+            self._joined = "".join(self._parts)
+            self._parts = [self._joined]
+        return self._joined
+
+    def __len__(self) -> int:
+        return self._length
+
+
+class StreamRenderer:
+    """
+    Coalesce all chunks queued since the last frame and apply them to a text widget with a single insert.
+    """
+
+    def __init__(self, text_box, reader: StreamReader, buffer: Optional[TextBuffer] = None, replace: bool = False):
+        """
+        :param text_box: 目标文本控件，需要支持 configure/insert/see
+        :param reader: 已启动的 StreamReader
+        :param buffer: 累积完整输出的缓冲区
+        :param replace: 收到第一个片段时先清空控件中原有的文本，在此之前原文保持可见
+        """
+        self.text_box = text_box
+        self.reader = reader
+        self.buffer = buffer if buffer is not None else TextBuffer()
+        self.replace = replace
+
+    def flush(self) -> bool:
+        """
+        把队列中的全部片段合并后一次性写入控件。
+
+        :return: 流是否已经结束
+        """
+        # finished 需要在 drain 之前判断，避免漏掉判断之后才入队的片段
+        finished = self.reader.finished
+        pending = self.reader.drain()
+        if pending:
+            with metrics.timer("render_flush_seconds"):
+                content = "".join(pending)
+                self.buffer.append(content)
+                self.text_box.configure(state="normal")
+                if self.replace:
+                    self.text_box.delete("1.0", tk.END)
+                    self.replace = False
+                self.text_box.insert(tk.END, content)
+                self.text_box.see(tk.END)
+                self.text_box.configure(state="disabled")
+        return finished
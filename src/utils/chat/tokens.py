@@ -0,0 +1,89 @@
+import re
+import math
+from loguru import logger
+from typing import Callable, Dict, Iterable, Optional
+
+
+# 中日韩字符按每个字符一个 token 估算（多数分词器为 0.7~1.5 个），宁可高估
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef"
+_CJK = re.compile(f"[{_CJK_RANGES}]")
+_WORD = re.compile(f"[^\\W{_CJK_RANGES}]+|[^\\w\\s{_CJK_RANGES}]")
+CHARS_PER_TOKEN = 4
+# 对话格式中每条消息的额外开销（角色标记等），以及回复开头的开销
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+
+class TokenEstimator:
+    """
+    Tokenizer-free token count estimate, fast enough to run on every request. An exact tokenizer
+    (any callable returning the token count of a string) can be plugged in with `set_tokenizer`.
+    """
+
+    def __init__(self, tokenizer: Optional[Callable[[str], int]] = None):
+        self.tokenizer = tokenizer
+
+    def set_tokenizer(self, tokenizer: Optional[Callable[[str], int]]) -> None:
+        """设置精确分词器，传入 None 恢复为估算"""
+        self.tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return self.tokenizer(text)
+        cjk = len(_CJK.findall(text))
+        other_chars = len(text) - cjk
+        words = len(_WORD.findall(text))
+        # 英文约 4 个字符一个 token；代码和标点较多的文本中每个单词和符号至少一个 token，取两者中较大的
+        return cjk + math.ceil(max(other_chars / CHARS_PER_TOKEN, words))
+
+    def count_messages(self, messages: Iterable[Dict]) -> int:
+        """估算一组对话消息作为提示词的 token 数"""
+        return sum(self.count(message.get("content") or "") + MESSAGE_OVERHEAD for message in messages) + REPLY_OVERHEAD
+
+
+def tiktoken_tokenizer(encoding: str = "cl100k_base") -> Optional[Callable[[str], int]]:
+    """
+    返回基于 tiktoken 的精确分词器；未安装 tiktoken 时返回 None。
+
+    :param encoding: tiktoken 编码名称
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, falling back to token estimation")
+        return None
+    enc = tiktoken.get_encoding(encoding)
+    return lambda text: len(enc.encode(text, disallowed_special=()))
+
+
+token_estimator = TokenEstimator()
+
+
+def estimate_tokens(text: str) -> int:
+    return token_estimator.count(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    截断文本，使其估算 token 数不超过 max_tokens；尽量在段落或句子边界截断。
+
+    :param text: 原文本
+    :param max_tokens: 允许的最大 token 数
+    """
+    if max_tokens <= 0:
+        return ""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # 按比例估计截断位置，再逐步缩短直到满足预算
+    end = int(len(text) * max_tokens / tokens)
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end = int(end * 0.95)
+    head = text[:end]
+    for boundary in ("\n\n", "\n", "。", ". "):
+        index = head.rfind(boundary)
+        if index > end * 0.9:
+            return head[:index + len(boundary)].rstrip()
+    return head
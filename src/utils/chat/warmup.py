@@ -0,0 +1,96 @@
+import time
+import threading
+from loguru import logger
+from typing import Optional
+
+from utils.chat.llm import LLM
+
+
+# 用户超过这个时间没有发起请求，保活间隔开始按倍数退避
+DEFAULT_IDLE_TIMEOUT = 30 * 60  # 秒
+# 退避后的最大保活间隔
+MAX_KEEP_ALIVE_INTERVAL = 60 * 60  # 秒
+
+
+class WarmupScheduler:
+    """
+    Warms the model up in the background at startup and after settings change, then sends keep-alive
+    pings so the server keeps it loaded. Once the user has been idle for `idle_timeout`, the ping interval
+    doubles after every ping, up to `max_interval`; the next request resets it.
+    """
+
+    def __init__(self, llm: LLM, idle_timeout: float = DEFAULT_IDLE_TIMEOUT, max_interval: float = MAX_KEEP_ALIVE_INTERVAL):
+        """
+        :param llm: 要预热的模型，保活间隔读取自 llm.keep_alive_interval
+        :param idle_timeout: 用户空闲多久之后开始退避（秒）
+        :param max_interval: 退避后的最大保活间隔（秒）
+        """
+        self.llm = llm
+        self.idle_timeout = idle_timeout
+        self.max_interval = max_interval
+        self._backoff = 1
+        self._last_ping = 0.0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+
+    def start(self) -> "WarmupScheduler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wake.set()
+
+    def request_warmup(self) -> None:
+        """立即发送一次预热请求，用于设置保存或重置之后"""
+        self._wake.set()
+
+    def current_interval(self) -> Optional[float]:
+        """当前的保活间隔（秒），保活关闭时返回 None"""
+        interval = self.llm.keep_alive_interval
+        if interval <= 0:
+            return None
+        if time.monotonic() - self.llm.last_activity < self.idle_timeout:
+            self._backoff = 1
+        return min(interval * self._backoff, max(interval, self.max_interval))
+
+    def _seconds_until_ping(self) -> Optional[float]:
+        interval = self.current_interval()
+        if interval is None:
+            return None
+        # 用户请求本身也会让模型保持加载状态，从最近一次请求或保活请求开始计时
+        return max(self._last_ping, self.llm.last_activity) + interval - time.monotonic()
+
+    def _ping(self, reason: str) -> None:
+        logger.info(f"Sending {reason} request to {self.llm.defult_config['model']}")
+        try:
+            self.llm.warm_up()
+        except Exception as e:
+            logger.warning(f"{reason.capitalize()} request failed: {e}")
+        self._last_ping = time.monotonic()
+
+        idle = self._last_ping - self.llm.last_activity
+        if idle >= self.idle_timeout:
+            if self.llm.keep_alive_interval * self._backoff < self.max_interval:
+                self._backoff *= 2
+                logger.debug(f"User idle for {idle:.0f}s, keep-alive interval backed off to {self.current_interval():.0f}s")
+
+    def _run(self) -> None:
+        reason = "warm-up"
+        while not self._stopped:
+            self._ping(reason)
+            while True:
+                timeout = self._seconds_until_ping()
+                if timeout is not None and timeout <= 0:
+                    reason = "keep-alive"
+                    break
+                # 至少每个基础间隔醒来一次，用户重新活跃后及时取消退避
+                if timeout is not None:
+                    timeout = min(timeout, self.llm.keep_alive_interval)
+                if self._wake.wait(timeout):
+                    self._wake.clear()
+                    reason = "warm-up"
+                    break
+                if self._stopped:
+                    return
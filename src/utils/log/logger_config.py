@@ -1,15 +1,162 @@
 # logger_config.py
+import os
 import sys
+import time
+import glob
+import queue
+import threading
+from typing import Optional
 from loguru import logger
 
-def setup_logger():
-    folder_ = "./log/"
+# 默认只记录 INFO 及以上级别：低于 sink 级别的调用在 loguru 中直接返回，不会构建和格式化记录。
+# 需要 DEBUG 日志时使用 --debug 启动，或设置环境变量 RAGENT_COPILOT_LOG_LEVEL=DEBUG
+DEFAULT_LOG_LEVEL = "INFO"
+LOG_LEVEL_ENV = "RAGENT_COPILOT_LOG_LEVEL"
+# 单条日志消息的最大长度，超出部分截断，避免整段提示词和生成结果拖慢日志写入
+MAX_MESSAGE_LENGTH = 2000
+# 日志级别与文件名后缀的对应关系，每条日志写入所有阈值不高于其级别的文件
+LEVEL_FILES = (
+    ("DEBUG", "debug"),
+    ("INFO", "info"),
+    ("WARNING", "warning"),
+    ("ERROR", "error"),
+    ("CRITICAL", "critical"),
+)
+
+
+def clip(value, limit: int = MAX_MESSAGE_LENGTH) -> str:
+    """
+    把要记录的对象转换为字符串，超出 limit 的部分截断。
+
+    :param value: 要记录的对象
+    :param limit: 最大字符数
+    """
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...(+{len(text) - limit} chars)"
+
+
+def default_log_level() -> str:
+    if "--debug" in sys.argv:
+        return "DEBUG"
+    return os.environ.get(LOG_LEVEL_ENV, DEFAULT_LOG_LEVEL).upper()
+
+
+def _clip_record(record):
+    # loguru 在调用方线程中构建并格式化记录，sink 只把格式化好的字符串放入队列，
+    # 因此在这里截断过长的消息，减少调用方线程的格式化开销；写文件在后台线程完成
+    if len(record["message"]) > MAX_MESSAGE_LENGTH:
+        record["message"] = clip(record["message"])
+
+
+class LevelRoutingSink:
+    """
+    A single sink that routes each formatted message to the per-level log files.
+    loguru formats the message on the calling thread; the sink only puts the finished string on an in-process
+    queue, and all file I/O happens on a background thread.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        prefix: str,
+        rotation_bytes: int,
+        retention_seconds: float,
+        encoding: str,
+        level: str = DEFAULT_LOG_LEVEL,
+    ):
+        self.folder = folder
+        self.prefix = prefix
+        self.rotation_bytes = rotation_bytes
+        self.retention_seconds = retention_seconds
+        self.encoding = encoding
+        self._files = {}
+        self._sizes = {}
+        # 低于 sink 级别的文件不会收到只属于它的日志，不再创建
+        min_level_no = logger.level(level).no
+        self._levels = [
+            (logger.level(file_level).no, name) for file_level, name in LEVEL_FILES
+            if logger.level(file_level).no >= min_level_no
+        ]
+        self._flush_level_no = logger.level("WARNING").no
+        self._queue = queue.SimpleQueue()
+        os.makedirs(folder, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder, f"{self.prefix}{name}.log")
+
+    def _get_file(self, name: str):
+        file = self._files.get(name)
+        if file is None:
+            path = self._path(name)
+            file = open(path, "a", encoding=self.encoding)
+            self._files[name] = file
+            self._sizes[name] = os.path.getsize(path)
+        return file
+
+    def _rotate(self, name: str) -> None:
+        self._files.pop(name).close()
+        path = self._path(name)
+        os.replace(path, f"{path[:-4]}.{time.strftime('%Y-%m-%d_%H-%M-%S')}.log")
+        # 删除超过保留期限的历史日志
+        expire_before = time.time() - self.retention_seconds
+        for old_path in glob.glob(os.path.join(self.folder, f"{self.prefix}{name}.*.log")):
+            if os.path.getmtime(old_path) < expire_before:
+                os.remove(old_path)
+
+    def write(self, message) -> None:
+        self._queue.put((message.record["level"].no, message))
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            level_no, message = item
+            try:
+                self._write_to_files(level_no, message)
+            except Exception as e:
+                sys.stderr.write(f"Failed to write log message: {e}\n")
+            # 队列清空时落盘，既能批量写入，又不会让日志长时间停留在缓冲区
+            if self._queue.empty():
+                for file in self._files.values():
+                    file.flush()
+
+    def _write_to_files(self, level_no: int, message: str) -> None:
+        for threshold, name in self._levels:
+            if level_no < threshold:
+                break
+            file = self._get_file(name)
+            file.write(message)
+            if level_no >= self._flush_level_no:
+                file.flush()
+            self._sizes[name] += len(message)
+            if self._sizes[name] >= self.rotation_bytes:
+                self._rotate(name)
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        for file in self._files.values():
+            file.close()
+        self._files.clear()
+
+
+def setup_logger(folder_: str = "./log/", level_: Optional[str] = None):
+    """
+    :param folder_: 日志目录
+    :param level_: 最低记录级别，默认由 default_log_level() 决定（INFO，--debug 时为 DEBUG）
+    """
+    level_ = level_ or default_log_level()
     prefix_ = "ragent-copilot-"
-    rotation_ = "10 MB"
-    retention_ = "30 days"
+    rotation_ = 10 * 1024 * 1024  # 10 MB
+    retention_ = 30 * 24 * 3600  # 30 days
     encoding_ = "utf-8"
     backtrace_ = True
-    diagnose_ = True
+    diagnose_ = False  # diagnose 会在异常中展开所有变量的值，开销大且可能泄露提示词内容
 
     format_ = '<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> ' \
               '| <magenta>{process}</magenta>:<yellow>{thread}</yellow> ' \
@@ -20,42 +167,20 @@ def setup_logger():
     except ValueError:
         pass
 
-    # debug
-    logger.add(folder_ + prefix_ + "debug.log", level="DEBUG", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("DEBUG").no)
-
-    # info
-    logger.add(folder_ + prefix_ + "info.log", level="INFO", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("INFO").no)
-
-    # warning
-    logger.add(folder_ + prefix_ + "warning.log", level="WARNING", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("WARNING").no)
-
-    # error
-    logger.add(folder_ + prefix_ + "error.log", level="ERROR", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("ERROR").no)
-
-    # critical
-    logger.add(folder_ + prefix_ + "critical.log", level="CRITICAL", backtrace=backtrace_, diagnose=diagnose_,
-               format=format_, colorize=False,
-               rotation=rotation_, retention=retention_, encoding=encoding_,
-               filter=lambda record: record["level"].no >= logger.level("CRITICAL").no)
+    logger.configure(patcher=_clip_record)
+    # 单个后台队列 sink，按级别分发到 debug/info/warning/error/critical 文件
+    # loguru 自带的 enqueue=True 会对每条记录做 pickle 并写入管道，调用方的开销反而比同步写文件更大，
+    # 因此由 sink 自己使用进程内队列
+    logger.add(LevelRoutingSink(folder_, prefix_, rotation_, retention_, encoding_, level_),
+               level=level_, backtrace=backtrace_, diagnose=diagnose_,
+               format=format_, colorize=False)
 
     # logger.add(sys.stderr, level="CRITICAL", backtrace=backtrace_, diagnose=diagnose_,
     #            format=format_, colorize=True,
     #            filter=lambda record: record["level"].no >= logger.level("CRITICAL").no)
-    
+
     # logger.add(sys.stdout, level="INFO", backtrace=backtrace_, diagnose=diagnose_,
     #            format=format_, colorize=True,
     #            filter=lambda record: record["level"].no == logger.level("INFO").no)
 
-setup_logger()
\ No newline at end of file
+setup_logger()
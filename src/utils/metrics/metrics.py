@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+from typing import Callable, Dict, Generator, Iterable, Optional
+
+
+DEFAULT_WINDOW = 1024
+DEFAULT_METRICS_PATH = "log/metrics.json"
+DEFAULT_METRICS_PORT = 9464
+EXPORT_INTERVAL = 5.0  # 秒
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """Keeps the last `window` observations for percentiles, plus all-time count and sum."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._values.append(value)
+            self.count += 1
+            self.sum += value
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            values = sorted(self._values)
+        return _percentile(values, q)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            values = sorted(self._values)
+            count, total = self.count, self.sum
+        result = {"count": count, "sum": total}
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = _percentile(values, q)
+        result["max"] = values[-1] if values else 0.0
+        return result
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class MetricsStore:
+    """
+    Process-wide store of rolling histograms, exported as JSON to a local file and as Prometheus text.
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW, path: str = DEFAULT_METRICS_PATH):
+        self.window = window
+        self.path = path
+        self._histograms: Dict[str, RollingHistogram] = {}
+        self._gauges: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+
+    def histogram(self, name: str) -> RollingHistogram:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = RollingHistogram(self.window)
+            return histogram
+
+    def observe(self, name: str, value: float) -> None:
+        self.histogram(name).observe(value)
+
+    def register_gauges(self, name: str, collect: Callable[[], Dict[str, Dict[str, float]]], label: str) -> None:
+        """
+        注册一组在导出时才读取的当前值，例如每个接口的延迟和并发数。
+
+        :param name: 指标名前缀，同名注册会覆盖之前的
+        :param collect: 返回 {标签值: {字段: 数值}} 的函数，非数值字段不会导出到 Prometheus
+        :param label: Prometheus 标签名
+        """
+        with self._lock:
+            self._gauges[name] = (collect, label)
+
+    def gauges(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        with self._lock:
+            gauges = dict(self._gauges)
+        result = {}
+        for name, (collect, _) in sorted(gauges.items()):
+            try:
+                result[name] = collect()
+            except Exception as e:
+                logger.warning(f"Failed to collect gauges {name}: {e}")
+        return result
+
+    @contextmanager
+    def timer(self, name: str):
+        """记录 with 代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {name: histogram.snapshot() for name, histogram in sorted(histograms.items())}
+
+    def to_prometheus(self) -> str:
+        """以 Prometheus 文本格式（summary 类型）输出所有指标"""
+        lines = []
+        for name, snapshot in self.snapshot().items():
+            metric = f"ragent_copilot_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                lines.append(f'{metric}{{quantile="{q}"}} {snapshot[f"p{int(q * 100)}"]}')
+            lines.append(f"{metric}_sum {snapshot['sum']}")
+            lines.append(f"{metric}_count {snapshot['count']}")
+        with self._lock:
+            labels = {name: label for name, (_, label) in self._gauges.items()}
+        for name, series in self.gauges().items():
+            fields = sorted({field for values in series.values() for field, value in values.items()
+                             if isinstance(value, (int, float))})
+            for field in fields:
+                metric = f"ragent_copilot_{name}_{field}"
+                lines.append(f"# TYPE {metric} gauge")
+                for label_value, values in series.items():
+                    if isinstance(values.get(field), (int, float)):
+                        lines.append(f'{metric}{{{labels[name]}="{label_value}"}} {values[field]}')
+        return "\n".join(lines) + "\n"
+
+    def export_json(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        try:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"timestamp": time.time(), "metrics": self.snapshot(), "gauges": self.gauges()}, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to export metrics to {path}: {e}")
+
+    def maybe_export(self) -> None:
+        """距离上次导出超过 EXPORT_INTERVAL 时写入指标文件"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_export < EXPORT_INTERVAL:
+                return
+            self._last_export = now
+        self.export_json()
+
+
+metrics = MetricsStore()
+
+
+class RequestTrace:
+    """
+    Timeline of one generation, from the button click to the last streamed token.
+
+    Reports capture time, executor queue wait, time-to-first-token, decode rate and total latency to `metrics`.
+    """
+
+    def __init__(self, task: str, store: MetricsStore = metrics):
+        self.task = task
+        self.store = store
+        self.submitted_at = time.perf_counter()
+        self.sent_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished = False
+
+    def start(self) -> None:
+        """任务开始在线程池中执行"""
+        self.store.observe("queue_wait_seconds", time.perf_counter() - self.submitted_at)
+
+    @contextmanager
+    def stage(self, name: str):
+        with self.store.timer(f"{name}_seconds"):
+            yield
+
+    def request_sent(self) -> None:
+        self.sent_at = time.perf_counter()
+
+    def first_token(self) -> None:
+        if self.first_token_at is not None:
+            return
+        self.first_token_at = time.perf_counter()
+        self.store.observe("ttft_seconds", self.first_token_at - (self.sent_at or self.submitted_at))
+
+    def complete(self, tokens: int) -> None:
+        """
+        记录一次完整的生成。
+
+        :param tokens: 生成的 token 数；流式输出时以 chunk 数近似
+        """
+        if self.finished:
+            return
+        self.finished = True
+        now = time.perf_counter()
+        self.store.observe("total_latency_seconds", now - self.submitted_at)
+        if self.first_token_at is not None and tokens > 1 and now > self.first_token_at:
+            # 第一个 token 之后的解码速度，不含排队和预填充时间
+            self.store.observe("decode_tokens_per_second", (tokens - 1) / (now - self.first_token_at))
+        logger.info(
+            f"Generation for {self.task} finished: {tokens} tokens, "
+            f"total {now - self.submitted_at:.3f}s, "
+            f"ttft {(self.first_token_at - (self.sent_at or self.submitted_at)) if self.first_token_at else 0:.3f}s"
+        )
+        self.store.maybe_export()
+
+
+def observe_stream(stream: Iterable, trace: Optional[RequestTrace]) -> Generator:
+    """
+    透传流式输出，并把首个 token 时间和解码速度记录到 trace。
+
+    :param stream: OpenAI 流式输出
+    :param trace: 请求的时间线，为 None 时直接透传
+    """
+    if trace is None:
+        yield from stream
+        return
+    chunks = 0
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            trace.first_token()
+            chunks += 1
+        yield chunk
+    trace.complete(chunks)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    store: MetricsStore = metrics
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.store.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = DEFAULT_METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """
+    在 localhost 上启动 Prometheus 文本格式的指标接口（/metrics）。
+
+    :param port: 监听端口
+    :return: 服务器对象；端口被占用时返回 None
+    """
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Failed to start metrics server on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics available at http://127.0.0.1:{port}/metrics")
+    return server
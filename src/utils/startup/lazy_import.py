@@ -0,0 +1,61 @@
+import sys
+import types
+import importlib
+import threading
+from loguru import logger
+from typing import Iterable
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module proxy that performs the real import on first attribute access.
+    Thread-safe: the import itself goes through importlib and its module locks.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    返回模块本身（已导入时）或一个延迟导入的代理。
+
+    :param name: 模块的完整名称，例如 "PIL.Image"
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def preload_modules(names: Iterable[str]) -> threading.Thread:
+    """
+    在后台线程中依次导入模块，让首次使用时不再需要等待导入。
+
+    :param names: 要预先导入的模块名称
+    :return: 已启动的后台线程
+    """
+    def run():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                logger.warning(f"Failed to preload {name}: {e}")
+
+    thread = threading.Thread(target=run, name="preload-modules", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,93 @@
+import sys
+import time
+import builtins
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class StartupProfiler:
+    """
+    Records how long each import and each init phase takes between process start and the hotkey being ready.
+
+    Disabled by default; `enable()` must run before the imports that should be measured.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started_at = time.perf_counter()
+        self._original_import = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (模块名, 嵌套深度, 耗时)，按导入完成的顺序
+        self.imports: List[Tuple[str, int, float]] = []
+        # (阶段名, 距离启动的时间, 阶段耗时)
+        self.phases: List[Tuple[str, float, float]] = []
+        self._last_mark = self.started_at
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        self.enabled = True
+        self.started_at = self._last_mark = time.perf_counter()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # 只统计第一次真正加载的绝对导入
+        if level != 0 or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._local.depth = depth
+            with self._lock:
+                self.imports.append((name, depth, elapsed))
+
+    def mark(self, phase: str) -> None:
+        """记录一个初始化阶段的结束"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self.phases.append((phase, now - self.started_at, now - self._last_mark))
+            self._last_mark = now
+
+    def report(self, top: int = 15) -> Optional[str]:
+        """
+        生成启动耗时报告，并停止统计导入。
+
+        :param top: 列出耗时最多的导入数量
+        :return: 报告文本；未启用时返回 None
+        """
+        if not self.enabled:
+            return None
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+        with self._lock:
+            imports = list(self.imports)
+            phases = list(self.phases)
+        direct: Dict[str, float] = {}
+        for name, depth, elapsed in imports:
+            if depth == 0:
+                direct[name] = direct.get(name, 0.0) + elapsed
+
+        lines = ["Startup profile", "", f"{'phase':<32} {'at (ms)':>10} {'took (ms)':>10}"]
+        for phase, at, took in phases:
+            lines.append(f"{phase:<32} {at * 1000:>10.1f} {took * 1000:>10.1f}")
+        lines += ["", f"{'top-level import':<32} {'took (ms)':>10}"]
+        for name, elapsed in sorted(direct.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(f"{name:<32} {elapsed * 1000:>10.1f}")
+        report = "\n".join(lines)
+        # loguru 在此处才导入，使其导入耗时也能被统计
+        from loguru import logger
+        logger.info(report)
+        return report
+
+
+startup_profiler = StartupProfiler()
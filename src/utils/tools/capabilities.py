@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import threading
+from loguru import logger
+from typing import Dict, Optional
+
+
+DEFAULT_CAPABILITY_PATH = "cache/tool_capabilities.json"
+SETTINGS_PATH = "settings/settings.json"
+
+
+def settings_fingerprint(settings_path: str = SETTINGS_PATH) -> str:
+    """返回设置文件内容的哈希，设置文件不存在时返回空字符串"""
+    try:
+        with open(settings_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return ""
+
+
+class ToolCapabilityCache:
+    """
+    Remembers per (base_url, model) whether the endpoint accepts tool-calling requests.
+    Persisted to disk and dropped whenever the settings file changes.
+    """
+
+    def __init__(self, path: str = DEFAULT_CAPABILITY_PATH, settings_path: str = SETTINGS_PATH):
+        """
+        :param path: 缓存文件路径
+        :param settings_path: 设置文件路径，其内容变化时缓存失效
+        """
+        self.path = path
+        self.settings_path = settings_path
+        self._lock = threading.Lock()
+        self._fingerprint = settings_fingerprint(settings_path)
+        self._capabilities: Dict[str, bool] = self._load()
+
+    @staticmethod
+    def _key(base_url: str, model: str) -> str:
+        return f"{base_url}|{model}"
+
+    def _load(self) -> Dict[str, bool]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("settings_fingerprint") != self._fingerprint:
+            logger.info("Settings changed since tool capabilities were probed, discarding cached results")
+            return {}
+        return dict(data.get("capabilities", {}))
+
+    def _save(self) -> None:
+        """写入磁盘，调用方需持有锁"""
+        try:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"settings_fingerprint": self._fingerprint, "capabilities": self._capabilities}, f)
+        except OSError as e:
+            logger.warning(f"Failed to save tool capabilities: {e}")
+
+    def get(self, base_url: str, model: str) -> Optional[bool]:
+        """
+        :return: True 表示支持工具调用，False 表示不支持，None 表示尚未探测
+        """
+        with self._lock:
+            return self._capabilities.get(self._key(base_url, model))
+
+    def set(self, base_url: str, model: str, supported: bool) -> None:
+        with self._lock:
+            self._capabilities[self._key(base_url, model)] = supported
+            self._save()
+        logger.info(f"Tool calling {'supported' if supported else 'not supported'} by {model} at {base_url}")
+
+    def invalidate(self) -> None:
+        """清空探测结果，在设置保存或重置后调用"""
+        with self._lock:
+            self._fingerprint = settings_fingerprint(self.settings_path)
+            self._capabilities = {}
+            self._save()
+
+
+tool_capability_cache = ToolCapabilityCache()
@@ -1,13 +1,41 @@
+import re
 import json
+import time
 import random
 import inspect
+import threading
 from loguru import logger
 from copy import deepcopy
-from typing import Any, Dict, List, Union, Optional, Callable
-from openai import OpenAI, Stream
+from typing import Any, Dict, Generator, Iterable, Iterator, List, Tuple, Union, Optional, Callable
+from openai import Stream, BadRequestError, UnprocessableEntityError
 from openai.types.chat.chat_completion import ChatCompletion
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 
 from utils.chat.prompts import TOOL_USE_PROMPT
+from utils.log.logger_config import clip
+from utils.metrics.metrics import metrics
+from utils.chat.clients import get_client
+from utils.tools.capabilities import tool_capability_cache
+from utils.chat.cache import replay_as_stream
+
+
+# 单个工具的超时时间（秒），从工具开始执行时计算
+TOOL_TIMEOUT = 30.0
+
+# 接口因为不支持工具而拒绝请求时的错误信息，例如 Ollama 的 "... does not support tools"、
+# vLLM 的 "auto" tool choice requires --enable-auto-tool-choice
+_TOOLS_UNSUPPORTED = re.compile(
+    r"does not support (?:tools|tool|function)|tools? (?:are|is) not supported|"
+    r"(?:tool|function)[ _](?:calling|use|choice)s? (?:is )?not supported|enable-auto-tool-choice|"
+    r"unrecognized (?:request argument|parameter)s?[^.]*\btools?\b",
+    re.I,
+)
+
+
+def tools_unsupported(error: Exception) -> bool:
+    """错误是否说明模型或接口不支持工具调用；上下文超长、消息格式错误等其他 400 错误不算"""
+    body = getattr(error, "body", None)
+    return bool(_TOOLS_UNSUPPORTED.search(f"{error} {json.dumps(body, ensure_ascii=False, default=str)}"))
 
 
 def function_to_json(func: Callable[..., Any]) -> str:
@@ -83,15 +111,14 @@ class ToolsParameterOutputParser:
 
     def _parse_stream_to_json(self, stream_output: Stream) -> List[Dict[str, Any]]:
         """将流式输出转换为字典格式的JSON字符串列表"""
-        chunks = list(stream_output)
-        stream2str = ''.join(chunk.choices[0].delta.content for chunk in chunks if chunk.choices and chunk.choices[0].delta.content is not None)
-        logger.debug(stream2str)
-        
-        params =  [json.loads(param) for param in stream2str.split('\n') if param]
-        # 给每个参数添加一个id字段
-        # 创建一个可以生成唯一ID的生成器，格式为"call_{id}",id为8位随机数字和字符的组合
-        
-        return [{'name': param['name'], 'parameters': param['parameters'], 'tool_call_id': self._generate_unique_id()} for param in params]
+        stream_parser = StreamingToolCallParser(self._generate_unique_id)
+        params = []
+        for chunk in stream_output:
+            params.extend(stream_parser.feed(chunk))
+        params.extend(stream_parser.finish())
+        if stream_parser.is_plain_text:
+            raise ValueError(f"Stream does not contain tool calls: {stream_parser.content[:100]}")
+        return params
 
     def parse_tools_to_json(self, output: ChatCompletion) -> List[Dict[str, Any]]:
         """
@@ -106,6 +133,242 @@ class ToolsParameterOutputParser:
         return [{'name': param.name, 'parameters': json.loads(param.arguments), 'tool_call_id': tool_call_ids[params.index(param)]} for param in params]
 
 
+class StreamingToolCallParser:
+    """
+    增量解析流式输出中的工具调用。支持两种格式：
+    OpenAI 的 delta.tool_calls 片段，以及在 content 中逐行输出的 JSON（{"name": ..., "parameters": ...}）。
+    每当一个工具调用的参数成为完整的 JSON 时立即返回，调用方可以马上开始执行该工具。
+    """
+
+    def __init__(self, id_factory: Callable[[], str]):
+        """
+        :param id_factory: 为没有 id 的工具调用生成唯一 id
+        """
+        self._id_factory = id_factory
+        # delta.tool_calls 格式：index -> {"id", "name", "arguments"}
+        self._pending_calls: Dict[int, Dict[str, Any]] = {}
+        self._emitted: set = set()
+        # content 格式
+        self._content_parts: List[str] = []
+        self._line_buffer = ""
+        self.is_plain_text = False
+
+    @property
+    def content(self) -> str:
+        """流中的全部文本内容"""
+        return "".join(self._content_parts)
+
+    def feed(self, chunk: ChatCompletionChunk) -> List[Dict[str, Any]]:
+        """
+        处理一个 chunk。
+
+        :return: 本次 chunk 之后参数变为完整的工具调用列表
+        """
+        if not chunk.choices:
+            return []
+        delta = chunk.choices[0].delta
+        completed = []
+        for tool_call in delta.tool_calls or []:
+            call = self._pending_calls.setdefault(tool_call.index, {"id": None, "name": "", "arguments": ""})
+            if tool_call.id:
+                call["id"] = tool_call.id
+            if tool_call.function is not None:
+                if tool_call.function.name:
+                    call["name"] += tool_call.function.name
+                if tool_call.function.arguments:
+                    call["arguments"] += tool_call.function.arguments
+            # 参数以 } 结尾时才尝试解析，避免对每个片段都做一次 json.loads
+            if call["arguments"].rstrip().endswith("}"):
+                parsed = self._try_emit(tool_call.index)
+                if parsed is not None:
+                    completed.append(parsed)
+        if delta.content:
+            self._content_parts.append(delta.content)
+            if not self.is_plain_text:
+                self._line_buffer += delta.content
+                *lines, self._line_buffer = self._line_buffer.split("\n")
+                completed.extend(self._parse_lines(lines))
+                # 工具调用的每一行都以 { 开头，不必等到换行就能判断模型在直接回答
+                head = self._line_buffer.lstrip()
+                if head and not head.startswith("{"):
+                    self.is_plain_text = True
+        return completed
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """流结束后，返回剩余尚未返回的工具调用"""
+        completed = []
+        for index in sorted(self._pending_calls):
+            parsed = self._try_emit(index)
+            if parsed is not None:
+                completed.append(parsed)
+            elif index not in self._emitted:
+                logger.error(f"Incomplete tool call arguments: {self._pending_calls[index]}")
+        if not self.is_plain_text and self._line_buffer:
+            completed.extend(self._parse_lines([self._line_buffer]))
+            self._line_buffer = ""
+        return completed
+
+    def _try_emit(self, index: int) -> Optional[Dict[str, Any]]:
+        if index in self._emitted:
+            return None
+        call = self._pending_calls[index]
+        try:
+            parameters = json.loads(call["arguments"]) if call["arguments"].strip() else {}
+        except ValueError:
+            return None
+        self._emitted.add(index)
+        return {'name': call["name"], 'parameters': parameters, 'tool_call_id': call["id"] or self._id_factory()}
+
+    def _parse_lines(self, lines: List[str]) -> List[Dict[str, Any]]:
+        completed = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                param = json.loads(line)
+            except ValueError:
+                param = None
+            if not isinstance(param, dict) or 'name' not in param or 'parameters' not in param:
+                # 不是工具调用格式，说明模型直接给出了回答
+                self.is_plain_text = True
+                return completed
+            completed.append({'name': param['name'], 'parameters': param['parameters'], 'tool_call_id': self._id_factory()})
+        return completed
+
+
+class _ToolCall:
+    """
+    One tool call on its own daemon thread, so a tool that hangs (e.g. a scraper on a dead host) never holds
+    up the others. The timeout counts from when the call starts running, not from when it was dispatched.
+    """
+
+    def __init__(self, func: Callable[..., Any], parameters: Dict[str, Any], name: str):
+        self.started_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+        self._started = threading.Event()
+        self._done = threading.Event()
+        threading.Thread(target=self._run, args=(func, parameters), name=f"tool-{name}", daemon=True).start()
+
+    def _run(self, func: Callable[..., Any], parameters: Dict[str, Any]) -> None:
+        self.started_at = time.monotonic()
+        self._started.set()
+        try:
+            self.result = func(**parameters)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def wait(self, timeout: float) -> bool:
+        """等待工具执行完毕，返回是否在超时前完成"""
+        self._started.wait()
+        return self._done.wait(max(0.0, self.started_at + timeout - time.monotonic()))
+
+
+def _submit_tool_call(param: Dict[str, Any], function_map: Dict[str, Callable[..., Any]]) -> Optional[_ToolCall]:
+    """开始执行一个工具调用；工具不存在时返回 None"""
+    func = function_map.get(param['name'])
+    if func is None:
+        return None
+    return _ToolCall(func, param['parameters'], param['name'])
+
+
+def _collect_tool_results(
+        parsed_params: List[Dict[str, Any]],
+        calls: List[Optional[_ToolCall]],
+        timeout: float,
+    ) -> List[str]:
+    results = []
+    for param, call in zip(parsed_params, calls):
+        if call is None:
+            logger.warning(f"Unknown tool: {param['name']}")
+            results.append(f"Error: tool {param['name']} does not exist.")
+        elif not call.wait(timeout):
+            # 线程无法被强行终止，超时的工具在后台继续运行，结果被丢弃
+            logger.warning(f"Tool {param['name']} timed out after {timeout}s")
+            results.append(f"Error: tool {param['name']} timed out after {timeout} seconds.")
+        elif call.error is not None:
+            logger.warning(f"Tool {param['name']} failed: {call.error}")
+            results.append(f"Error: tool {param['name']} failed: {call.error}")
+        else:
+            results.append(str(call.result))
+    return results
+
+
+def run_tool_calls(
+        parsed_params: List[Dict[str, Any]],
+        function_map: Dict[str, Callable[..., Any]],
+        timeout: float = TOOL_TIMEOUT,
+    ) -> List[str]:
+    """
+    并发执行所有工具调用，结果按调用顺序返回。超时或抛出异常的工具返回错误信息，不影响其他工具。
+
+    :param parsed_params: 解析后的工具调用参数列表
+    :param function_map: 函数映射，根据工具名称映射到本地函数
+    :param timeout: 单个工具的超时时间（秒），从工具开始执行时计算
+    :return: 与 parsed_params 一一对应的结果列表
+    """
+    calls = [_submit_tool_call(param, function_map) for param in parsed_params]
+    return _collect_tool_results(parsed_params, calls, timeout)
+
+
+def run_streamed_tool_calls(
+        stream_output: Iterable[ChatCompletionChunk],
+        function_map: Dict[str, Callable[..., Any]],
+        timeout: float = TOOL_TIMEOUT,
+    ) -> Tuple[List[Dict[str, Any]], List[str], str]:
+    """
+    边读取流式输出边执行工具：每个工具调用的参数一旦完整就立即提交执行，使工具耗时与模型解码重叠。
+
+    :param stream_output: 带工具调用的流式输出
+    :param function_map: 函数映射，根据工具名称映射到本地函数
+    :param timeout: 单个工具的超时时间（秒）
+    :return: (工具调用参数列表, 与之对应的结果列表, 流中的文本内容)
+    """
+    stream_parser = StreamingToolCallParser(ToolsParameterOutputParser()._generate_unique_id)
+    parsed_params, calls = [], []
+    for chunk in stream_output:
+        for param in stream_parser.feed(chunk):
+            logger.debug(f"Dispatching tool call while streaming: {param}")
+            parsed_params.append(param)
+            calls.append(_submit_tool_call(param, function_map))
+    for param in stream_parser.finish():
+        parsed_params.append(param)
+        calls.append(_submit_tool_call(param, function_map))
+    return parsed_params, _collect_tool_results(parsed_params, calls, timeout), stream_parser.content
+
+
+def read_until_decided(stream_output: Iterator[ChatCompletionChunk]) -> Tuple[List[ChatCompletionChunk], bool]:
+    """
+    读取流式输出的开头，直到能判断模型是在调用工具还是直接回答。
+
+    :param stream_output: 带工具调用的流式输出，剩余部分仍可继续读取
+    :return: (已读取的 chunk, 是否为直接回答)
+    """
+    probe = StreamingToolCallParser(lambda: "")
+    head = []
+    for chunk in stream_output:
+        head.append(chunk)
+        if chunk.choices and chunk.choices[0].delta.tool_calls:
+            return head, False
+        if probe.feed(chunk):
+            return head, False
+        if probe.is_plain_text:
+            return head, True
+    return head, not probe.finish()
+
+
+def _pass_through(head: List[ChatCompletionChunk], stream_output: Iterable[ChatCompletionChunk]) -> Generator:
+    """先输出已读取的 chunk，再透传剩余的流式输出"""
+    try:
+        yield from head
+        yield from stream_output
+    finally:
+        if hasattr(stream_output, "close"):
+            stream_output.close()
+
+
 def create_tools_call_completion(
         messages: List[Dict[str, Any]], 
         tools: Optional[List[Dict[str, Any]]] = None, 
@@ -122,14 +385,17 @@ def create_tools_call_completion(
     :param messages: 消息列表
     :param tools: 工具列表
     :param function_map: 函数映射，根据工具名称映射到本地函数
-    :return: 包含工具调用参数的一轮完整对话
+    :return: 包含工具调用参数的一轮完整对话；stream 为 True 时返回流式 chunk 的可迭代对象
     """
     parser = ToolsParameterOutputParser()
 
-    client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+    client = get_client(base_url=base_url, api_key=api_key)
+
+    # 已知不支持工具调用的模型，直接提问，省去一次必然失败的请求
+    supports_tools = tool_capability_cache.get(base_url, model)
+    if supports_tools is False:
+        logger.info(f"{model} does not support tools, use default chat mode directly")
+        return client.chat.completions.create(model=model, messages=messages, stream=stream)
 
     try:
         # 第一步， 调用模型生成工具调用参数
@@ -139,39 +405,85 @@ def create_tools_call_completion(
         messages_copy.insert(0, {"role":"system", "content":TOOL_USE_PROMPT})
         logger.info("Trying to use tools")
         # logger.debug(f"messages input: {messages_copy}")
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-            temperature=0
-            # stream=stream
-        )
-        parsed_params = parser(response)
-        logger.debug(parsed_params)
-        # 添加工具调用参数到消息列表
-        messages.append(response.choices[0].message.dict(exclude_unset=True))
-
-        # 第二步， 根据工具调用参数，本地运行工具，并返回结果
-        function_results = [function_map[param['name']](**param['parameters']) for param in parsed_params]
+        try:
+            with metrics.timer("tool_first_completion_seconds"):
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    tools=tools,
+                    tool_choice="auto",
+                    temperature=0,
+                    stream=stream
+                )
+        except (BadRequestError, UnprocessableEntityError) as e:
+            # 接口明确表示不支持 tools 时记录下来，之后不再探测；其他错误不影响判断
+            if supports_tools is None and tools_unsupported(e):
+                tool_capability_cache.set(base_url, model, False)
+            raise
+        if supports_tools is None:
+            tool_capability_cache.set(base_url, model, True)
+
+        if stream:
+            # 模型没有调用任何工具时，第一次的回复就是最终回复，边生成边输出，无需再请求一次
+            head, plain_text = read_until_decided(response)
+            if plain_text:
+                logger.info("No tool calls requested, streaming the first response directly")
+                return _pass_through(head, response)
+            # 流式输出时，每个工具调用的参数一旦完整就开始执行，与模型后续的解码并行
+            with metrics.timer("tool_stream_and_execution_seconds"):
+                parsed_params, function_results, content = run_streamed_tool_calls(
+                    _pass_through(head, response), function_map
+                )
+            if not parsed_params:
+                logger.info("No complete tool calls in the response, returning its text directly")
+                return replay_as_stream(content, model)
+            logger.debug(parsed_params)
+            # 添加工具调用参数到消息列表
+            messages.append({
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": param['tool_call_id'],
+                        "type": "function",
+                        "function": {"name": param['name'], "arguments": json.dumps(param['parameters'], ensure_ascii=False)},
+                    }
+                    for param in parsed_params
+                ],
+            })
+        else:
+            # 模型没有调用任何工具时，第一次的回复就是最终回复，无需再请求一次
+            if not response.choices[0].message.tool_calls:
+                logger.info("No tool calls requested, returning the first response directly")
+                return response
+
+            parsed_params = parser(response)
+            logger.debug(parsed_params)
+            # 添加工具调用参数到消息列表
+            messages.append(response.choices[0].message.dict(exclude_unset=True))
+
+            # 第二步， 根据工具调用参数，本地运行工具，并返回结果
+            with metrics.timer("tool_execution_seconds"):
+                function_results = run_tool_calls(parsed_params, function_map)
         # 添加所有工具调用结果到消息列表
-        for result in function_results:
+        for param, result in zip(parsed_params, function_results):
             messages.append({
                 "role":"tool",
-                "name": parsed_params[function_results.index(result)]['name'],
+                "name": param['name'],
                 "content":result,
-                "tool_call_id":parsed_params[function_results.index(result)]['tool_call_id']
+                "tool_call_id":param['tool_call_id']
             })
         
         # 第三步， 调用模型生成最终的回复
-        logger.debug(f"final messages input: {messages}")
-        final_response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-            stream=stream
-        )
+        logger.opt(lazy=True).debug("final messages input: {}", lambda: clip(messages))
+        with metrics.timer("tool_final_completion_seconds"):
+            final_response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+                stream=stream
+            )
         # messages.append(dict(final_response.choices[0].message))
         return final_response
     
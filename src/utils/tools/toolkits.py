@@ -1,5 +1,5 @@
-from typing import Annotated, Literal, Dict, Callable, Union
-from trafilatura import fetch_url, extract
+from functools import lru_cache
+from typing import Annotated, Literal, Dict, Callable, List, Union
 from utils.tools.tool_utils import function_to_json
 from utils.log.logger_config import setup_logger
 from loguru import logger
@@ -84,6 +84,8 @@ def tool_calculator(expression:str) -> str:
 
 def tool_web_scraper(url: str) -> str:
     '''Useful to scrape web pages, and extract text content.'''
+    # trafilatura 依赖 lxml 等较重的库，只在工具实际运行时导入
+    from trafilatura import fetch_url, extract
     return extract(fetch_url(url),url=url,include_links=True)
 
 # 自动将所有整个py文件里的tool添加到to_tools字典中
@@ -97,7 +99,17 @@ TO_TOOLS: Dict[str, Dict[str, Union[Callable, str]]] = {
     if callable(tool) and hasattr(tool, "__name__") and tool.__name__.startswith("tool_")
 }
 
-TOOLS_LIST = [json.loads(function_to_json(tool["func"])) for tool in TO_TOOLS.values()]
+@lru_cache(maxsize=None)
+def get_tools_list() -> List[Dict]:
+    """首次调用工具时才生成所有工具的 JSON Schema"""
+    return [json.loads(function_to_json(tool["func"])) for tool in TO_TOOLS.values()]
+
+
+def __getattr__(name: str):
+    # 兼容 `from utils.tools.toolkits import TOOLS_LIST`
+    if name == "TOOLS_LIST":
+        return get_tools_list()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 TOOLS_MAP = {
     tool["name"]: tool["func"]
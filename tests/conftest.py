@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+@pytest.fixture(autouse=True)
+def _workdir(tmp_path, monkeypatch):
+    # logger_config 和响应缓存会在当前目录下创建 log/cache 文件夹
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def fake_server():
+    from fake_server import FakeOpenAIServer, FakeServerConfig
+
+    server = FakeOpenAIServer(FakeServerConfig(ttft=0.05, token_delay=0.01, output_tokens=32)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def llm(fake_server):
+    from utils.chat.cache import ResponseCache
+    from utils.chat.llm import DEFAULT_CONFIG, LLM
+
+    config = {**DEFAULT_CONFIG[0], "base_url": fake_server.base_url}
+    model = LLM(config_list=[config], cache=ResponseCache(path=None))
+    # 订阅者离开后立即取消上游，不等待宽限期
+    model.in_flight.grace = 0.0
+    return model
+
+
+def wait_until(predicate, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
@@ -0,0 +1,27 @@
+from utils.chat.chunking import split_text
+
+
+def _paragraph(index: int) -> str:
+    return " ".join(f"Paragraph {index} sentence {n} states a fact about the topic." for n in range(10))
+
+
+def test_adjacent_chunks_share_text():
+    text = "\n\n".join(_paragraph(index) for index in range(8))
+
+    chunks = split_text(text, chunk_size=1200, overlap=300)
+
+    assert len(chunks) > 2
+    for previous, current in zip(chunks, chunks[1:]):
+        assert len(current) <= 1200
+        head = current[:100]
+        assert head in previous
+
+
+def test_overlap_falls_back_to_characters_without_sentence_breaks():
+    text = "\n\n".join(" ".join(f"w{index}x{n}" for n in range(150)) for index in range(3))
+
+    chunks = split_text(text, chunk_size=1100, overlap=50)
+
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current[:20] in previous
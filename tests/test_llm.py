@@ -0,0 +1,55 @@
+from conftest import wait_until
+from utils.chat.streaming import CancellationToken
+
+
+def in_flight(llm) -> int:
+    return sum(endpoint.in_flight for endpoint in llm.router.endpoints)
+
+
+def test_stream_cancelled_before_iteration_releases_endpoint(llm):
+    token = CancellationToken()
+    stream = llm.generate("Hello there", cancel_token=token)
+    assert in_flight(llm) == 1
+
+    token.cancel()
+
+    assert wait_until(lambda: in_flight(llm) == 0)
+    assert wait_until(lambda: llm.scheduler.running == 0)
+    assert llm.in_flight.stats()["all"]["in_flight"] == 0
+    del stream
+
+
+def test_stream_read_to_the_end_releases_endpoint(llm):
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in llm.generate("Hello there") if chunk.choices)
+
+    assert text
+    assert in_flight(llm) == 0
+    assert llm.scheduler.running == 0
+
+
+def test_dropped_stream_releases_everything(llm):
+    import gc
+
+    stream = llm.generate("Hello there")
+    assert in_flight(llm) == 1
+
+    del stream
+    gc.collect()
+
+    assert wait_until(lambda: in_flight(llm) == 0)
+    assert wait_until(lambda: llm.scheduler.running == 0)
+    assert llm.in_flight.stats()["all"]["in_flight"] == 0
+
+
+def test_warm_up_skips_endpoints_that_are_serving(llm, fake_server):
+    assert list(llm.warm_up()) == [llm.router.endpoints[0].name]
+    assert fake_server.requests == 1
+
+    stream = llm.generate("Hello there")
+    assert llm.warm_up() == {}
+    assert fake_server.requests == 2
+    assert in_flight(llm) == 1
+
+    list(stream)
+    assert in_flight(llm) == 0
+    assert llm.scheduler.running == 0
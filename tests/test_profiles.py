@@ -0,0 +1,41 @@
+from utils.chat.cache import make_chunk
+from utils.chat.profiles import GenerationProfile, list_complete, trailing_note
+
+
+def _stream(pieces):
+    return [make_chunk(piece, "m") for piece in pieces]
+
+
+def _text(chunks):
+    return "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices)
+
+
+def test_keyword_list_stops_at_the_blank_line():
+    profile = GenerationProfile("keywords", complete_at=list_complete)
+    pieces = ["Keywords:\n", "- alpha\n", "- beta\n", "\n", "These keywords were chosen because ..."]
+
+    assert _text(profile.apply_early_stop(_stream(pieces), "m")) == "Keywords:\n- alpha\n- beta\n"
+
+
+def test_trailing_note_split_across_chunks_is_cut():
+    profile = GenerationProfile("rewrite", complete_at=trailing_note)
+    pieces = ["A rewritten sentence.", "\n", "\n**No", "te**", ": I changed ..."]
+
+    text = _text(profile.apply_early_stop(_stream(pieces), "m"))
+
+    assert text.startswith("A rewritten sentence.")
+    assert "I changed" not in text
+
+
+def test_check_runs_only_near_paragraph_breaks():
+    calls = []
+
+    def complete_at(text):
+        calls.append(len(text))
+        return None
+
+    profile = GenerationProfile("rewrite", complete_at=complete_at)
+    pieces = ["word "] * 2000 + ["\n\n"] + ["word "] * 2000
+
+    assert len(list(profile.apply_early_stop(_stream(pieces), "m"))) == 4001
+    assert len(calls) <= 1 + 32 // len("word ") + 1
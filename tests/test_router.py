@@ -0,0 +1,39 @@
+import threading
+import time
+
+from utils.chat.router import EndpointRouter
+from utils.chat.streaming import CancellationToken
+
+
+def _router(max_concurrency: int = 1) -> EndpointRouter:
+    return EndpointRouter([{"model": "m", "base_url": "http://a/v1", "max_concurrency": max_concurrency}])
+
+
+def test_acquire_does_not_exceed_max_concurrency():
+    router = _router()
+    endpoint = router.acquire()
+
+    assert router.acquire(timeout=0) is None
+    assert endpoint.in_flight == 1
+
+
+def test_acquire_waits_for_a_release():
+    router = _router()
+    endpoint = router.acquire()
+    threading.Timer(0.1, router.release, args=(endpoint,)).start()
+
+    start = time.monotonic()
+    assert router.acquire(timeout=2) is endpoint
+    assert time.monotonic() - start >= 0.05
+    assert endpoint.in_flight == 1
+
+
+def test_cancelling_stops_the_wait():
+    router = _router()
+    router.acquire()
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+
+    start = time.monotonic()
+    assert router.acquire(timeout=5, cancel_token=token) is None
+    assert time.monotonic() - start < 2
@@ -0,0 +1,14 @@
+from utils.chat.scheduler import RequestScheduler
+
+
+def test_try_acquire_never_exceeds_capacity():
+    scheduler = RequestScheduler(lambda: 2)
+    first = scheduler.acquire()
+
+    second = scheduler.try_acquire()
+    assert second is not None
+    assert scheduler.try_acquire() is None
+
+    second.release()
+    first.release()
+    assert scheduler.running == 0
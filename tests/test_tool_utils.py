@@ -0,0 +1,46 @@
+from utils.chat.cache import make_chunk
+from utils.tools import tool_utils
+
+
+class _FakeCompletions:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def create(self, **kwargs):
+        return self._stream
+
+
+class _FakeClient:
+    def __init__(self, stream):
+        self.chat = type("Chat", (), {"completions": _FakeCompletions(stream)})()
+
+
+def test_plain_answer_streams_before_the_response_ends(monkeypatch):
+    read = []
+
+    def stream():
+        for word in ["The ", "answer ", "is ", "forty ", "two."]:
+            read.append(word)
+            yield make_chunk(word, "m")
+
+    monkeypatch.setattr(tool_utils, "get_client", lambda **kwargs: _FakeClient(stream()))
+    monkeypatch.setattr(tool_utils.tool_capability_cache, "get", lambda *args: True)
+
+    result = tool_utils.create_tools_call_completion(
+        [{"role": "user", "content": "?"}], tools=[], function_map={}, stream=True
+    )
+    first = next(iter(result))
+
+    assert first.choices[0].delta.content == "The "
+    assert len(read) == 1
+    assert "".join(chunk.choices[0].delta.content for chunk in result) == "answer is forty two."
+
+
+def test_json_tool_call_line_is_not_plain_text():
+    parser = tool_utils.StreamingToolCallParser(lambda: "call_1")
+
+    assert parser.feed(make_chunk('  {"name": "tool_calculator", ', "m")) == []
+    assert not parser.is_plain_text
+    calls = parser.feed(make_chunk('"parameters": {"expression": "1+1"}}\n', "m"))
+
+    assert calls == [{"name": "tool_calculator", "parameters": {"expression": "1+1"}, "tool_call_id": "call_1"}]